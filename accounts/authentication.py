@@ -0,0 +1,148 @@
+"""
+JWT authentication that caches the users it resolves.
+
+The stock JWTAuthentication loads the User row on every API request, and
+UserSerializer then loads the profile and support profile on top. Here the
+user is loaded once with both profiles and kept in a size-bounded,
+short-TTL LRU per process (plus, optionally, the shared Django cache).
+Entries are dropped when the user or one of their profiles changes (see
+signals.py and stats.py); other processes' LRUs catch up within the TTL.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+JWT_USER_CACHE_TTL = getattr(settings, 'JWT_USER_CACHE_TTL', 30)
+JWT_USER_CACHE_SIZE = getattr(settings, 'JWT_USER_CACHE_SIZE', 1024)
+JWT_USER_CACHE_SHARED = getattr(settings, 'JWT_USER_CACHE_SHARED', False)
+
+
+class UserCache:
+    """Thread-safe LRU of users with a TTL, optionally backed by the shared Django cache."""
+
+    def __init__(self, ttl, max_size, shared=False):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.shared = shared
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def shared_key(user_id):
+        return f'jwt_user:{user_id}'
+
+    def get(self, user_id):
+        """Return a private copy of the cached user, or None."""
+        user_id = str(user_id)
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is not None:
+                expires, user = entry
+                if expires > time.monotonic():
+                    self.entries.move_to_end(user_id)
+                else:
+                    del self.entries[user_id]
+                    user = None
+            else:
+                user = None
+
+        if user is None and self.shared:
+            user = cache.get(self.shared_key(user_id))
+            if user is not None:
+                self.store(user_id, user)
+
+        # Requests may modify request.user, so never hand out the cached instance itself
+        return copy.deepcopy(user) if user is not None else None
+
+    def set(self, user_id, user):
+        user = copy.deepcopy(user)
+        self.store(str(user_id), user)
+        if self.shared:
+            cache.set(self.shared_key(user_id), user, self.ttl)
+
+    def store(self, user_id, user):
+        with self.lock:
+            self.entries[user_id] = (time.monotonic() + self.ttl, user)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.entries.pop(str(user_id), None)
+        if self.shared:
+            cache.delete(self.shared_key(user_id))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+user_cache = UserCache(JWT_USER_CACHE_TTL, JWT_USER_CACHE_SIZE, JWT_USER_CACHE_SHARED)
+
+
+class CachingJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that resolves the token's user through `user_cache`."""
+
+    def get_user(self, validated_token):
+        user_id = self.get_user_id(validated_token)
+        user = user_cache.get(user_id)
+        if user is None:
+            try:
+                user = self.get_user_queryset().get(**{api_settings.USER_ID_FIELD: user_id})
+            except self.user_model.DoesNotExist:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+            user_cache.set(user_id, user)
+        return self.check_user(user, validated_token)
+
+    async def aget_user(self, validated_token):
+        """get_user() for async views; a cache miss loads the user through the async ORM."""
+        user_id = self.get_user_id(validated_token)
+        user = user_cache.get(user_id)
+        if user is None:
+            try:
+                user = await self.get_user_queryset().aget(**{api_settings.USER_ID_FIELD: user_id})
+            except self.user_model.DoesNotExist:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+            user_cache.set(user_id, user)
+        return self.check_user(user, validated_token)
+
+    async def aauthenticate(self, request):
+        """authenticate() for async views: returns (user, token) or None."""
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+
+    def get_user_id(self, validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+    def get_user_queryset(self):
+        # Load the profiles UserSerializer renders in the same query
+        return self.user_model.objects.select_related('profile', 'support_profile')
+
+    def check_user(self, user, validated_token):
+        # Same checks as JWTAuthentication, applied to cached users too
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return user
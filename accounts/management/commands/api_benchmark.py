@@ -0,0 +1,69 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from rest_framework.views import APIView
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+
+from accounts.authentication import CachingJWTAuthentication, user_cache
+from accounts.models import SupportProfile, User
+from tickets.models import Ticket
+
+AUTH_CLASSES = (
+    ('stock', JWTAuthentication),
+    ('caching', CachingJWTAuthentication),
+)
+
+
+class Command(BaseCommand):
+    help = 'Compare API requests per second with the stock and the caching JWT authentication'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Requests per endpoint and auth class')
+        parser.add_argument('--paths', default='/api/auth/profile/,/api/tickets/',
+                            help='Comma separated API paths to request')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1:
+            raise CommandError('--requests must be positive')
+
+        # Everything runs in one transaction that is rolled back, so the benchmark user leaves no trace
+        with transaction.atomic():
+            user = User.objects.create_user(email='api-benchmark@localhost', password=None, first_name='API',
+                                            last_name='Benchmark', user_type='support')
+            SupportProfile.objects.get_or_create(user=user)
+            Ticket.objects.bulk_create([
+                Ticket(title=f'Benchmark ticket {i}', description='Benchmark', created_by=user, assigned_to=user)
+                for i in range(20)
+            ])
+            client = Client(HTTP_HOST='localhost', HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+
+            original = APIView.authentication_classes
+            try:
+                for name, auth_class in AUTH_CLASSES:
+                    # Views without their own authentication_classes pick this up
+                    APIView.authentication_classes = [auth_class]
+                    user_cache.clear()
+                    for path in options['paths'].split(','):
+                        self.report(name, path, *self.measure(client, path, options['requests']))
+            finally:
+                APIView.authentication_classes = original
+                user_cache.clear()
+                transaction.set_rollback(True)
+
+    def measure(self, client, path, requests):
+        response = client.get(path)
+        if response.status_code != 200:
+            raise CommandError(f'{path} returned {response.status_code}')
+
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            for _ in range(requests):
+                client.get(path)
+            elapsed = time.perf_counter() - started
+        return requests / elapsed, len(queries) / requests
+
+    def report(self, name, path, rps, queries):
+        self.stdout.write(f'{name:>8}  {path:<24} {rps:8.1f} req/s  {queries:5.1f} queries/request')
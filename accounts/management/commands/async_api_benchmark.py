@@ -0,0 +1,132 @@
+import asyncio
+import threading
+import time
+from urllib.parse import urlsplit
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import AccessToken
+
+from accounts.authentication import user_cache
+from accounts.models import SupportProfile, User
+from chat.models import Message
+from support_system import async_api
+from tickets.models import Ticket
+
+MODES = (
+    ('sync', False),
+    ('async', True),
+)
+
+
+class Command(BaseCommand):
+    help = ('Compare concurrent throughput and thread usage of the sync DRF views and the async views '
+            'of the hot API GET endpoints, through the ASGI application')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Requests per endpoint and mode')
+        parser.add_argument('--concurrency', type=int, default=50, help='Requests in flight at once')
+        parser.add_argument('--paths', default='/api/auth/profile/,/api/tickets/,/api/tickets/{ticket}/,'
+                                               '/api/tickets/{ticket}/messages/',
+                            help='Comma separated API paths; {ticket} is replaced by a benchmark ticket id')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--requests and --concurrency must be positive')
+
+        # The async ORM queries from other threads, so the data is committed and deleted afterwards
+        user = User.objects.create_user(email='async-benchmark@localhost', password=None, first_name='Async',
+                                        last_name='Benchmark', user_type='support')
+        try:
+            SupportProfile.objects.get_or_create(user=user)
+            tickets = Ticket.objects.bulk_create([
+                Ticket(title=f'Benchmark ticket {i}', description='Benchmark', created_by=user, assigned_to=user)
+                for i in range(20)
+            ])
+            Message.objects.bulk_create([
+                Message(ticket=tickets[0], sender=user, content=f'Benchmark message {i}') for i in range(50)
+            ])
+            token = str(AccessToken.for_user(user))
+            paths = [path.format(ticket=tickets[0].id) for path in options['paths'].split(',')]
+
+            from support_system.asgi import application
+            original = async_api.ASYNC_API_VIEWS
+            try:
+                for name, enabled in MODES:
+                    async_api.ASYNC_API_VIEWS = enabled
+                    user_cache.clear()
+                    for path in paths:
+                        result = asyncio.run(self.measure(application, path, token, options))
+                        self.report(name, path, *result)
+            finally:
+                async_api.ASYNC_API_VIEWS = original
+                user_cache.clear()
+        finally:
+            user.delete()
+
+    async def measure(self, application, path, token, options):
+        status = await self.get(application, path, token)
+        if status != 200:
+            raise CommandError(f'{path} returned {status}')
+
+        peak_threads = threading.active_count()
+        threads_before = {thread.ident for thread in threading.enumerate()}
+        threads_seen = set()
+        running = True
+
+        async def sample_threads():
+            nonlocal peak_threads
+            while running:
+                peak_threads = max(peak_threads, threading.active_count())
+                threads_seen.update(thread.ident for thread in threading.enumerate())
+                await asyncio.sleep(0.005)
+
+        semaphore = asyncio.Semaphore(options['concurrency'])
+
+        async def one_request():
+            async with semaphore:
+                await self.get(application, path, token)
+
+        sampler = asyncio.create_task(sample_threads())
+        started = time.perf_counter()
+        await asyncio.gather(*(one_request() for _ in range(options['requests'])))
+        elapsed = time.perf_counter() - started
+        running = False
+        await sampler
+        return options['requests'] / elapsed, peak_threads, len(threads_seen - threads_before)
+
+    async def get(self, application, path, token):
+        """One GET through the ASGI application; returns the status code."""
+        url = urlsplit(path)
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': url.path,
+            'raw_path': url.path.encode(),
+            'query_string': url.query.encode(),
+            'root_path': '',
+            'headers': [(b'host', b'localhost'), (b'authorization', f'Bearer {token}'.encode())],
+            'client': ('127.0.0.1', 0),
+            'server': ('localhost', 80),
+        }
+        response = {}
+        body_sent = asyncio.Event()
+
+        async def receive():
+            if not body_sent.is_set():
+                body_sent.set()
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            # Nothing else arrives until the client disconnects
+            await asyncio.Event().wait()
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+
+        await application(scope, receive, send)
+        return response['status']
+
+    def report(self, name, path, rps, peak_threads, new_threads):
+        self.stdout.write(f'{name:>6}  {path:<28} {rps:8.1f} req/s  peak {peak_threads:3d} threads  '
+                          f'{new_threads:3d} started')
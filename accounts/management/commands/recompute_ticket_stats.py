@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from accounts.models import User, UserProfile, SupportProfile
+from tickets.models import Ticket
+
+
+def ticket_count(filter_field, **filters):
+    """Correlated subquery counting tickets whose `filter_field` is the profile's user."""
+    tickets = (
+        Ticket.objects.filter(**{filter_field: OuterRef('user_id')}, **filters)
+        .order_by()
+        .values(filter_field)
+        .annotate(total=Count('id'))
+        .values('total')
+    )
+    return Coalesce(Subquery(tickets, output_field=IntegerField()), Value(0))
+
+
+class Command(BaseCommand):
+    help = 'Recompute UserProfile and SupportProfile ticket counters from the Ticket table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report drifted profiles without fixing them')
+
+    def handle(self, *args, **options):
+        counters = [
+            (UserProfile, 'tickets_submitted', ticket_count('created_by')),
+            (SupportProfile, 'tickets_assigned', ticket_count('assigned_to')),
+            # Same definition as accounts.stats: resolved_at is set while the status is one of RESOLVED_STATUSES
+            (SupportProfile, 'tickets_resolved', ticket_count('assigned_to', resolved_at__isnull=False)),
+        ]
+
+        with transaction.atomic():
+            if not options['dry_run']:
+                self.create_missing_profiles()
+
+            for model, field, expected in counters:
+                drifted = model.objects.annotate(expected=expected).filter(~Q(**{field: expected}))
+                count = drifted.count()
+                if count and not options['dry_run']:
+                    # One UPDATE per counter, only touching rows that drifted
+                    model.objects.filter(pk__in=drifted.values('pk')).update(**{field: expected})
+                self.stdout.write(f'{model.__name__}.{field}: {count} drifted')
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('Dry run, no counters were changed'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Ticket statistics recomputed'))
+
+    def create_missing_profiles(self):
+        missing_users = User.objects.filter(user_type='user', profile__isnull=True).values_list('id', flat=True)
+        missing_support = User.objects.filter(user_type='support', support_profile__isnull=True).values_list('id', flat=True)
+
+        UserProfile.objects.bulk_create([UserProfile(user_id=user_id) for user_id in missing_users])
+        SupportProfile.objects.bulk_create([SupportProfile(user_id=user_id) for user_id in missing_support])
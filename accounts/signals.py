@@ -0,0 +1,25 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .authentication import user_cache
+from .models import SupportProfile, User, UserProfile
+
+
+def invalidate_cached_user(user_id):
+    # After commit, so a concurrent request cannot re-cache the old row; a shared cache outage is only logged
+    transaction.on_commit(lambda: user_cache.invalidate(user_id), robust=True)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    invalidate_cached_user(instance.pk)
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+@receiver(post_save, sender=SupportProfile)
+@receiver(post_delete, sender=SupportProfile)
+def profile_changed(sender, instance, **kwargs):
+    # Cached users carry their profiles
+    invalidate_cached_user(instance.user_id)
@@ -0,0 +1,52 @@
+"""
+Ticket statistics kept on UserProfile and SupportProfile.
+
+All counters are updated with F() expressions so concurrent requests cannot
+lose increments, and each update only touches the counter column.
+"""
+from django.db import transaction
+from django.db.models import F
+
+from tickets.models import Ticket
+from .models import UserProfile, SupportProfile
+from .signals import invalidate_cached_user
+
+
+def _increment(model, user_id, field, delta=1):
+    if user_id is None:
+        return
+    profiles = model.objects.filter(user_id=user_id)
+    if delta < 0:
+        # Counters are unsigned; never let drift push them below zero
+        profiles = profiles.filter(**{f'{field}__gte': -delta})
+    if profiles.update(**{field: F(field) + delta}):
+        # QuerySet.update() sends no post_save, so drop the cached copy here
+        invalidate_cached_user(user_id)
+
+
+@transaction.atomic(savepoint=False)
+def ticket_created(ticket):
+    _increment(UserProfile, ticket.created_by_id, 'tickets_submitted')
+
+
+@transaction.atomic(savepoint=False)
+def ticket_assigned(old_assignee_id, new_assignee_id, resolved=False):
+    """Move an assignment; `resolved` is whether the ticket was resolved before this change."""
+    if old_assignee_id == new_assignee_id:
+        return
+    _increment(SupportProfile, old_assignee_id, 'tickets_assigned', -1)
+    _increment(SupportProfile, new_assignee_id, 'tickets_assigned')
+    if resolved:
+        # The resolution counts for whoever the ticket is assigned to, as in recompute_ticket_stats
+        _increment(SupportProfile, old_assignee_id, 'tickets_resolved', -1)
+        _increment(SupportProfile, new_assignee_id, 'tickets_resolved')
+
+
+@transaction.atomic(savepoint=False)
+def ticket_status_changed(ticket, old_status):
+    # A ticket counts as resolved while resolved_at is set (see Ticket.save): resolved -> closed
+    # changes nothing, and reopening takes the credit back so a second resolution is not counted twice
+    was_resolved = old_status in Ticket.RESOLVED_STATUSES
+    is_resolved = ticket.resolved_at is not None
+    if is_resolved != was_resolved:
+        _increment(SupportProfile, ticket.assigned_to_id, 'tickets_resolved', 1 if is_resolved else -1)
@@ -0,0 +1,87 @@
+from io import StringIO
+from django.core.management import call_command
+from rest_framework.test import APITestCase
+from accounts.models import SupportProfile, User, UserProfile
+from tickets.models import Ticket
+
+
+class TicketStatsTests(APITestCase):
+    """The live counters in accounts.stats agree with recompute_ticket_stats."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(email='admin@example.com', password='pass', first_name='Ada',
+                                             last_name='Admin', user_type='admin')
+        cls.customer = User.objects.create_user(email='customer@example.com', password='pass',
+                                                first_name='Customer', last_name='One', user_type='user')
+        UserProfile.objects.create(user=cls.customer)
+        cls.agents = []
+        for i in range(2):
+            agent = User.objects.create_user(email=f'agent{i}@example.com', password='pass', first_name='Agent',
+                                             last_name=str(i), user_type='support')
+            SupportProfile.objects.create(user=agent)
+            cls.agents.append(agent)
+
+    def setUp(self):
+        self.client.force_authenticate(self.admin)
+
+    def create_ticket(self):
+        self.client.force_authenticate(self.customer)
+        response = self.client.post('/api/tickets/', {'title': 'Printer', 'description': 'On fire'})
+        self.client.force_authenticate(self.admin)
+        return response.data['id']
+
+    def change_status(self, ticket_id, status):
+        response = self.client.post(f'/api/tickets/{ticket_id}/change_status/', {'status': status})
+        self.assertEqual(response.status_code, 200)
+
+    def assign(self, ticket_id, agent):
+        response = self.client.post(f'/api/tickets/{ticket_id}/assign/', {'support_user_id': agent.id})
+        self.assertEqual(response.status_code, 200)
+
+    def resolved_counts(self):
+        return [SupportProfile.objects.get(user=agent).tickets_resolved for agent in self.agents]
+
+    def assert_no_drift(self):
+        out = StringIO()
+        call_command('recompute_ticket_stats', '--dry-run', stdout=out)
+        for line in out.getvalue().splitlines():
+            if line.endswith('drifted'):
+                self.assertTrue(line.endswith(': 0 drifted'), line)
+
+    def test_reopen_and_resolve_again_counts_once(self):
+        ticket_id = self.create_ticket()
+        self.assign(ticket_id, self.agents[0])
+        self.change_status(ticket_id, 'resolved')
+        self.change_status(ticket_id, 'open')
+        self.assertEqual(self.resolved_counts(), [0, 0])
+        self.change_status(ticket_id, 'resolved')
+        self.change_status(ticket_id, 'closed')
+        self.assertEqual(self.resolved_counts(), [1, 0])
+        self.assert_no_drift()
+
+    def test_closing_directly_counts(self):
+        ticket_id = self.create_ticket()
+        self.assign(ticket_id, self.agents[0])
+        self.change_status(ticket_id, 'closed')
+        self.assertEqual(self.resolved_counts(), [1, 0])
+        self.assert_no_drift()
+
+    def test_reassigning_a_resolved_ticket_moves_the_credit(self):
+        ticket_id = self.create_ticket()
+        self.assign(ticket_id, self.agents[0])
+        self.change_status(ticket_id, 'resolved')
+        self.assign(ticket_id, self.agents[1])
+        self.assertEqual(self.resolved_counts(), [0, 1])
+        self.assert_no_drift()
+
+    def test_update_changing_assignee_and_status_together(self):
+        ticket_id = self.create_ticket()
+        self.assign(ticket_id, self.agents[0])
+        self.change_status(ticket_id, 'resolved')
+        response = self.client.patch(f'/api/tickets/{ticket_id}/', {'assigned_to': self.agents[1].id,
+                                                                     'status': 'in_progress'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.resolved_counts(), [0, 0])
+        self.assertIsNone(Ticket.objects.get(pk=ticket_id).resolved_at)
+        self.assert_no_drift()
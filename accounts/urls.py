@@ -1,10 +1,11 @@
 from django.urls import path
 from rest_framework_simplejwt.views import TokenRefreshView
-from .views import RegisterView, LoginView, ProfileView
+from support_system.async_api import read_view
+from .views import RegisterView, LoginView, ProfileView, profile_async
 
 urlpatterns = [
     path('auth/register/', RegisterView.as_view(), name='register'),
     path('auth/login/', LoginView.as_view(), name='login'),
     path('auth/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
-    path('auth/profile/', ProfileView.as_view(), name='profile'),
+    path('auth/profile/', read_view(profile_async, ProfileView.as_view()), name='profile'),
 ]
\ No newline at end of file
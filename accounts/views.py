@@ -5,6 +5,7 @@ from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import authenticate
 from .models import User
 from .serializers import UserSerializer, LoginSerializer
+from support_system.async_api import async_api_view, setup_view
 
 
 class RegisterView(generics.CreateAPIView):
@@ -41,4 +42,13 @@ class ProfileView(generics.RetrieveAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_object(self):
-        return self.request.user
\ No newline at end of file
+        return self.request.user
+
+
+@async_api_view(ProfileView)
+async def profile_async(request):
+    user = request.user
+    # CachingJWTAuthentication loads the user with both profiles; other authenticators leave them to load here
+    if not (User.profile.is_cached(user) and User.support_profile.is_cached(user)):
+        user = await User.objects.select_related('profile', 'support_profile').aget(pk=user.pk)
+    return setup_view(ProfileView, request).get_serializer(user).data
@@ -2,4 +2,8 @@ from django.apps import AppConfig
 
 class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'chat'
\ No newline at end of file
+    name = 'chat'
+
+    def ready(self):
+        # Release attachment blobs when attachments are deleted
+        from . import signals  # noqa: F401
@@ -0,0 +1,302 @@
+"""
+Content-addressed attachment storage and resumable uploads.
+
+Attachment bytes live in Blob rows keyed by SHA-256, so the same screenshot
+sent ten times is stored once. A blob counts its references (attachments
+plus finished uploads waiting to be attached) and is deleted, file
+included, when the last one goes.
+
+Large files arrive through Upload sessions: the client creates one, then
+PATCHes raw byte ranges at the current offset until the size is reached.
+Chunks are streamed straight to a partial file next to MEDIA_ROOT, never
+through Django's upload handlers, and hashed as they are written. The
+running hash lives in process memory; a chunk landing on another process
+(or after a restart) rehashes the partial file once and carries on.
+
+Downloads are handed to the web server through ATTACHMENT_SENDFILE_HEADER
+when configured, and otherwise streamed with Range support.
+"""
+import fcntl
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.http import content_disposition_header
+from . import thumbnails
+from .models import Blob, Upload
+
+logger = logging.getLogger(__name__)
+
+# Largest attachment accepted, in bytes
+ATTACHMENT_MAX_SIZE = getattr(settings, 'ATTACHMENT_MAX_SIZE', 100 * 1024 * 1024)
+# Where partial uploads are written; must be on the same filesystem as MEDIA_ROOT
+ATTACHMENT_UPLOAD_DIR = getattr(settings, 'ATTACHMENT_UPLOAD_DIR', os.path.join(settings.MEDIA_ROOT, 'uploads'))
+# Seconds after its last chunk before `clean_uploads` discards an unattached upload
+ATTACHMENT_UPLOAD_EXPIRY = getattr(settings, 'ATTACHMENT_UPLOAD_EXPIRY', 24 * 60 * 60)
+# 'X-Accel-Redirect' (nginx) or 'X-Sendfile' (Apache, lighttpd) to let the web server send files
+ATTACHMENT_SENDFILE_HEADER = getattr(settings, 'ATTACHMENT_SENDFILE_HEADER', None)
+# Internal location mapped to MEDIA_ROOT, for X-Accel-Redirect
+ATTACHMENT_SENDFILE_PREFIX = getattr(settings, 'ATTACHMENT_SENDFILE_PREFIX', '/protected-media/')
+
+READ_SIZE = 64 * 1024
+# Running hashes kept for uploads in progress in this process
+MAX_HASHERS = 256
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class UploadError(Exception):
+    """A chunk that cannot be applied; `status` is the HTTP status to answer with."""
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+hashers = OrderedDict()
+hashers_lock = threading.Lock()
+
+
+def blob_name(sha256):
+    return f'blobs/{sha256[:2]}/{sha256[2:4]}/{sha256}'
+
+
+def partial_path(upload):
+    return os.path.join(ATTACHMENT_UPLOAD_DIR, str(upload.id))
+
+
+def store(path, sha256, size):
+    """
+    Move the complete file at `path` into blob storage, or drop it if that
+    content is already stored, and return its Blob with one reference taken.
+    """
+    moved = False
+    while True:
+        blob = Blob.objects.filter(sha256=sha256).first()
+        if blob is not None:
+            # Fails if the last reference was released since the read; then start over
+            if Blob.objects.filter(pk=blob.pk, ref_count__gt=0).update(ref_count=F('ref_count') + 1):
+                if not moved:
+                    os.remove(path)
+                return blob
+            continue
+
+        name = blob_name(sha256)
+        target = default_storage.path(name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # Same content as anything already at the target, so replacing it is harmless
+        os.replace(path, target)
+        moved = True
+        try:
+            with transaction.atomic():
+                return Blob.objects.create(sha256=sha256, file=name, size=size, ref_count=1)
+        except IntegrityError:
+            # Another request stored the same content first; reference theirs
+            continue
+
+
+def store_file(file):
+    """Store an UploadedFile (multipart upload) as a blob; returns it with one reference taken."""
+    os.makedirs(ATTACHMENT_UPLOAD_DIR, exist_ok=True)
+    hasher = hashlib.sha256()
+    path = os.path.join(ATTACHMENT_UPLOAD_DIR, f'form-{os.getpid()}-{threading.get_ident()}-{id(file)}')
+    with open(path, 'wb') as f:
+        for chunk in file.chunks(READ_SIZE):
+            f.write(chunk)
+            hasher.update(chunk)
+    return store(path, hasher.hexdigest(), file.size)
+
+
+def release(blob_id):
+    """Drop one reference; the last one deletes the blob and, after commit, its file."""
+    Blob.objects.filter(pk=blob_id).update(ref_count=F('ref_count') - 1)
+    blob = Blob.objects.filter(pk=blob_id, ref_count=0).first()
+    if blob is not None and Blob.objects.filter(pk=blob_id, ref_count=0).delete()[0]:
+        transaction.on_commit(lambda: delete_blob_file(blob.sha256, blob.file.name))
+
+
+def delete_blob_file(sha256, name):
+    # The same content may have been stored again since; its files live at the same names
+    if not Blob.objects.filter(sha256=sha256).exists():
+        default_storage.delete(name)
+        thumbnails.delete_variants(sha256)
+
+
+def start(upload):
+    """Create the partial file of a new upload."""
+    os.makedirs(ATTACHMENT_UPLOAD_DIR, exist_ok=True)
+    open(partial_path(upload), 'wb').close()
+
+
+def discard(upload):
+    """Delete an upload, its partial file and, if it finished, its blob reference."""
+    # The blob reference is released by the post_delete receiver in chat/signals.py
+    upload.delete()
+    with hashers_lock:
+        hashers.pop(upload.pk, None)
+    try:
+        os.remove(partial_path(upload))
+    except FileNotFoundError:
+        pass
+
+
+def running_hash(upload, f):
+    """The SHA-256 of the first `upload.offset` bytes of the partial file `f`."""
+    with hashers_lock:
+        entry = hashers.pop(upload.pk, None)
+    if entry is not None and entry[0] == upload.offset:
+        return entry[1]
+
+    # Earlier chunks went to another process, or this one restarted
+    hasher = hashlib.sha256()
+    f.seek(0)
+    remaining = upload.offset
+    while remaining:
+        data = f.read(min(READ_SIZE, remaining))
+        if not data:
+            raise UploadError('Partial upload is shorter than its offset', 409)
+        hasher.update(data)
+        remaining -= len(data)
+    return hasher
+
+
+def write_chunk(upload, stream, offset):
+    """
+    Append the bytes read from `stream` to `upload` at `offset`, which must
+    be the upload's current offset. Bytes received before the stream breaks
+    are kept, so the client can resume from the new offset. Finishes the
+    upload when its last byte arrives.
+    """
+    if upload.blob_id is not None:
+        raise UploadError('Upload is already complete', 409)
+    try:
+        f = open(partial_path(upload), 'r+b')
+    except FileNotFoundError:
+        raise UploadError('Upload has no partial file', 410)
+
+    with f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadError('Another chunk of this upload is being written', 409)
+
+        # Read under the lock, so a chunk that just finished is seen
+        upload.refresh_from_db(fields=['offset', 'blob'])
+        if upload.blob_id is not None:
+            raise UploadError('Upload is already complete', 409)
+        if offset != upload.offset:
+            raise UploadError(f'Expected offset {upload.offset}', 409)
+
+        hasher = running_hash(upload, f)
+        f.seek(offset)
+        # Drop bytes a broken earlier request wrote past the recorded offset
+        f.truncate()
+
+        written = 0
+        remaining = upload.size - offset
+        try:
+            while stream is not None:
+                data = stream.read(min(READ_SIZE, remaining + 1))
+                if not data:
+                    break
+                if len(data) > remaining:
+                    # Reject the whole chunk; the next one rehashes from disk
+                    f.truncate(offset)
+                    written = 0
+                    raise UploadError('Chunk runs past the upload size', 413)
+                f.write(data)
+                hasher.update(data)
+                written += len(data)
+                remaining -= len(data)
+        finally:
+            f.flush()
+            os.fsync(f.fileno())
+            upload.offset = offset + written
+            Upload.objects.filter(pk=upload.pk).update(offset=upload.offset, updated_at=timezone.now())
+
+        if remaining:
+            with hashers_lock:
+                hashers[upload.pk] = (upload.offset, hasher)
+                while len(hashers) > MAX_HASHERS:
+                    hashers.popitem(last=False)
+            return upload
+
+        with transaction.atomic():
+            upload.blob = store(partial_path(upload), hasher.hexdigest(), upload.size)
+            Upload.objects.filter(pk=upload.pk).update(blob=upload.blob)
+        logger.info(f"Upload {upload.pk} complete: {upload.size} bytes, blob {upload.blob.sha256}")
+        return upload
+
+
+def iter_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length:
+            data = f.read(min(READ_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def serve(request, blob, file_name, variant='file'):
+    """
+    Response sending `blob` (or its `thumbnail` / `preview` variant) as
+    `file_name`, honouring If-None-Match and single byte ranges.
+    """
+    name = getattr(blob, variant).name
+    if variant == 'file':
+        size, etag = blob.size, f'"{blob.sha256}"'
+    else:
+        size, etag = default_storage.size(name), f'"{blob.sha256}-{variant}"'
+    if request.headers.get('If-None-Match') == etag:
+        return HttpResponseNotModified(headers={'ETag': etag})
+
+    content_type = mimetypes.guess_type(file_name)[0] or 'application/octet-stream'
+    # Only images are shown inline; anything else (HTML, SVG, ...) must not run on our origin
+    inline = content_type.startswith('image/') and content_type != 'image/svg+xml'
+    headers = {
+        'ETag': etag,
+        'Content-Disposition': content_disposition_header(not inline, file_name),
+        'Cache-Control': 'private, max-age=31536000, immutable',
+        'Accept-Ranges': 'bytes',
+    }
+
+    if ATTACHMENT_SENDFILE_HEADER:
+        # The web server answers, Range requests included
+        if ATTACHMENT_SENDFILE_HEADER == 'X-Accel-Redirect':
+            location = ATTACHMENT_SENDFILE_PREFIX + name
+        else:
+            location = default_storage.path(name)
+        response = HttpResponse(content_type=content_type, headers=headers)
+        response[ATTACHMENT_SENDFILE_HEADER] = location
+        return response
+
+    path = default_storage.path(name)
+    start, end, status = 0, size - 1, 200
+    match = RANGE_RE.match(request.headers.get('Range', ''))
+    if match and any(match.groups()):
+        first, last = match.groups()
+        if first:
+            start, end = int(first), min(int(last), size - 1) if last else size - 1
+        else:
+            start = max(size - int(last), 0)
+        if start > end:
+            return HttpResponse(status=416, headers={'Content-Range': f'bytes */{size}'})
+        status = 206
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+    length = end - start + 1
+    response = StreamingHttpResponse(iter_range(path, start, length), status=status,
+                                     content_type=content_type, headers=headers)
+    response['Content-Length'] = str(length)
+    return response
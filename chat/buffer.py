@@ -0,0 +1,117 @@
+import asyncio
+import logging
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+from search import index as search_index
+from support_system.instrumentation import registry
+from .models import Message
+
+logger = logging.getLogger(__name__)
+
+
+class MessageWriteBuffer:
+    """
+    Process-wide write-behind buffer for chat messages.
+
+    Consumers hand over unsaved Message instances; they are written with a
+    single bulk_create at most `interval` seconds later, or as soon as
+    `max_size` messages are pending. This bounds how many chat lines can be
+    lost if the process dies, while coalescing bursts from every consumer in
+    the process into one database round-trip.
+
+    A batch that fails to write goes back to the front of the buffer and is
+    retried with the next flush. After `max_attempts` failures its messages
+    are written one by one, and only those that still fail are dropped.
+    Failures and drops are logged and counted in /metrics.
+    """
+
+    def __init__(self, interval, max_size, max_attempts):
+        self.interval = interval
+        self.max_size = max_size
+        self.max_attempts = max_attempts
+        self.failures = 0
+        self.pending = []
+        self.timer = None
+        self.flush_task = None
+        self.lock = None
+
+    async def add(self, message):
+        self.pending.append(message)
+
+        if len(self.pending) >= self.max_size:
+            await self.flush()
+        else:
+            self.start_timer()
+
+    def start_timer(self):
+        if self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.interval, self.schedule_flush)
+
+    def schedule_flush(self):
+        self.timer = None
+        self.flush_task = asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+        # Serialize flushes so batches are inserted in arrival order
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+
+        async with self.lock:
+            batch, self.pending = self.pending, []
+            if not batch:
+                return
+            try:
+                await database_sync_to_async(self.write)(batch)
+            except Exception:
+                self.failures += 1
+                registry.inc('chat_write_behind_failures_total', ())
+                logger.exception(f"Error saving {len(batch)} buffered messages (attempt {self.failures})")
+                if self.failures < self.max_attempts:
+                    # Ahead of the messages that arrived meanwhile, so the order is kept
+                    self.pending[:0] = batch
+                    self.start_timer()
+                    return
+                await database_sync_to_async(self.write_each)(batch)
+            self.failures = 0
+
+    @staticmethod
+    def write(batch):
+        try:
+            # bulk_create skips post_save, so index the batch here. In one transaction, so a
+            # failed index write does not leave stored messages behind to be inserted again.
+            with transaction.atomic():
+                Message.objects.bulk_create(batch)
+                search_index.index_new_messages(batch)
+        except Exception:
+            # Undo the ids bulk_create may have set before the rollback
+            for message in batch:
+                message.pk = None
+                message._state.adding = True
+            raise
+
+    @classmethod
+    def write_each(cls, batch):
+        """Store what can be stored of a batch that keeps failing; returns the number dropped."""
+        dropped = 0
+        for message in batch:
+            try:
+                cls.write([message])
+            except Exception:
+                dropped += 1
+                logger.exception(f"Dropping buffered message from user {message.sender_id} "
+                                 f"on ticket {message.ticket_id}")
+        if dropped:
+            registry.inc('chat_write_behind_dropped_total', (), dropped)
+        return dropped
+
+
+message_buffer = MessageWriteBuffer(
+    interval=getattr(settings, 'CHAT_WRITE_BEHIND_INTERVAL', 0.5),
+    max_size=getattr(settings, 'CHAT_WRITE_BEHIND_MAX_BATCH', 500),
+    max_attempts=getattr(settings, 'CHAT_WRITE_BEHIND_MAX_ATTEMPTS', 3),
+)
@@ -1,21 +1,109 @@
+import asyncio
 import json
 import logging
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from django.contrib.auth import get_user_model
-from tickets.models import Ticket
+from channels.consumer import get_handler_name
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from tickets import permissions
+from . import feed, presence, unread
+from .buffer import message_buffer
 from .models import Message
 
-User = get_user_model()
 logger = logging.getLogger(__name__)
 
+# Number of messages sent on connect and per `load_older` page
+CHAT_HISTORY_PAGE_SIZE = getattr(settings, 'CHAT_HISTORY_PAGE_SIZE', 50)
+# Largest gap replayed on resume before falling back to a fresh history snapshot
+CHAT_RESUME_LIMIT = getattr(settings, 'CHAT_RESUME_LIMIT', 200)
+# Persist chat lines through the batched write-behind buffer instead of one INSERT each
+CHAT_WRITE_BEHIND = getattr(settings, 'CHAT_WRITE_BEHIND', False)
+# Seconds after the last keystroke before a typing indicator is cleared
+CHAT_TYPING_TIMEOUT = getattr(settings, 'CHAT_TYPING_TIMEOUT', 5)
+# Presence changes arriving within this window reach each socket as one frame
+CHAT_PRESENCE_COALESCE_WINDOW = getattr(settings, 'CHAT_PRESENCE_COALESCE_WINDOW', 0.25)
+# Chat messages arriving within this window go out as one chat_batch frame (0 disables batching)
+CHAT_BATCH_WINDOW = getattr(settings, 'CHAT_BATCH_WINDOW', 0)
+# Ticket updates arriving within this window reach each dashboard as one delta per ticket
+FEED_TICKET_COALESCE_WINDOW = getattr(settings, 'FEED_TICKET_COALESCE_WINDOW', 0.5)
+
+
+def run_later(delay, callback):
+    """
+    Await `callback()` after `delay` seconds in a task, which the caller keeps
+    so disconnect() can cancel it. Errors are logged here, since nothing
+    awaits the task.
+    """
+    async def later():
+        await asyncio.sleep(delay)
+        try:
+            await callback()
+        except Exception:
+            logger.exception(f"Error in {callback.__qualname__}")
+    return asyncio.ensure_future(later())
+
+
+def chat_message_frame(event):
+    """Serialize a chat_message group event into the JSON frame sent to clients."""
+    return json.dumps({
+        'type': 'chat_message',
+        'id': event.get('id'),
+        'message': event['message'],
+        'user_id': event['user_id'],
+        'first_name': event['first_name'],
+        'last_name': event['last_name'],
+        'user_type': event['user_type'],
+        'timestamp': event['timestamp']
+    })
+
+
 class ChatConsumer(AsyncWebsocketConsumer):
+    async def dispatch(self, message):
+        # AsyncConsumer.dispatch closes stale DB connections in a thread before every
+        # event, which makes each fanned-out chat_message pay an executor hop. All
+        # database work here already goes through database_sync_to_async, which
+        # does that cleanup itself. This is channels' dispatch (4.2+, see
+        # requirements.txt) minus that call; chat/tests.py checks the two still agree.
+        handler = getattr(self, get_handler_name(message), None)
+        if handler is None:
+            raise ValueError("No handler for message type %s" % message["type"])
+        await handler(message)
+
     async def connect(self):
-        self.ticket_id = self.scope['url_route']['kwargs']['ticket_id']
+        self.ticket_id = int(self.scope['url_route']['kwargs']['ticket_id'])
         self.room_group_name = f'chat_{self.ticket_id}'
         
         logger.info(f"WebSocket connect attempt for ticket_id: {self.ticket_id}")
-        print(f"WebSocket connect attempt for ticket_id: {self.ticket_id}")
+
+        # Resolve the sender once; clients can no longer post as someone else
+        self.user = self.scope.get('user')
+        if self.user is None or not self.user.is_authenticated:
+            logger.info(f"Rejected unauthenticated WebSocket for ticket_id: {self.ticket_id}")
+            await self.close()
+            return
+
+        # Same rules as the ticket API; the participants also drive the unread deltas
+        self.ticket_participants = await permissions.get_participants(self.ticket_id)
+        if self.ticket_participants is None or not permissions.can_access(self.user, self.ticket_participants):
+            logger.info(f"Rejected WebSocket for ticket_id {self.ticket_id}: no access for user {self.user.id}")
+            await self.close()
+            return
+
+        self.sender = {
+            'user_id': self.user.id,
+            'first_name': self.user.first_name,
+            'last_name': self.user.last_name,
+            'user_type': self.user.user_type,
+        }
+        self.typing_timer = None
+        self.pending_presence = {}
+        self.presence_timer = None
+        self.pending_frames = []
+        self.batch_timer = None
 
         # Join room group
         await self.channel_layer.group_add(
@@ -24,100 +112,361 @@ class ChatConsumer(AsyncWebsocketConsumer):
         )
 
         logger.info(f"WebSocket connected for ticket_id: {self.ticket_id}")
-        print(f"WebSocket connected for ticket_id: {self.ticket_id}")
         await self.accept()
-        
-        # Send chat history to the newly connected client
-        await self.send_chat_history()
+
+        # Reconnecting clients pass the last message id they saw and only get what they missed
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        since = query.get('since', [None])[0]
+        if since:
+            await self.send_missed_messages(since)
+        else:
+            # Send chat history to the newly connected client
+            await self.send_chat_history()
+
+        # Tell the client who else is here, then announce ourselves
+        viewers = await presence.join(self.room_group_name, self.channel_name, self.presence_info())
+        await self.send(text_data=json.dumps({
+            'type': 'presence',
+            'snapshot': True,
+            'viewers': [{**viewer, 'state': 'viewing'} for viewer in viewers]
+        }))
+        await self.broadcast_presence('viewing')
 
     async def disconnect(self, close_code):
+        if not hasattr(self, 'sender'):
+            # Rejected in connect() before joining the group
+            return
+
+        for timer in (self.typing_timer, self.presence_timer, self.batch_timer):
+            if timer is not None:
+                timer.cancel()
+
         # Leave room group
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
 
+        await presence.leave(self.room_group_name, self.channel_name)
+        await self.broadcast_presence('left')
+
+        if CHAT_WRITE_BEHIND:
+            await message_buffer.flush()
+
     # Receive message from WebSocket
     async def receive(self, text_data):
         text_data_json = json.loads(text_data)
+
+        # Client commands (e.g. paging through older history)
+        if text_data_json.get('command') == 'load_older':
+            await self.send_older_history(text_data_json.get('before') or {})
+            return
+        if text_data_json.get('command') == 'resume':
+            await self.send_missed_messages(text_data_json.get('since'))
+            return
+        if text_data_json.get('command') == 'heartbeat':
+            if not await presence.heartbeat(self.room_group_name, self.channel_name, self.presence_info()):
+                await self.broadcast_presence('viewing')
+            return
+        if text_data_json.get('command') == 'typing':
+            await self.typing_activity()
+            return
+        if text_data_json.get('command') == 'mark_read':
+            await self.mark_read(text_data_json.get('message_id'))
+            return
+
         message = text_data_json['message']
-        user_id = text_data_json.get('user_id')
         
         # Save message to database
-        await self.save_message(user_id, message)
+        message_id = await self.save_message(message)
         
+        event = {
+            'type': 'chat_message',
+            'id': message_id,
+            'message': message,
+            **self.sender,
+            'timestamp': self.get_timestamp()
+        }
+        # Serialize once here rather than once per subscriber in chat_message()
+        event['frame'] = chat_message_frame(event)
+
         # Send message to room group
+        await self.channel_layer.group_send(self.room_group_name, event)
+
+        await unread.publish_new_message(self.channel_layer, self.ticket_id, self.user.id,
+                                         self.ticket_participants)
+
+        # Sending a message ends the typing burst
+        if self.typing_timer is not None:
+            await self.stop_typing()
+
+    # Receive message from room group
+    async def chat_message(self, event):
+        # Events published outside ChatConsumer (e.g. status updates) are not pre-serialized
+        frame = event.get('frame') or chat_message_frame(event)
+
+        if not CHAT_BATCH_WINDOW:
+            # Send message to WebSocket
+            await self.send(text_data=frame)
+            return
+
+        self.pending_frames.append(frame)
+        if self.batch_timer is None:
+            self.batch_timer = run_later(CHAT_BATCH_WINDOW, self.flush_frames)
+
+    async def flush_frames(self):
+        self.batch_timer = None
+        frames, self.pending_frames = self.pending_frames, []
+        if len(frames) == 1:
+            await self.send(text_data=frames[0])
+        elif frames:
+            # Splice the already-serialized frames instead of re-encoding them
+            await self.send(text_data='{"type": "chat_batch", "messages": [' + ', '.join(frames) + ']}')
+
+    def presence_info(self):
+        return {**self.sender, 'connection': self.channel_name}
+
+    async def broadcast_presence(self, state):
         await self.channel_layer.group_send(
             self.room_group_name,
             {
-                'type': 'chat_message',
-                'message': message,
-                'user_id': user_id,
-                'first_name': text_data_json.get('first_name', ''),
-                'last_name': text_data_json.get('last_name', ''),
-                'user_type': text_data_json.get('user_type', ''),
-                'timestamp': await self.get_timestamp()
+                'type': 'presence_event',
+                **self.presence_info(),
+                'state': state
             }
         )
 
-    # Receive message from room group
-    async def chat_message(self, event):
-        # Send message to WebSocket
-        await self.send(text_data=json.dumps({
-            'type': 'chat_message',
-            'message': event['message'],
-            'user_id': event['user_id'],
-            'first_name': event['first_name'],
-            'last_name': event['last_name'],
-            'user_type': event['user_type'],
-            'timestamp': event['timestamp']
-        }))
+    async def typing_activity(self):
+        # Only the first keystroke of a burst is broadcast; later ones just push back the timeout
+        if self.typing_timer is None:
+            await self.broadcast_presence('typing')
+        else:
+            self.typing_timer.cancel()
+        self.typing_timer = run_later(CHAT_TYPING_TIMEOUT, self.stop_typing)
+
+    async def stop_typing(self):
+        timer, self.typing_timer = self.typing_timer, None
+        # Unless the timeout is what called us
+        if timer is not None and timer is not asyncio.current_task():
+            timer.cancel()
+        await self.broadcast_presence('viewing')
+
+    # Receive presence change from room group
+    async def presence_event(self, event):
+        if event['connection'] == self.channel_name:
+            return
+
+        # Keep only the latest state per connection and flush them together
+        self.pending_presence[event['connection']] = {key: value for key, value in event.items() if key != 'type'}
+        if self.presence_timer is None:
+            self.presence_timer = run_later(CHAT_PRESENCE_COALESCE_WINDOW, self.flush_presence)
+
+    async def flush_presence(self):
+        self.presence_timer = None
+        viewers, self.pending_presence = list(self.pending_presence.values()), {}
+        if viewers:
+            await self.send(text_data=json.dumps({
+                'type': 'presence',
+                'viewers': viewers
+            }))
+
+    async def save_message(self, message_content):
+        """
+        Persist a chat line and return its id. In write-behind mode the message
+        is queued for a batched insert and no id is available yet.
+        """
+        message = Message(ticket_id=self.ticket_id, sender_id=self.user.id, content=message_content)
+        if CHAT_WRITE_BEHIND:
+            await message_buffer.add(message)
+            return None
+        return await self.create_message(message)
+
+    async def mark_read(self, message_id):
+        try:
+            message_id = int(message_id) if message_id is not None else None
+        except (TypeError, ValueError):
+            await self.send(text_data=json.dumps({
+                'type': 'error',
+                'error': 'Invalid message id'
+            }))
+            return
+
+        count = await database_sync_to_async(unread.mark_read)(self.user, self.ticket_id, message_id)
+        # Keeps badges in the user's other tabs in step
+        await unread.publish_count(self.channel_layer, self.user.id, self.ticket_id, count)
 
     @database_sync_to_async
-    def save_message(self, user_id, message_content):
+    def create_message(self, message):
         try:
-            user = User.objects.get(id=user_id)
-            ticket = Ticket.objects.get(id=self.ticket_id)
-            
-            Message.objects.create(
-                ticket=ticket,
-                sender=user,
-                content=message_content
-            )
-            return True
+            message.save()
+            return message.id
         except Exception as e:
             logger.error(f"Error saving message: {str(e)}")
-            print(f"Error saving message: {str(e)}")
-            return False
+            return None
 
-    @database_sync_to_async
     def get_timestamp(self):
-        import datetime
-        return datetime.datetime.now().isoformat()
+        return timezone.now().isoformat()
 
     @database_sync_to_async
-    def get_chat_history(self):
+    def get_chat_history(self, before=None):
+        """
+        Return one page of messages (oldest first) ending just before the
+        (timestamp, id) cursor, or the most recent page if no cursor is given.
+        """
         try:
-            messages = Message.objects.filter(ticket_id=self.ticket_id).order_by('timestamp')
-            return [
-                {
-                    'message': msg.content,
-                    'user_id': msg.sender.id,
-                    'first_name': msg.sender.first_name,
-                    'last_name': msg.sender.last_name,
-                    'user_type': msg.sender.user_type,
-                    'timestamp': msg.timestamp.isoformat()
-                }
-                for msg in messages
-            ]
+            messages = Message.objects.filter(ticket_id=self.ticket_id).select_related('sender')
+            if before is not None:
+                before_timestamp, before_id = before
+                messages = messages.filter(
+                    Q(timestamp__lt=before_timestamp) |
+                    Q(timestamp=before_timestamp, id__lt=before_id)
+                )
+            page = list(messages.order_by('-timestamp', '-id')[:CHAT_HISTORY_PAGE_SIZE + 1])
+            has_more = len(page) > CHAT_HISTORY_PAGE_SIZE
+            page = page[:CHAT_HISTORY_PAGE_SIZE]
+            page.reverse()
+            return [self.serialize_message(msg) for msg in page], has_more
         except Exception as e:
             logger.error(f"Error getting chat history: {str(e)}")
-            print(f"Error getting chat history: {str(e)}")
-            return []
+            return [], False
+
+    @staticmethod
+    def serialize_message(msg):
+        return {
+            'id': msg.id,
+            'message': msg.content,
+            'user_id': msg.sender.id,
+            'first_name': msg.sender.first_name,
+            'last_name': msg.sender.last_name,
+            'user_type': msg.sender.user_type,
+            'timestamp': msg.timestamp.isoformat()
+        }
+
+    @database_sync_to_async
+    def get_messages_since(self, since_id):
+        """
+        Return the messages after `since_id` (oldest first), or None if the gap
+        is larger than CHAT_RESUME_LIMIT.
+        """
+        messages = list(
+            Message.objects.filter(ticket_id=self.ticket_id, id__gt=since_id)
+            .select_related('sender')
+            .order_by('id')[:CHAT_RESUME_LIMIT + 1]
+        )
+        if len(messages) > CHAT_RESUME_LIMIT:
+            return None
+        return [self.serialize_message(msg) for msg in messages]
 
     async def send_chat_history(self):
-        messages = await self.get_chat_history()
+        messages, has_more = await self.get_chat_history()
         await self.send(text_data=json.dumps({
             'type': 'chat_history',
+            'messages': messages,
+            'has_more': has_more
+        }))
+
+    async def send_older_history(self, before):
+        # The cursor is the (timestamp, id) of the oldest message the client holds
+        before_timestamp = parse_datetime(str(before.get('timestamp', '')))
+        try:
+            before_id = int(before.get('id'))
+        except (TypeError, ValueError):
+            before_id = None
+
+        if before_timestamp is None or before_id is None:
+            await self.send(text_data=json.dumps({
+                'type': 'error',
+                'error': 'Invalid history cursor'
+            }))
+            return
+
+        messages, has_more = await self.get_chat_history(before=(before_timestamp, before_id))
+        await self.send(text_data=json.dumps({
+            'type': 'chat_history_page',
+            'messages': messages,
+            'has_more': has_more
+        }))
+
+    async def send_missed_messages(self, since):
+        try:
+            since_id = int(since)
+        except (TypeError, ValueError):
+            since_id = None
+
+        messages = await self.get_messages_since(since_id) if since_id is not None else None
+        if messages is None:
+            # Unknown cursor or too large a gap: start over from a bounded snapshot
+            await self.send_chat_history()
+            return
+
+        await self.send(text_data=json.dumps({
+            'type': 'chat_resume',
             'messages': messages
         }))
+
+
+class FeedConsumer(AsyncWebsocketConsumer):
+    """
+    Per-user stream for the dashboard: unread-count changes for the badges,
+    and ticket creations, assignments and status changes (see chat/feed.py).
+    """
+
+    async def connect(self):
+        self.user = self.scope.get('user')
+        if self.user is None or not self.user.is_authenticated:
+            await self.close()
+            return
+
+        self.pending_tickets = {}
+        self.tickets_timer = None
+        self.groups_joined = [unread.feed_group(self.user.id)]
+        if self.user.user_type in feed.ROLE_FEED_GROUPS:
+            self.groups_joined.append(feed.ROLE_FEED_GROUPS[self.user.user_type])
+        for group in self.groups_joined:
+            await self.channel_layer.group_add(group, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        if getattr(self, 'tickets_timer', None) is not None:
+            self.tickets_timer.cancel()
+        for group in getattr(self, 'groups_joined', []):
+            await self.channel_layer.group_discard(group, self.channel_name)
+
+    async def ticket_update(self, event):
+        # Participants also get the event through their own group
+        if event.get('roles') and self.user.id in event['participants']:
+            return
+
+        # Keep the latest state per ticket and flush them together
+        pending = self.pending_tickets.get(event['ticket'])
+        self.pending_tickets[event['ticket']] = feed.merge_ticket_events(pending, event)
+        if self.tickets_timer is None:
+            self.tickets_timer = run_later(FEED_TICKET_COALESCE_WINDOW, self.flush_tickets)
+
+    async def flush_tickets(self):
+        self.tickets_timer = None
+        tickets, self.pending_tickets = list(self.pending_tickets.values()), {}
+        if tickets:
+            await self.send(text_data=json.dumps({
+                'type': 'tickets',
+                'tickets': [feed.ticket_frame(event) for event in tickets]
+            }))
+
+    async def unread_delta(self, event):
+        if event['sender'] == self.user.id:
+            return
+        # Admins who take part in the ticket already got this through their own group
+        if event.get('admins') and self.user.id in event['participants']:
+            return
+        await self.send(text_data=json.dumps({
+            'type': 'unread',
+            'ticket': event['ticket'],
+            'delta': event['delta']
+        }))
+
+    async def unread_count(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'unread',
+            'ticket': event['ticket'],
+            'count': event['count']
+        }))
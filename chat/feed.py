@@ -0,0 +1,96 @@
+"""
+Live ticket updates for the dashboards.
+
+Every Ticket save goes through one post_save hook (chat/signals.py) that
+works out what changed (creation, status, assignee) from the values the
+row was loaded with, and after commit sends one ticket_update event to the
+feed groups of the people who see the ticket: its creator, its current and
+previous assignee, and the admin and support role groups, whose dashboards
+list every ticket. FeedConsumer merges the events for a ticket that arrive
+within FEED_TICKET_COALESCE_WINDOW, so a burst of saves reaches each
+dashboard as one delta per ticket.
+"""
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.utils.dateparse import parse_datetime
+from .unread import ADMIN_FEED_GROUP, feed_group
+
+# Support staff see every ticket on the dashboard, so they share one feed group for ticket events
+SUPPORT_FEED_GROUP = 'feed_support'
+
+ROLE_FEED_GROUPS = {
+    'admin': ADMIN_FEED_GROUP,
+    'support': SUPPORT_FEED_GROUP,
+}
+
+# Order in which merged changes are listed
+CHANGES = ('created', 'assigned', 'status')
+
+
+def ticket_changes(ticket, created):
+    """What a save of `ticket` changed, as a list of CHANGES entries."""
+    if created:
+        return ['created']
+    loaded = getattr(ticket, 'loaded_values', {})
+    changes = []
+    if loaded.get('assigned_to_id') != ticket.assigned_to_id:
+        changes.append('assigned')
+    if loaded.get('status') != ticket.status:
+        changes.append('status')
+    return changes
+
+
+def ticket_event(ticket, changes, previous_assignee_id=None):
+    """The ticket_update group event for a save of `ticket`."""
+    event = {
+        'type': 'ticket_update',
+        'ticket': ticket.id,
+        'title': ticket.title,
+        'status': ticket.status,
+        'status_display': ticket.get_status_display(),
+        'priority': ticket.priority,
+        'priority_display': ticket.get_priority_display(),
+        'created_by': ticket.created_by_id,
+        'assigned_to': ticket.assigned_to_id,
+        'updated_at': ticket.updated_at.isoformat(),
+        'changes': changes,
+        'participants': [
+            user_id for user_id in {ticket.created_by_id, ticket.assigned_to_id, previous_assignee_id}
+            if user_id is not None
+        ],
+    }
+    if 'created' in changes or 'assigned' in changes:
+        # The assignee was just set, so this reads the cached object rather than querying
+        event['assigned_to_name'] = ticket.assigned_to.get_full_name() if ticket.assigned_to_id else None
+    return event
+
+
+def publish_ticket(event):
+    """Send a ticket_update event to its participants' feeds and the role feeds."""
+    channel_layer = get_channel_layer()
+    send = async_to_sync(channel_layer.group_send)
+    for user_id in event['participants']:
+        send(feed_group(user_id), event)
+    for group in ROLE_FEED_GROUPS.values():
+        send(group, {**event, 'roles': True})
+
+
+def merge_ticket_events(pending, event):
+    """
+    Fold `event` into `pending`, the merged event waiting for the same
+    ticket (or None): the newer state wins and the changes add up.
+    """
+    if pending is None:
+        return event
+    # Events from different processes may arrive out of order
+    if parse_datetime(pending['updated_at']) <= parse_datetime(event['updated_at']):
+        older, newer = pending, event
+    else:
+        older, newer = event, pending
+    changes = set(older['changes']) | set(newer['changes'])
+    return {**older, **newer, 'changes': [change for change in CHANGES if change in changes]}
+
+
+def ticket_frame(event):
+    """A merged ticket_update event as sent to clients."""
+    return {key: value for key, value in event.items() if key not in ('type', 'participants', 'roles')}
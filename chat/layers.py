@@ -0,0 +1,45 @@
+import asyncio
+import time
+from copy import deepcopy
+from channels.layers import InMemoryChannelLayer
+
+
+class FanoutInMemoryChannelLayer(InMemoryChannelLayer):
+    """
+    In-memory channel layer tuned for group fan-out in single-process mode.
+
+    The stock InMemoryChannelLayer scans every channel and group membership for
+    expired entries on each receive and group_send, deep-copies the message for
+    every recipient and schedules a task per recipient, so a busy room costs
+    O(sockets) per delivered frame. This layer expires entries at most once
+    per `cleanup_interval` seconds and enqueues one shared copy of a group
+    message directly on each member's queue. Consumers must treat received
+    events as read-only.
+    """
+
+    def __init__(self, cleanup_interval=1.0, **kwargs):
+        super().__init__(**kwargs)
+        self.cleanup_interval = cleanup_interval
+        self.last_cleanup = 0.0
+
+    def _clean_expired(self):
+        now = time.monotonic()
+        if now - self.last_cleanup < self.cleanup_interval:
+            return
+        self.last_cleanup = now
+        super()._clean_expired()
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        self.require_valid_group_name(group)
+        self._clean_expired()
+
+        message = deepcopy(message)
+        expires = time.time() + self.expiry
+        for channel in list(self.groups.get(group, ())):
+            queue = self.channels.setdefault(channel, asyncio.Queue(maxsize=self.get_capacity(channel)))
+            try:
+                queue.put_nowait((expires, message))
+            except asyncio.QueueFull:
+                # Same as the stock layer: a full channel just misses the message
+                pass
@@ -0,0 +1,155 @@
+import asyncio
+import time
+from channels.layers import channel_layers
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from channels import DEFAULT_CHANNEL_LAYER
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+from accounts.models import User
+from chat.consumers import chat_message_frame
+from chat.routing import websocket_urlpatterns
+from tickets import permissions
+
+# Room ids far above real ticket ids so connects only read empty history
+ROOM_ID_OFFSET = 900000000
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Command(BaseCommand):
+    help = 'Load-test chat WebSocket fan-out with simulated sockets and report latency per channel layer backend'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=1000, help='Number of simulated sockets')
+        parser.add_argument('--rooms', type=int, default=10, help='Number of chat rooms the sockets are spread over')
+        parser.add_argument('--messages', type=int, default=50, help='Messages published to each room')
+        parser.add_argument('--backends', default=settings.CHANNEL_LAYER,
+                            help='Comma separated CHANNEL_LAYER_BACKENDS to compare, e.g. memory,redis')
+        parser.add_argument('--timeout', type=float, default=5.0,
+                            help='Seconds a socket waits for the next frame before counting the rest as lost')
+
+    def handle(self, *args, **options):
+        if options['clients'] < 1 or options['rooms'] < 1 or options['messages'] < 1:
+            raise CommandError('--clients, --rooms and --messages must be positive')
+
+        for name in options['backends'].split(','):
+            config = settings.CHANNEL_LAYER_BACKENDS.get(name)
+            if config is None:
+                raise CommandError(f"Unknown channel layer backend '{name}'")
+
+            # Point the consumers at this backend for the duration of the run
+            layer = import_string(config['BACKEND'])(**config.get('CONFIG', {}))
+            channel_layers.set(DEFAULT_CHANNEL_LAYER, layer)
+
+            try:
+                result = asyncio.run(self.run_load(layer, options))
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'{name}: failed ({e})'))
+                continue
+            self.report(name, result)
+
+    async def run_load(self, layer, options):
+        application = URLRouter(websocket_urlpatterns)
+        # Unsaved user: the consumer only needs an authenticated identity and ticket access to accept the socket
+        user = User(id=0, email='loadtest@localhost', first_name='Load', last_name='Test', user_type='support')
+        rooms = [ROOM_ID_OFFSET + i for i in range(options['rooms'])]
+        # The rooms have no ticket rows, so let the access check find the user assigned to them
+        for room in rooms:
+            await cache.aset(permissions.participants_key(room), (user.id, user.id), permissions.TICKET_ACCESS_CACHE_TTL)
+
+        async def open_socket(index):
+            communicator = WebsocketCommunicator(application, f'/ws/chat/{rooms[index % len(rooms)]}/')
+            communicator.scope['user'] = user
+            connected, _ = await communicator.connect(timeout=options['timeout'])
+            if not connected:
+                raise RuntimeError('socket rejected')
+            await communicator.receive_from(timeout=options['timeout'])  # chat history
+            return communicator
+
+        async def settle(communicator):
+            # Swallow the presence updates triggered by the other sockets joining
+            while not await communicator.receive_nothing(timeout=0.5):
+                await communicator.receive_from()
+
+        started = time.perf_counter()
+        sockets = await asyncio.gather(*(open_socket(i) for i in range(options['clients'])))
+        connect_time = time.perf_counter() - started
+        await asyncio.gather(*(settle(communicator) for communicator in sockets))
+
+        sent_at = {}
+        latencies = []
+
+        async def drain(communicator):
+            received = 0
+            while received < options['messages']:
+                try:
+                    frame = await communicator.receive_json_from(timeout=options['timeout'])
+                except asyncio.TimeoutError:
+                    return
+                now = time.perf_counter()
+                if frame['type'] not in ('chat_message', 'chat_batch'):
+                    # e.g. presence updates from the other simulated sockets
+                    continue
+                messages = frame['messages'] if frame['type'] == 'chat_batch' else [frame]
+                for message in messages:
+                    latencies.append(now - sent_at[message['message']])
+                received += len(messages)
+
+        async def publish(room):
+            for seq in range(options['messages']):
+                key = f'{room}:{seq}'
+                sent_at[key] = time.perf_counter()
+                # Same event ChatConsumer.receive publishes for a chat line
+                event = {
+                    'type': 'chat_message',
+                    'id': None,
+                    'message': key,
+                    'user_id': user.id,
+                    'first_name': user.first_name,
+                    'last_name': user.last_name,
+                    'user_type': user.user_type,
+                    'timestamp': '',
+                }
+                event['frame'] = chat_message_frame(event)
+                await layer.group_send(f'chat_{room}', event)
+                await asyncio.sleep(0)
+
+        started = time.perf_counter()
+        drainers = [asyncio.ensure_future(drain(communicator)) for communicator in sockets]
+        await asyncio.gather(*(publish(room) for room in rooms))
+        await asyncio.gather(*drainers)
+        elapsed = time.perf_counter() - started
+
+        await asyncio.gather(*(communicator.disconnect() for communicator in sockets))
+
+        return {
+            'connect_time': connect_time,
+            'elapsed': elapsed,
+            'published': len(sent_at),
+            'expected': options['clients'] * options['messages'],
+            'latencies': sorted(latencies),
+        }
+
+    def report(self, name, result):
+        latencies = result['latencies']
+        delivered = len(latencies)
+        lost = result['expected'] - delivered
+        self.stdout.write(self.style.SUCCESS(f'Backend: {name}'))
+        self.stdout.write(f"  connect:    {result['connect_time']:.2f}s")
+        self.stdout.write(f"  published:  {result['published']} messages")
+        self.stdout.write(f"  delivered:  {delivered} frames ({lost} lost)")
+        self.stdout.write(f"  throughput: {delivered / result['elapsed']:.0f} frames/s")
+        self.stdout.write('  latency:    p50 {:.1f}ms  p95 {:.1f}ms  p99 {:.1f}ms  max {:.1f}ms'.format(
+            percentile(latencies, 0.50) * 1000,
+            percentile(latencies, 0.95) * 1000,
+            percentile(latencies, 0.99) * 1000,
+            (latencies[-1] if latencies else 0) * 1000,
+        ))
@@ -0,0 +1,41 @@
+import os
+from datetime import timedelta
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chat import attachments
+from chat.models import Blob, Upload
+
+# Where attachments were stored before blobs; migration 0006 leaves duplicate copies here
+LEGACY_ATTACHMENT_DIR = 'attachments'
+
+
+class Command(BaseCommand):
+    help = ('Discard uploads that were abandoned or never attached to a message, and legacy attachment files '
+            'no blob uses (run periodically, e.g. from cron)')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(seconds=attachments.ATTACHMENT_UPLOAD_EXPIRY)
+        expired = Upload.objects.filter(updated_at__lt=cutoff)
+        count = 0
+        for upload in expired.iterator():
+            attachments.discard(upload)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Discarded {count} expired upload(s)'))
+
+        removed = 0
+        for name in self.legacy_files(LEGACY_ATTACHMENT_DIR):
+            if not Blob.objects.filter(file=name).exists():
+                default_storage.delete(name)
+                removed += 1
+        self.stdout.write(self.style.SUCCESS(f'Deleted {removed} unused legacy attachment file(s)'))
+
+    def legacy_files(self, directory):
+        if not os.path.isdir(default_storage.path(directory)):
+            return
+        directories, files = default_storage.listdir(directory)
+        for name in files:
+            yield f'{directory}/{name}'
+        for name in directories:
+            yield from self.legacy_files(f'{directory}/{name}')
@@ -0,0 +1,38 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from chat import thumbnails
+
+
+class Command(BaseCommand):
+    help = 'Generate thumbnails and previews for new image attachments (long-running worker)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=None,
+                            help='Image processes in the pool (default: one per CPU)')
+        parser.add_argument('--batch', type=int, default=20, help='Blobs claimed per round')
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help='Seconds to wait before polling again when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty (e.g. from cron)')
+
+    def handle(self, *args, **options):
+        if options['batch'] < 1 or (options['processes'] is not None and options['processes'] < 1):
+            raise CommandError('--batch and --processes must be positive')
+
+        processed = 0
+        with ProcessPoolExecutor(max_workers=options['processes']) as executor:
+            try:
+                while True:
+                    close_old_connections()
+                    count = thumbnails.process_batch(executor, options['batch'])
+                    processed += count
+                    if count:
+                        continue
+                    if options['once']:
+                        break
+                    time.sleep(options['interval'])
+            except KeyboardInterrupt:
+                pass
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} attachment(s)'))
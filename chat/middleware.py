@@ -0,0 +1,70 @@
+"""
+WebSocket authentication for API clients holding simplejwt access tokens.
+
+Browsers keep using the session through AuthMiddlewareStack. Other clients
+send their access token either as the subprotocol pair ("bearer", <token>)
+or as ?token=<token>. The subprotocol is preferred because query strings
+end up in proxy and access logs.
+"""
+from urllib.parse import parse_qs
+from channels.auth import AuthMiddlewareStack
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.contrib.auth.models import AnonymousUser
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from accounts.authentication import CachingJWTAuthentication
+
+BEARER_SUBPROTOCOL = 'bearer'
+
+
+def get_raw_token(scope):
+    """Return (token, subprotocol to accept) from the handshake, or (None, None)."""
+    subprotocols = scope.get('subprotocols') or []
+    if BEARER_SUBPROTOCOL in subprotocols:
+        index = subprotocols.index(BEARER_SUBPROTOCOL)
+        if index + 1 < len(subprotocols):
+            return subprotocols[index + 1], BEARER_SUBPROTOCOL
+
+    query = parse_qs(scope.get('query_string', b'').decode())
+    return query.get('token', [None])[0], None
+
+
+@database_sync_to_async
+def get_user(raw_token):
+    # Same token checks as the API, and the same user cache, so reconnects rarely load the user row
+    authentication = CachingJWTAuthentication()
+    try:
+        return authentication.get_user(authentication.get_validated_token(raw_token))
+    except (InvalidToken, AuthenticationFailed):
+        return AnonymousUser()
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """
+    Sets scope['user'] from a JWT access token when the session did not
+    authenticate the connection. Must run inside AuthMiddlewareStack.
+    """
+
+    async def __call__(self, scope, receive, send):
+        user = scope.get('user')
+        if user is not None and user.is_authenticated:
+            return await super().__call__(scope, receive, send)
+
+        raw_token, subprotocol = get_raw_token(scope)
+        if raw_token:
+            scope = dict(scope, user=await get_user(raw_token))
+
+        if subprotocol is not None:
+            # Browsers drop the connection unless the server echoes one of the offered subprotocols
+            inner_send = send
+
+            async def send(message):
+                if message['type'] == 'websocket.accept' and not message.get('subprotocol'):
+                    message = dict(message, subprotocol=subprotocol)
+                await inner_send(message)
+
+        return await super().__call__(scope, receive, send)
+
+
+def JWTAuthMiddlewareStack(inner):
+    return AuthMiddlewareStack(JWTAuthMiddleware(inner))
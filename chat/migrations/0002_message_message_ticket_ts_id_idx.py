@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:33
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0001_initial'),
+        ('tickets', '0002_ticket_ticket_created_at_id_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['ticket', 'timestamp', 'id'], name='message_ticket_ts_id_idx'),
+        ),
+    ]
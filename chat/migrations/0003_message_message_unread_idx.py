@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:34
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_message_message_ticket_ts_id_idx'),
+        ('tickets', '0003_ticket_ticket_status_created_idx_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('is_read', False)), fields=['ticket', 'sender'], name='message_unread_idx'),
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def seed_read_cursors(apps, schema_editor):
+    """
+    Carry the old global is_read flags over to the ticket's creator and
+    assignee: each is considered to have read up to the newest read message
+    sent by someone else.
+    """
+    Message = apps.get_model('chat', 'Message')
+    Ticket = apps.get_model('tickets', 'Ticket')
+    ReadCursor = apps.get_model('chat', 'ReadCursor')
+
+    newest_read = {}
+    rows = (
+        Message.objects.filter(is_read=True)
+        .values('ticket_id', 'sender_id')
+        .annotate(newest=models.Max('id'))
+    )
+    for row in rows:
+        newest_read.setdefault(row['ticket_id'], {})[row['sender_id']] = row['newest']
+
+    cursors = []
+    tickets = Ticket.objects.filter(id__in=newest_read).values_list('id', 'created_by_id', 'assigned_to_id')
+    for ticket_id, created_by_id, assigned_to_id in tickets:
+        for user_id in {created_by_id, assigned_to_id} - {None}:
+            last_read = max(
+                (newest for sender_id, newest in newest_read[ticket_id].items() if sender_id != user_id),
+                default=0
+            )
+            if last_read:
+                cursors.append(ReadCursor(user_id=user_id, ticket_id=ticket_id, last_read_message_id=last_read))
+
+    ReadCursor.objects.bulk_create(cursors, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_message_message_unread_idx'),
+        ('tickets', '0003_ticket_ticket_status_created_idx_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReadCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read_message_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('ticket', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_cursors', to='tickets.ticket')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_cursors', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='readcursor',
+            constraint=models.UniqueConstraint(fields=('user', 'ticket'), name='unique_read_cursor'),
+        ),
+        migrations.RunPython(seed_read_cursors, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='message',
+            name='message_unread_idx',
+        ),
+        migrations.RemoveField(
+            model_name='message',
+            name='is_read',
+        ),
+    ]
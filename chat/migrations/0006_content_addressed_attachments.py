@@ -0,0 +1,95 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:21
+
+import hashlib
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+
+
+def link_blobs(apps, schema_editor):
+    """
+    Hash the existing attachment files into blobs. The first copy of each
+    content stays where it is and becomes the blob's file. Later copies are
+    left on disk, so a failed or reversed migration loses nothing;
+    `clean_uploads` deletes them. Attachments whose file is missing are
+    left without a blob.
+    """
+    Attachment = apps.get_model('chat', 'Attachment')
+    Blob = apps.get_model('chat', 'Blob')
+
+    for attachment in Attachment.objects.exclude(file='').iterator():
+        name = attachment.file.name
+        if not default_storage.exists(name):
+            continue
+        hasher = hashlib.sha256()
+        with default_storage.open(name, 'rb') as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b''):
+                hasher.update(chunk)
+
+        blob, created = Blob.objects.get_or_create(
+            sha256=hasher.hexdigest(), defaults={'file': name, 'size': default_storage.size(name)}
+        )
+        Blob.objects.filter(pk=blob.pk).update(ref_count=models.F('ref_count') + 1)
+        Attachment.objects.filter(pk=attachment.pk).update(blob=blob)
+
+
+def unlink_blobs(apps, schema_editor):
+    """Point attachments back at their blob's file, which has the same content as their own."""
+    Attachment = apps.get_model('chat', 'Attachment')
+    for attachment in Attachment.objects.filter(blob__isnull=False).select_related('blob').iterator():
+        Attachment.objects.filter(pk=attachment.pk).update(file=attachment.blob.file.name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_message_message_timestamp_idx'),
+        ('tickets', '0005_daily_ticket_metrics'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('file', models.FileField(upload_to='')),
+                ('size', models.BigIntegerField()),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='attachment',
+            name='blob',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='attachments', to='chat.blob'),
+        ),
+        migrations.RunPython(link_blobs, unlink_blobs),
+        # Gives the column a default, so reversing the removal can add it back to existing rows
+        migrations.AlterField(
+            model_name='attachment',
+            name='file',
+            field=models.FileField(blank=True, default='', upload_to='attachments/'),
+        ),
+        migrations.RemoveField(
+            model_name='attachment',
+            name='file',
+        ),
+        migrations.CreateModel(
+            name='Upload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('file_name', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField()),
+                ('offset', models.BigIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('blob', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='chat.blob')),
+                ('ticket', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='uploads', to='tickets.ticket')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='uploads', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
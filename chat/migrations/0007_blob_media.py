@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_content_addressed_attachments'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='media_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('done', 'Done'), ('skipped', 'Not an image'), ('failed', 'Failed')], default='pending', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='preview',
+            field=models.FileField(blank=True, upload_to=''),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='thumbnail',
+            field=models.FileField(blank=True, upload_to=''),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='blob',
+            index=models.Index(condition=models.Q(('media_status__in', ['pending', 'processing'])), fields=['media_status', 'id'], name='blob_media_queue_idx'),
+        ),
+    ]
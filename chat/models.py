@@ -1,3 +1,4 @@
+import uuid
 from django.db import models
 from accounts.models import User
 from tickets.models import Ticket
@@ -8,19 +9,101 @@ class Message(models.Model):
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages')
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
-    is_read = models.BooleanField(default=False)
 
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            # Backs cursor pagination in MessageListCreate and chat history paging
+            models.Index(fields=['ticket', 'timestamp', 'id'], name='message_ticket_ts_id_idx'),
+            # Backs the incremental scan in rollup_metrics
+            models.Index(fields=['timestamp'], name='message_timestamp_idx'),
+        ]
 
     def __str__(self):
         return f"Message from {self.sender.email} at {self.timestamp}"
 
 
+class ReadCursor(models.Model):
+    """The newest message of a ticket that a user has read; everything after it is unread."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='read_cursors')
+    ticket = models.ForeignKey(Ticket, on_delete=models.CASCADE, related_name='read_cursors')
+    last_read_message_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'ticket'], name='unique_read_cursor'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.email} read ticket {self.ticket_id} up to message {self.last_read_message_id}"
+
+
+class Blob(models.Model):
+    """Attachment content, stored once per SHA-256 and shared by every attachment and upload that has it."""
+    MEDIA_PENDING = 'pending'
+    MEDIA_PROCESSING = 'processing'
+    MEDIA_DONE = 'done'
+    MEDIA_SKIPPED = 'skipped'
+    MEDIA_FAILED = 'failed'
+    MEDIA_STATUS_CHOICES = (
+        (MEDIA_PENDING, 'Pending'),
+        (MEDIA_PROCESSING, 'Processing'),
+        (MEDIA_DONE, 'Done'),
+        (MEDIA_SKIPPED, 'Not an image'),
+        (MEDIA_FAILED, 'Failed'),
+    )
+
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField()
+    size = models.BigIntegerField()
+    # Attachments plus finished uploads not yet attached to a message; the blob is deleted at zero
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    # Filled in by `manage.py process_attachments` for images
+    media_status = models.CharField(max_length=20, choices=MEDIA_STATUS_CHOICES, default=MEDIA_PENDING)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    thumbnail = models.FileField(blank=True)
+    preview = models.FileField(blank=True)
+
+    class Meta:
+        indexes = [
+            # The processing queue: only blobs still waiting for (or stuck in) a worker
+            models.Index(
+                fields=['media_status', 'id'],
+                name='blob_media_queue_idx',
+                condition=models.Q(media_status__in=['pending', 'processing'])
+            ),
+        ]
+
+    def __str__(self):
+        return self.sha256
+
+
+class Upload(models.Model):
+    """A resumable chunked upload. `blob` is set, holding one reference, once all bytes have arrived."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='uploads')
+    ticket = models.ForeignKey(Ticket, on_delete=models.CASCADE, related_name='uploads')
+    file_name = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.file_name} ({self.offset}/{self.size} bytes)"
+
+
 class Attachment(models.Model):
     message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='attachments')
-    file = models.FileField(upload_to='attachments/')
+    # Only empty for attachments whose file was already missing when blobs were introduced
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, null=True, related_name='attachments')
     file_name = models.CharField(max_length=255)
 
     def __str__(self):
-        return self.file_name
\ No newline at end of file
+        return self.file_name
@@ -0,0 +1,10 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+from support_system.async_api import AsyncCursorPaginationMixin
+
+
+class MessageCursorPagination(AsyncCursorPaginationMixin, CursorPagination):
+    """Keyset pagination over (timestamp, id), oldest messages first."""
+    ordering = ('timestamp', 'id')
+    page_size_query_param = 'page_size'
+    max_page_size = settings.API_MAX_PAGE_SIZE
@@ -0,0 +1,122 @@
+"""
+Ephemeral "who is viewing this ticket" state.
+
+Presence is never written to the database. Each room is one Redis hash
+with a field per connection (keyed by channel name, so several tabs of the
+same user are tracked independently), updated with HSET/HDEL in MULTI
+pipelines so workers joining and leaving the same room never overwrite
+each other's entries. An entry that misses its heartbeats counts as gone
+after PRESENCE_TTL seconds and is pruned by the next join; the hash itself
+expires PRESENCE_TTL seconds after its last write.
+
+Without CHAT_PRESENCE_REDIS_URL (the in-memory channel layer, one process)
+the rooms are a dict in this process.
+"""
+import asyncio
+import json
+import time
+import weakref
+from django.conf import settings
+from redis.asyncio import Redis
+
+PRESENCE_TTL = getattr(settings, 'CHAT_PRESENCE_TTL', 30)
+PRESENCE_REDIS_URL = getattr(settings, 'CHAT_PRESENCE_REDIS_URL', None)
+
+
+def _key(room_group_name):
+    return f'presence:{room_group_name}'
+
+
+def _viewer(entry):
+    return {key: value for key, value in entry.items() if key != 'expires'}
+
+
+class LocalPresence:
+    """Rooms of a single process. No method awaits, so updates cannot interleave."""
+
+    def __init__(self):
+        self.rooms = {}
+
+    async def join(self, room, channel, entry, now):
+        viewers = self.rooms.setdefault(room, {})
+        for other, viewer in list(viewers.items()):
+            if viewer['expires'] <= now:
+                del viewers[other]
+        others = [viewer for other, viewer in viewers.items() if other != channel]
+        viewers[channel] = entry
+        return others
+
+    async def heartbeat(self, room, channel, entry, now):
+        viewers = self.rooms.setdefault(room, {})
+        previous = viewers.get(channel)
+        viewers[channel] = entry
+        return previous is not None and previous['expires'] > now
+
+    async def leave(self, room, channel):
+        viewers = self.rooms.get(room, {})
+        viewers.pop(channel, None)
+        if not viewers:
+            self.rooms.pop(room, None)
+
+
+class RedisPresence:
+    """Rooms shared by every worker through Redis hashes."""
+
+    def __init__(self, url):
+        self.url = url
+        # Redis connections belong to the event loop that opened them
+        self.clients = weakref.WeakKeyDictionary()
+
+    def client(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self.clients:
+            self.clients[loop] = Redis.from_url(self.url)
+        return self.clients[loop]
+
+    async def join(self, room, channel, entry, now):
+        key = _key(room)
+        async with self.client().pipeline(transaction=True) as pipe:
+            pipe.hgetall(key).hset(key, channel, json.dumps(entry)).expire(key, PRESENCE_TTL)
+            viewers = (await pipe.execute())[0]
+        others, expired = [], []
+        for other, value in viewers.items():
+            viewer = json.loads(value)
+            if viewer['expires'] <= now:
+                expired.append(other)
+            elif other.decode() != channel:
+                others.append(viewer)
+        if expired:
+            # A pruned connection that is still alive re-adds itself with its next heartbeat
+            await self.client().hdel(key, *expired)
+        return others
+
+    async def heartbeat(self, room, channel, entry, now):
+        key = _key(room)
+        async with self.client().pipeline(transaction=True) as pipe:
+            pipe.hget(key, channel).hset(key, channel, json.dumps(entry)).expire(key, PRESENCE_TTL)
+            previous = (await pipe.execute())[0]
+        return previous is not None and json.loads(previous)['expires'] > now
+
+    async def leave(self, room, channel):
+        # Redis drops the hash along with its last field
+        await self.client().hdel(_key(room), channel)
+
+
+store = RedisPresence(PRESENCE_REDIS_URL) if PRESENCE_REDIS_URL else LocalPresence()
+
+
+async def join(room_group_name, channel_name, sender):
+    """Mark a connection as viewing the room; returns the room's viewers (without this connection)."""
+    now = time.time()
+    others = await store.join(room_group_name, channel_name, {**sender, 'expires': now + PRESENCE_TTL}, now)
+    return [_viewer(viewer) for viewer in others]
+
+
+async def heartbeat(room_group_name, channel_name, sender):
+    """Refresh a connection's entry; returns False if it had already expired."""
+    now = time.time()
+    return await store.heartbeat(room_group_name, channel_name, {**sender, 'expires': now + PRESENCE_TTL}, now)
+
+
+async def leave(room_group_name, channel_name):
+    await store.leave(room_group_name, channel_name)
@@ -3,4 +3,5 @@ from . import consumers
 
 websocket_urlpatterns = [
     re_path(r'ws/chat/(?P<ticket_id>\d+)/$', consumers.ChatConsumer.as_asgi()),
-]
\ No newline at end of file
+    re_path(r'ws/feed/$', consumers.FeedConsumer.as_asgi()),
+]
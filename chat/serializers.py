@@ -1,12 +1,60 @@
+from django.db import transaction
+from django.urls import reverse
 from rest_framework import serializers
-from .models import Message, Attachment
+from . import attachments
+from .models import Message, Attachment, Upload
 from accounts.serializers import UserSerializer
+from tickets.models import Ticket
 
 
 class AttachmentSerializer(serializers.ModelSerializer):
+    file = serializers.SerializerMethodField()
+    size = serializers.IntegerField(source='blob.size', read_only=True, default=None)
+    # Images only, once process_attachments has handled them; until then clients show a placeholder
+    width = serializers.IntegerField(source='blob.width', read_only=True, default=None)
+    height = serializers.IntegerField(source='blob.height', read_only=True, default=None)
+    thumbnail = serializers.SerializerMethodField()
+    preview = serializers.SerializerMethodField()
+
     class Meta:
         model = Attachment
-        fields = ['id', 'file', 'file_name']
+        fields = ['id', 'file', 'file_name', 'size', 'width', 'height', 'thumbnail', 'preview']
+
+    def get_file(self, obj):
+        return self.url(obj, 'attachment-download') if obj.blob_id is not None else None
+
+    def get_thumbnail(self, obj):
+        return self.url(obj, 'attachment-thumbnail') if obj.blob_id is not None and obj.blob.thumbnail else None
+
+    def get_preview(self, obj):
+        return self.url(obj, 'attachment-preview') if obj.blob_id is not None and obj.blob.preview else None
+
+    def url(self, obj, name):
+        url = reverse(name, args=[obj.id])
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
+
+
+class UploadSerializer(serializers.ModelSerializer):
+    complete = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Upload
+        fields = ['id', 'ticket', 'file_name', 'size', 'offset', 'complete', 'created_at']
+        read_only_fields = ['offset', 'created_at']
+
+    def get_complete(self, obj):
+        return obj.blob_id is not None
+
+    def validate_ticket(self, value):
+        if not Ticket.objects.visible_to(self.context['request'].user).filter(id=value.id).exists():
+            raise serializers.ValidationError('You cannot attach files to this ticket')
+        return value
+
+    def validate_size(self, value):
+        if not 0 <= value <= attachments.ATTACHMENT_MAX_SIZE:
+            raise serializers.ValidationError(f'Size must be between 0 and {attachments.ATTACHMENT_MAX_SIZE} bytes')
+        return value
 
 
 class MessageSerializer(serializers.ModelSerializer):
@@ -17,15 +65,29 @@ class MessageSerializer(serializers.ModelSerializer):
         write_only=True,
         required=False
     )
+    # Finished uploads (see /api/uploads/) to attach to the message
+    upload_ids = serializers.ListField(
+        child=serializers.UUIDField(),
+        write_only=True,
+        required=False
+    )
 
     class Meta:
         model = Message
-        fields = ['id', 'ticket', 'sender', 'content', 'timestamp', 'is_read', 'sender_details', 'attachments',
-                  'upload_files']
-        read_only_fields = ['sender', 'timestamp', 'is_read']
+        fields = ['id', 'ticket', 'sender', 'content', 'timestamp', 'sender_details', 'attachments',
+                  'upload_files', 'upload_ids']
+        read_only_fields = ['sender', 'timestamp']
 
+    def validate_upload_files(self, value):
+        for file in value:
+            if file.size > attachments.ATTACHMENT_MAX_SIZE:
+                raise serializers.ValidationError(f'{file.name} is larger than {attachments.ATTACHMENT_MAX_SIZE} bytes')
+        return value
+
+    @transaction.atomic
     def create(self, validated_data):
         upload_files = validated_data.pop('upload_files', [])
+        upload_ids = set(validated_data.pop('upload_ids', []))
 
         # Set sender to current user
         validated_data['sender'] = self.context['request'].user
@@ -33,12 +95,25 @@ class MessageSerializer(serializers.ModelSerializer):
         # Create the message
         message = Message.objects.create(**validated_data)
 
-        # Create attachments if any
+        # Finished uploads hand their blob reference over to the attachment
+        uploads = list(Upload.objects.select_for_update().filter(
+            id__in=upload_ids, user=message.sender, ticket=message.ticket, blob__isnull=False
+        ))
+        if len(uploads) != len(upload_ids):
+            raise serializers.ValidationError({'upload_ids': 'Unknown or unfinished upload'})
+        Attachment.objects.bulk_create([
+            Attachment(message=message, blob_id=upload.blob_id, file_name=upload.file_name) for upload in uploads
+        ])
+        # Cleared first, so deleting the uploads does not release the references just handed over
+        Upload.objects.filter(id__in=upload_ids).update(blob=None)
+        Upload.objects.filter(id__in=upload_ids).delete()
+
+        # Files posted with the message are stored the same way, identical content only once
         for file in upload_files:
             Attachment.objects.create(
                 message=message,
-                file=file,
+                blob=attachments.store_file(file),
                 file_name=file.name
             )
 
-        return message
\ No newline at end of file
+        return message
@@ -0,0 +1,34 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from tickets.models import Ticket
+from . import attachments, feed
+from .models import Attachment, Upload
+
+
+@receiver(post_delete, sender=Attachment)
+def release_attachment_blob(sender, instance, **kwargs):
+    # Also runs for attachments deleted along with their message or ticket
+    if instance.blob_id is not None:
+        attachments.release(instance.blob_id)
+
+
+@receiver(post_delete, sender=Upload)
+def release_upload_blob(sender, instance, **kwargs):
+    # A finished upload that was never attached holds a reference too; also runs for cascades from users and tickets
+    if instance.blob_id is not None:
+        attachments.release(instance.blob_id)
+
+
+@receiver(post_save, sender=Ticket)
+def publish_ticket_update(sender, instance, created, **kwargs):
+    # The one place ticket changes reach the dashboards, whichever view or command saved the ticket
+    changes = feed.ticket_changes(instance, created)
+    previous_assignee_id = getattr(instance, 'loaded_values', {}).get('assigned_to_id')
+    instance.loaded_values = {name: getattr(instance, name) for name in Ticket.TRACKED_FIELDS}
+    if not changes:
+        return
+
+    event = feed.ticket_event(instance, changes, previous_assignee_id)
+    # A channel layer outage is logged rather than failing a request whose changes are committed
+    transaction.on_commit(lambda: feed.publish_ticket(event), robust=True)
@@ -0,0 +1,655 @@
+import asyncio
+import hashlib
+import inspect
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import uuid
+from unittest import mock
+from urllib.parse import urlencode
+import redis
+from channels import consumer as channels_consumer
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+from accounts.authentication import user_cache
+from accounts.models import SupportProfile, User
+from search.models import SearchDocument
+from support_system.asgi import application
+from support_system.instrumentation import registry
+from tickets.models import Ticket
+from . import attachments, consumers, presence
+from .consumers import ChatConsumer, run_later
+from .buffer import MessageWriteBuffer
+from .models import Attachment, Blob, Message, Upload
+
+
+class MessageWriteBufferTests(TestCase):
+    """Buffered messages that fail to write are retried, and only unstorable ones are dropped."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user(email='customer@example.com', password='pass',
+                                                first_name='Customer', last_name='One', user_type='user')
+        cls.ticket = Ticket.objects.create(title='Printer', description='On fire', created_by=cls.customer)
+
+    def setUp(self):
+        self.buffer = MessageWriteBuffer(interval=60, max_size=100, max_attempts=3)
+
+    def tearDown(self):
+        if self.buffer.timer is not None:
+            self.buffer.timer.cancel()
+
+    def message(self, content):
+        return Message(ticket=self.ticket, sender=self.customer, content=content)
+
+    def counter(self, name):
+        return registry.values.get((name, ()), 0)
+
+    async def test_failed_batch_is_retried(self):
+        write = MessageWriteBuffer.write
+        calls = []
+
+        def fail_once(batch):
+            calls.append(len(batch))
+            if len(calls) == 1:
+                raise OSError('database is down')
+            write(batch)
+
+        failures = self.counter('chat_write_behind_failures_total')
+        with mock.patch.object(MessageWriteBuffer, 'write', side_effect=fail_once):
+            for content in ('one', 'two'):
+                await self.buffer.add(self.message(content))
+            with self.assertLogs('chat.buffer', 'ERROR') as logs:
+                await self.buffer.flush()
+            self.assertIn('database is down', logs.output[0])
+            self.assertEqual([message.content for message in self.buffer.pending], ['one', 'two'])
+            self.assertIsNotNone(self.buffer.timer)
+
+            await self.buffer.add(self.message('three'))
+            await self.buffer.flush()
+        self.assertEqual(calls, [2, 3])
+        self.assertEqual(self.buffer.pending, [])
+        self.assertEqual(self.counter('chat_write_behind_failures_total'), failures + 1)
+        self.assertEqual([content async for content in Message.objects.values_list('content', flat=True)],
+                         ['one', 'two', 'three'])
+        self.assertEqual(await SearchDocument.objects.filter(kind=SearchDocument.MESSAGE).acount(), 3)
+
+    async def test_unstorable_message_is_dropped_after_max_attempts(self):
+        dropped = self.counter('chat_write_behind_dropped_total')
+        # NULL content fails every bulk INSERT the message is part of
+        for content in ('one', None, 'three'):
+            await self.buffer.add(self.message(content))
+        with self.assertLogs('chat.buffer', 'ERROR'):
+            for _ in range(3):
+                await self.buffer.flush()
+        self.assertEqual(self.buffer.pending, [])
+        self.assertEqual(self.counter('chat_write_behind_dropped_total'), dropped + 1)
+        self.assertEqual([content async for content in Message.objects.values_list('content', flat=True)],
+                         ['one', 'three'])
+        self.assertEqual(await SearchDocument.objects.filter(kind=SearchDocument.MESSAGE).acount(), 2)
+
+
+class ChatConsumerDispatchTests(SimpleTestCase):
+    """
+    ChatConsumer.dispatch is channels' AsyncConsumer.dispatch without the
+    aclose_old_connections() call; these fail if upstream changes it.
+    """
+
+    async def dispatch(self, dispatch, consumer, message):
+        with mock.patch.object(channels_consumer, 'aclose_old_connections') as aclose:
+            try:
+                await dispatch(consumer, message)
+            except ValueError as error:
+                return str(error), aclose.await_count
+            return consumer.handle_event.await_args, aclose.await_count
+
+    async def test_matches_upstream(self):
+        self.assertEqual(inspect.signature(ChatConsumer.dispatch),
+                         inspect.signature(channels_consumer.AsyncConsumer.dispatch))
+        for message in ({'type': 'handle.event', 'text': 'hi'}, {'type': 'no.such_event'}):
+            with self.subTest(message=message):
+                upstream_consumer = channels_consumer.AsyncConsumer()
+                upstream_consumer.handle_event = mock.AsyncMock()
+                consumer = ChatConsumer()
+                consumer.handle_event = mock.AsyncMock()
+                upstream, upstream_closes = await self.dispatch(
+                    channels_consumer.AsyncConsumer.dispatch, upstream_consumer, message
+                )
+                ours, closes = await self.dispatch(ChatConsumer.dispatch, consumer, message)
+                self.assertEqual(ours, upstream)
+                # Upstream closes old connections before a handler, ours never does
+                self.assertEqual(upstream_closes, 1 if message['type'] == 'handle.event' else 0)
+                self.assertEqual(closes, 0)
+
+
+class RunLaterTests(SimpleTestCase):
+
+    async def test_errors_are_logged(self):
+        async def flush():
+            raise RuntimeError('socket gone')
+
+        with self.assertLogs('chat.consumers', 'ERROR') as logs:
+            await run_later(0, flush)
+        self.assertIn('socket gone', logs.output[0])
+        self.assertIn('RunLaterTests.test_errors_are_logged.<locals>.flush', logs.output[0])
+
+    async def test_cancelled_timer_does_not_run(self):
+        calls = []
+
+        async def flush():
+            calls.append(True)
+
+        timer = run_later(0.01, flush)
+        timer.cancel()
+        await asyncio.sleep(0.02)
+        self.assertTrue(timer.cancelled())
+        self.assertEqual(calls, [])
+
+
+PRESENCE_REDIS_URL = getattr(settings, 'CHAT_PRESENCE_REDIS_URL', None) or 'redis://127.0.0.1:6379/1'
+
+
+def redis_available():
+    try:
+        return redis.Redis.from_url(PRESENCE_REDIS_URL, socket_connect_timeout=0.2).ping()
+    except redis.RedisError:
+        return False
+
+
+class PresenceMixin:
+    """Joins, heartbeats and leaves of the same room from concurrent connections."""
+
+    def setUp(self):
+        patcher = mock.patch.object(presence, 'store', self.make_store())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.room = f'chat_test_{uuid.uuid4().hex}'
+
+    def viewer(self, n):
+        return {'user_id': n, 'name': f'User {n}', 'connection': f'channel-{n}'}
+
+    async def test_join_heartbeat_leave(self):
+        self.assertEqual(await presence.join(self.room, 'channel-1', self.viewer(1)), [])
+        self.assertEqual(await presence.join(self.room, 'channel-2', self.viewer(2)), [self.viewer(1)])
+        self.assertTrue(await presence.heartbeat(self.room, 'channel-1', self.viewer(1)))
+        await presence.leave(self.room, 'channel-1')
+        self.assertFalse(await presence.heartbeat(self.room, 'channel-1', self.viewer(1)))
+        await presence.leave(self.room, 'channel-1')
+        await presence.leave(self.room, 'channel-2')
+        self.assertEqual(await presence.join(self.room, 'channel-3', self.viewer(3)), [])
+        await presence.leave(self.room, 'channel-3')
+
+    async def test_concurrent_joins_and_leaves_keep_every_viewer(self):
+        await asyncio.gather(*(presence.join(self.room, f'channel-{n}', self.viewer(n)) for n in range(20)))
+        await asyncio.gather(*(presence.leave(self.room, f'channel-{n}') for n in range(0, 20, 2)))
+        viewers = await presence.join(self.room, 'channel-last', self.viewer('last'))
+        self.assertCountEqual(viewers, [self.viewer(n) for n in range(1, 20, 2)])
+        for n in [*range(1, 20, 2), 'last']:
+            await presence.leave(self.room, f'channel-{n}')
+
+    async def test_missed_heartbeats_expire(self):
+        await presence.join(self.room, 'channel-1', self.viewer(1))
+        with mock.patch.object(time, 'time', return_value=time.time() + presence.PRESENCE_TTL + 1):
+            self.assertEqual(await presence.join(self.room, 'channel-2', self.viewer(2)), [])
+            self.assertFalse(await presence.heartbeat(self.room, 'channel-1', self.viewer(1)))
+        await presence.leave(self.room, 'channel-1')
+        await presence.leave(self.room, 'channel-2')
+
+
+class LocalPresenceTests(PresenceMixin, SimpleTestCase):
+
+    def make_store(self):
+        return presence.LocalPresence()
+
+
+@unittest.skipUnless(redis_available(), 'Redis is not running')
+class RedisPresenceTests(PresenceMixin, SimpleTestCase):
+
+    def make_store(self):
+        return presence.RedisPresence(PRESENCE_REDIS_URL)
+
+
+# The WebSocket tests run in one process, without Redis
+SINGLE_PROCESS_SETTINGS = {
+    'CHANNEL_LAYERS': {'default': {'BACKEND': 'chat.layers.FanoutInMemoryChannelLayer'}},
+    'CACHES': {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+}
+
+
+@override_settings(**SINGLE_PROCESS_SETTINGS)
+class WebSocketTestCase(TestCase):
+    """Connects through the project's ASGI application, authenticating with JWTs."""
+
+    def setUp(self):
+        patcher = mock.patch.object(presence, 'store', presence.LocalPresence())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Ticket and user ids are reused between tests
+        cache.clear()
+        user_cache.clear()
+        self.addCleanup(user_cache.clear)
+
+    async def connect(self, path, user=None, **params):
+        if user is not None:
+            params['token'] = str(AccessToken.for_user(user))
+        communicator = WebsocketCommunicator(application, f'{path}?{urlencode(params)}')
+        connected, _ = await communicator.connect()
+        return communicator, connected
+
+    async def receive(self, communicator, frame_type):
+        """The next frame of `frame_type`, skipping others (e.g. presence updates)."""
+        while True:
+            frame = await communicator.receive_json_from()
+            if frame['type'] == frame_type:
+                return frame
+
+
+class ChatConsumerTests(WebSocketTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user(email='customer@example.com', password='pass',
+                                                first_name='Customer', last_name='One', user_type='user')
+        cls.other_customer = User.objects.create_user(email='other@example.com', password='pass',
+                                                      first_name='Other', last_name='Customer', user_type='user')
+        cls.agent = User.objects.create_user(email='agent@example.com', password='pass', first_name='Agent',
+                                             last_name='Smith', user_type='support')
+        cls.other_agent = User.objects.create_user(email='agent2@example.com', password='pass',
+                                                   first_name='Other', last_name='Agent', user_type='support')
+        for agent in (cls.agent, cls.other_agent):
+            SupportProfile.objects.create(user=agent)
+        cls.ticket = Ticket.objects.create(title='Printer', description='On fire', created_by=cls.customer,
+                                           assigned_to=cls.agent)
+        cls.messages = Message.objects.bulk_create([
+            Message(ticket=cls.ticket, sender=cls.customer, content=f'Message {i}') for i in range(12)
+        ])
+        cls.path = f'/ws/chat/{cls.ticket.id}/'
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(consumers, 'CHAT_HISTORY_PAGE_SIZE', 5)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def contents(self, frame):
+        return [message['message'] for message in frame['messages']]
+
+    async def test_rejects_anonymous_users(self):
+        for params in ({}, {'token': 'not-a-token'}):
+            with self.subTest(params=params):
+                communicator, connected = await self.connect(self.path, **params)
+                self.assertFalse(connected)
+
+    async def test_rejects_users_without_access(self):
+        for user in (self.other_customer, self.other_agent):
+            with self.subTest(user=user.email):
+                communicator, connected = await self.connect(self.path, user)
+                self.assertFalse(connected)
+        communicator, connected = await self.connect('/ws/chat/999999/', self.customer)
+        self.assertFalse(connected)
+
+    async def test_history_and_load_older(self):
+        communicator, connected = await self.connect(self.path, self.customer)
+        self.assertTrue(connected)
+        history = await self.receive(communicator, 'chat_history')
+        self.assertEqual(self.contents(history), [f'Message {i}' for i in range(7, 12)])
+        self.assertTrue(history['has_more'])
+
+        pages = []
+        oldest = history['messages'][0]
+        has_more = True
+        while has_more:
+            await communicator.send_json_to({'command': 'load_older', 'before': oldest})
+            page = await self.receive(communicator, 'chat_history_page')
+            pages.append(self.contents(page))
+            oldest, has_more = page['messages'][0], page['has_more']
+        self.assertEqual(pages, [[f'Message {i}' for i in range(2, 7)], ['Message 0', 'Message 1']])
+
+        await communicator.send_json_to({'command': 'load_older', 'before': {'id': 'x'}})
+        self.assertEqual((await self.receive(communicator, 'error'))['error'], 'Invalid history cursor')
+        await communicator.disconnect()
+
+    async def test_resume_since(self):
+        communicator, _ = await self.connect(self.path, self.customer, since=self.messages[8].id)
+        resume = await self.receive(communicator, 'chat_resume')
+        self.assertEqual(self.contents(resume), ['Message 9', 'Message 10', 'Message 11'])
+        await communicator.disconnect()
+
+        # A gap over CHAT_RESUME_LIMIT, or a bad cursor, gets a fresh snapshot instead
+        with mock.patch.object(consumers, 'CHAT_RESUME_LIMIT', 2):
+            for since in (self.messages[8].id, 'garbage'):
+                with self.subTest(since=since):
+                    communicator, _ = await self.connect(self.path, self.customer, since=since)
+                    history = await self.receive(communicator, 'chat_history')
+                    self.assertEqual(self.contents(history), [f'Message {i}' for i in range(7, 12)])
+                    await communicator.disconnect()
+
+    async def test_messages_reach_the_room_as_their_sender(self):
+        customer, _ = await self.connect(self.path, self.customer)
+        agent, _ = await self.connect(self.path, self.agent)
+        for communicator in (customer, agent):
+            await self.receive(communicator, 'chat_history')
+
+        await customer.send_json_to({'message': 'Still on fire', 'user_id': self.agent.id})
+        for communicator in (customer, agent):
+            frame = await self.receive(communicator, 'chat_message')
+            self.assertEqual((frame['message'], frame['user_id']), ('Still on fire', self.customer.id))
+        message = await Message.objects.aget(id=frame['id'])
+        self.assertEqual(message.sender_id, self.customer.id)
+        for communicator in (customer, agent):
+            await communicator.disconnect()
+
+    async def test_typing_indicator_times_out(self):
+        customer, _ = await self.connect(self.path, self.customer)
+        agent, _ = await self.connect(self.path, self.agent)
+        snapshot = await self.receive(agent, 'presence')
+        self.assertEqual([viewer['state'] for viewer in snapshot['viewers']], ['viewing'])
+        # Shorter than the timeout, so "typing" is not merged away
+        with mock.patch.object(consumers, 'CHAT_PRESENCE_COALESCE_WINDOW', 0.01), \
+                mock.patch.object(consumers, 'CHAT_TYPING_TIMEOUT', 0.2):
+            await customer.send_json_to({'command': 'typing'})
+            states = []
+            while states[-1:] != ['viewing']:
+                frame = await self.receive(agent, 'presence')
+                states.extend(viewer['state'] for viewer in frame['viewers']
+                              if viewer.get('user_id') == self.customer.id)
+        self.assertIn('typing', states)
+        for communicator in (customer, agent):
+            await communicator.disconnect()
+
+    async def test_mark_read_and_new_messages_update_unread_counts(self):
+        feed, connected = await self.connect('/ws/feed/', self.agent)
+        self.assertTrue(connected)
+        agent, _ = await self.connect(self.path, self.agent)
+        await self.receive(agent, 'chat_history')
+
+        await agent.send_json_to({'command': 'mark_read', 'message_id': self.messages[8].id})
+        self.assertEqual(await self.receive(feed, 'unread'), {'type': 'unread', 'ticket': self.ticket.id, 'count': 3})
+        await agent.send_json_to({'command': 'mark_read'})
+        self.assertEqual(await self.receive(feed, 'unread'), {'type': 'unread', 'ticket': self.ticket.id, 'count': 0})
+
+        customer, _ = await self.connect(self.path, self.customer)
+        await customer.send_json_to({'message': 'Any news?'})
+        self.assertEqual(await self.receive(feed, 'unread'), {'type': 'unread', 'ticket': self.ticket.id, 'delta': 1})
+        for communicator in (feed, agent, customer):
+            await communicator.disconnect()
+
+
+class FeedConsumerTests(WebSocketTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(email='admin@example.com', password='pass', first_name='Ada',
+                                             last_name='Admin', user_type='admin')
+        cls.customer = User.objects.create_user(email='customer@example.com', password='pass',
+                                                first_name='Customer', last_name='One', user_type='user')
+        cls.agent = User.objects.create_user(email='agent@example.com', password='pass', first_name='Agent',
+                                             last_name='Smith', user_type='support')
+        SupportProfile.objects.create(user=cls.agent)
+        cls.ticket = Ticket.objects.create(title='Printer', description='On fire', created_by=cls.customer)
+
+    @database_sync_to_async
+    def update_ticket(self, **changes):
+        # The feed is published after commit
+        with self.captureOnCommitCallbacks(execute=True):
+            ticket = Ticket.objects.get(pk=self.ticket.pk)
+            for field, value in changes.items():
+                setattr(ticket, field, value)
+            ticket.save()
+
+    async def test_rejects_anonymous_users(self):
+        communicator, connected = await self.connect('/ws/feed/')
+        self.assertFalse(connected)
+
+    async def test_ticket_updates_are_coalesced(self):
+        feed, _ = await self.connect('/ws/feed/', self.admin)
+        await self.update_ticket(status='in_progress')
+        await self.update_ticket(assigned_to=self.agent)
+        await self.update_ticket(status='resolved')
+
+        frame = await self.receive(feed, 'tickets')
+        self.assertEqual(len(frame['tickets']), 1)
+        ticket = frame['tickets'][0]
+        self.assertEqual((ticket['ticket'], ticket['status'], ticket['assigned_to']),
+                         (self.ticket.id, 'resolved', self.agent.id))
+        self.assertEqual(ticket['changes'], ['assigned', 'status'])
+        self.assertEqual(ticket['assigned_to_name'], 'Agent Smith')
+        self.assertTrue(await feed.receive_nothing(consumers.FEED_TICKET_COALESCE_WINDOW + 0.1))
+        await feed.disconnect()
+
+    async def test_participants_get_each_update_once(self):
+        customer, _ = await self.connect('/ws/feed/', self.customer)
+        agent, _ = await self.connect('/ws/feed/', self.agent)
+        await self.update_ticket(assigned_to=self.agent)
+        for communicator in (customer, agent):
+            frame = await self.receive(communicator, 'tickets')
+            self.assertEqual([ticket['changes'] for ticket in frame['tickets']], [['assigned']])
+            self.assertTrue(await communicator.receive_nothing(consumers.FEED_TICKET_COALESCE_WINDOW + 0.1))
+            await communicator.disconnect()
+
+
+class MediaRootMixin:
+    """Files go to a temporary MEDIA_ROOT that is removed after each test."""
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media_root = self.settings(MEDIA_ROOT=self.media_root)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        patcher = mock.patch.object(attachments, 'ATTACHMENT_UPLOAD_DIR', os.path.join(self.media_root, 'uploads'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        attachments.hashers.clear()
+
+
+CONTENT = b'0123456789'
+SHA256 = hashlib.sha256(CONTENT).hexdigest()
+
+
+@override_settings(**SINGLE_PROCESS_SETTINGS)
+class AttachmentUploadTests(MediaRootMixin, APITestCase):
+    """Resumable uploads, content-addressed blobs and attachment downloads."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user(email='customer@example.com', password='pass',
+                                                first_name='Customer', last_name='One', user_type='user')
+        cls.other_customer = User.objects.create_user(email='other@example.com', password='pass',
+                                                      first_name='Other', last_name='Customer', user_type='user')
+        cls.ticket = Ticket.objects.create(title='Printer', description='On fire', created_by=cls.customer)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.customer)
+
+    def create_upload(self, size=len(CONTENT), file_name='log.txt'):
+        response = self.client.post('/api/uploads/', {'ticket': self.ticket.id, 'file_name': file_name,
+                                                      'size': size}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response['Upload-Offset'], '0')
+        return response.data['id']
+
+    def patch(self, upload_id, data, offset):
+        return self.client.generic('PATCH', f'/api/uploads/{upload_id}/', data,
+                                   content_type='application/offset+octet-stream', HTTP_UPLOAD_OFFSET=str(offset))
+
+    def upload(self, content=CONTENT):
+        upload_id = self.create_upload(len(content))
+        response = self.patch(upload_id, content, 0)
+        self.assertTrue(response.data['complete'])
+        return upload_id
+
+    def blob(self):
+        return Blob.objects.get(sha256=SHA256)
+
+    def post_message(self, **data):
+        data = {'ticket': self.ticket.id, 'content': 'See attached', **data}
+        response = self.client.post(f'/api/tickets/{self.ticket.id}/messages/', data)
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data
+
+    def test_chunks_resume_at_the_recorded_offset(self):
+        upload_id = self.create_upload()
+        response = self.patch(upload_id, CONTENT[:4], 0)
+        self.assertEqual((response.status_code, response['Upload-Offset']), (200, '4'))
+
+        response = self.patch(upload_id, CONTENT[2:], 2)
+        self.assertEqual((response.status_code, response['Upload-Offset']), (409, '4'))
+        response = self.client.head(f'/api/uploads/{upload_id}/')
+        self.assertEqual(response['Upload-Offset'], '4')
+
+        # The next chunk lands on a process that never saw the first one
+        attachments.hashers.clear()
+        response = self.patch(upload_id, CONTENT[4:], 4)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['complete'])
+        blob = self.blob()
+        self.assertEqual((blob.size, blob.ref_count), (len(CONTENT), 1))
+        with default_storage.open(blob.file.name) as f:
+            self.assertEqual(f.read(), CONTENT)
+
+        response = self.patch(upload_id, b'x', len(CONTENT))
+        self.assertEqual(response.status_code, 409)
+
+    def test_chunk_past_the_size_is_rejected(self):
+        upload_id = self.create_upload()
+        response = self.patch(upload_id, CONTENT + b'!', 0)
+        self.assertEqual((response.status_code, response['Upload-Offset']), (413, '0'))
+        response = self.patch(upload_id, CONTENT[:6], 0)
+        self.assertEqual(response['Upload-Offset'], '6')
+        response = self.patch(upload_id, CONTENT[6:] + b'!', 6)
+        self.assertEqual((response.status_code, response['Upload-Offset']), (413, '6'))
+        response = self.patch(upload_id, CONTENT[6:], 6)
+        self.assertTrue(response.data['complete'])
+        self.assertEqual(self.blob().sha256, SHA256)
+
+    def test_upload_size_is_limited(self):
+        with mock.patch.object(attachments, 'ATTACHMENT_MAX_SIZE', 5):
+            response = self.client.post('/api/uploads/', {'ticket': self.ticket.id, 'file_name': 'big.bin',
+                                                          'size': 6}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('size', response.data)
+
+    def test_uploads_need_ticket_access(self):
+        self.client.force_authenticate(self.other_customer)
+        response = self.client.post('/api/uploads/', {'ticket': self.ticket.id, 'file_name': 'log.txt',
+                                                      'size': 1}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('ticket', response.data)
+
+    def test_identical_content_is_stored_once(self):
+        upload_ids = [self.upload(), self.upload()]
+        self.assertEqual(self.blob().ref_count, 2)
+
+        message = self.post_message(upload_ids=upload_ids,
+                                    upload_files=[SimpleUploadedFile('copy.txt', CONTENT)])
+        self.assertEqual(len(message['attachments']), 3)
+        # The uploads handed their references to the attachments
+        self.assertFalse(Upload.objects.exists())
+        self.assertEqual(Blob.objects.count(), 1)
+        blob = self.blob()
+        self.assertEqual(blob.ref_count, 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.get(pk=message['id']).delete()
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(default_storage.exists(blob.file.name))
+
+    def test_discarding_an_upload_releases_its_blob(self):
+        kept = self.upload()
+        discarded = self.upload()
+        self.assertEqual(self.client.delete(f'/api/uploads/{discarded}/').status_code, 204)
+        self.assertEqual(self.blob().ref_count, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.delete(f'/api/uploads/{kept}/').status_code, 204)
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(default_storage.exists(attachments.blob_name(SHA256)))
+
+    def test_download(self):
+        message = self.post_message(upload_ids=[self.upload()])
+        attachment = message['attachments'][0]
+        url = reverse('attachment-download', args=[attachment['id']])
+        self.assertEqual(url, f'/api/attachments/{attachment["id"]}/download/')
+        self.assertEqual(attachment['file'], f'http://testserver{url}')
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), CONTENT)
+        self.assertEqual(response['ETag'], f'"{SHA256}"')
+        self.assertIn('attachment', response['Content-Disposition'])
+
+        for header, status_code, body, content_range in (
+                ('bytes=2-5', 206, CONTENT[2:6], f'bytes 2-5/{len(CONTENT)}'),
+                ('bytes=-3', 206, CONTENT[-3:], f'bytes 7-9/{len(CONTENT)}'),
+                ('bytes=50-', 416, b'', f'bytes */{len(CONTENT)}')):
+            with self.subTest(range=header):
+                response = self.client.get(url, HTTP_RANGE=header)
+                self.assertEqual(response.status_code, status_code)
+                self.assertEqual(response['Content-Range'], content_range)
+                content = b''.join(response.streaming_content) if response.streaming else response.content
+                self.assertEqual(content, body)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=f'"{SHA256}"')
+        self.assertEqual(response.status_code, 304)
+
+        self.client.force_authenticate(self.other_customer)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class ContentAddressedAttachmentsMigrationTests(MediaRootMixin, TransactionTestCase):
+    """chat 0006 moves attachment files into blobs without deleting any, and can be reversed."""
+    before = [('chat', '0005_message_message_timestamp_idx')]
+    after = [('chat', '0006_content_addressed_attachments')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+        super().tearDown()
+
+    def test_forwards_and_backwards(self):
+        apps = self.migrate(self.before)
+        User_ = apps.get_model('accounts', 'User')
+        user = User_.objects.create(email='customer@example.com', first_name='Customer', last_name='One',
+                                    user_type='user')
+        ticket = apps.get_model('tickets', 'Ticket').objects.create(title='Printer', description='On fire',
+                                                                    created_by=user)
+        message = apps.get_model('chat', 'Message').objects.create(ticket=ticket, sender=user, content='Logs')
+        names = [default_storage.save(f'attachments/{name}', SimpleUploadedFile(name, CONTENT))
+                 for name in ('first.txt', 'second.txt')]
+        old_attachment = apps.get_model('chat', 'Attachment')
+        ids = [old_attachment.objects.create(message=message, file=name).id for name in names]
+        missing = old_attachment.objects.create(message=message, file='attachments/gone.txt').id
+
+        apps = self.migrate(self.after)
+        blob = apps.get_model('chat', 'Blob').objects.get()
+        self.assertEqual((blob.sha256, blob.file.name, blob.ref_count), (SHA256, names[0], 2))
+        attachment = apps.get_model('chat', 'Attachment')
+        self.assertEqual(set(attachment.objects.filter(id__in=ids).values_list('blob', flat=True)), {blob.id})
+        self.assertIsNone(attachment.objects.get(id=missing).blob_id)
+        # The duplicate stays on disk until clean_uploads
+        self.assertTrue(all(default_storage.exists(name) for name in names))
+
+        apps = self.migrate(self.before)
+        attachment = apps.get_model('chat', 'Attachment')
+        self.assertEqual(list(attachment.objects.filter(id__in=ids).values_list('file', flat=True)),
+                         [names[0], names[0]])
+        self.assertTrue(all(default_storage.exists(name) for name in names))
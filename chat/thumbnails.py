@@ -0,0 +1,106 @@
+"""
+Thumbnails and previews for image attachments.
+
+Uploads never decode images. New blobs start out pending, and
+`manage.py process_attachments` works through them: the worker claims a
+batch in the database, decodes and resizes in a process pool (Pillow work
+is CPU bound and holds the GIL), then records the dimensions and the
+generated files. Blob rows are the queue, so several workers can run side
+by side, and a claim older than ATTACHMENT_PROCESSING_TIMEOUT (a worker
+that died mid-batch) is picked up again.
+"""
+import logging
+import os
+from datetime import timedelta
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import Q
+from django.utils import timezone
+from PIL import Image, ImageOps, UnidentifiedImageError
+from .models import Blob
+
+logger = logging.getLogger(__name__)
+
+# Longest side, in pixels, of the generated images
+ATTACHMENT_THUMBNAIL_SIZE = getattr(settings, 'ATTACHMENT_THUMBNAIL_SIZE', 256)
+ATTACHMENT_PREVIEW_SIZE = getattr(settings, 'ATTACHMENT_PREVIEW_SIZE', 1024)
+# Seconds after which a blob claimed by a worker is considered abandoned
+ATTACHMENT_PROCESSING_TIMEOUT = getattr(settings, 'ATTACHMENT_PROCESSING_TIMEOUT', 300)
+
+VARIANTS = (
+    ('thumbnail', ATTACHMENT_THUMBNAIL_SIZE),
+    ('preview', ATTACHMENT_PREVIEW_SIZE),
+)
+
+
+def variant_name(sha256, variant):
+    return f'thumbs/{sha256[:2]}/{sha256[2:4]}/{sha256}-{variant}.webp'
+
+
+def generate(path, sha256):
+    """
+    Decode the image at `path` and write its variants. Runs in a pool
+    process, so it only touches files: returns the Blob fields to update.
+    """
+    try:
+        with Image.open(path) as image:
+            # Animated images use their first frame
+            image.seek(0)
+            image = ImageOps.exif_transpose(image)
+            width, height = image.size
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+
+            fields = {'width': width, 'height': height, 'media_status': Blob.MEDIA_DONE}
+            for variant, bound in VARIANTS:
+                resized = image.copy()
+                resized.thumbnail((bound, bound), Image.Resampling.LANCZOS)
+                name = variant_name(sha256, variant)
+                target = default_storage.path(name)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                resized.save(target, 'WEBP', quality=80, method=4)
+                fields[variant] = name
+            return fields
+    except UnidentifiedImageError:
+        return {'media_status': Blob.MEDIA_SKIPPED}
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        logger.warning(f"Could not process blob {sha256}: {e}")
+        return {'media_status': Blob.MEDIA_FAILED}
+
+
+def claim(batch_size):
+    """Mark up to `batch_size` queued blobs as taken by this worker and return them."""
+    now = timezone.now()
+    stale = now - timedelta(seconds=ATTACHMENT_PROCESSING_TIMEOUT)
+    waiting = Q(media_status=Blob.MEDIA_PENDING) | Q(media_status=Blob.MEDIA_PROCESSING, claimed_at__lt=stale)
+    candidates = list(Blob.objects.filter(waiting).order_by('id').values_list('id', flat=True)[:batch_size])
+    if not candidates:
+        return []
+
+    # Conditional update, so a blob another worker claimed in between is not taken twice
+    Blob.objects.filter(waiting, id__in=candidates).update(media_status=Blob.MEDIA_PROCESSING, claimed_at=now)
+    return list(Blob.objects.filter(id__in=candidates, media_status=Blob.MEDIA_PROCESSING, claimed_at=now))
+
+
+def process_batch(executor, batch_size):
+    """Claim and process one batch in `executor`; returns how many blobs it held."""
+    blobs = claim(batch_size)
+    futures = [
+        (blob, executor.submit(generate, default_storage.path(blob.file.name), blob.sha256))
+        for blob in blobs
+    ]
+    for blob, future in futures:
+        try:
+            fields = future.result()
+        except Exception as e:
+            logger.error(f"Processing blob {blob.sha256} crashed: {e}")
+            fields = {'media_status': Blob.MEDIA_FAILED}
+        # Leaves blobs released while they were processed alone; their files go with them below
+        if not Blob.objects.filter(pk=blob.pk).update(claimed_at=None, **fields):
+            delete_variants(blob.sha256)
+    return len(blobs)
+
+
+def delete_variants(sha256):
+    for variant, _ in VARIANTS:
+        default_storage.delete(variant_name(sha256, variant))
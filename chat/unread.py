@@ -0,0 +1,83 @@
+"""
+Per-user unread state.
+
+Each reader has one ReadCursor row per ticket holding the newest message id
+they have read, so marking a ticket read is a single-row upsert and "unread"
+is every later message sent by someone else. Counts for all of a user's
+tickets come from one grouped query; live changes are pushed to each
+reader's feed group (see FeedConsumer) as deltas.
+"""
+from django.db.models import Count, F, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from tickets.models import Ticket
+from .models import Message, ReadCursor
+
+# Admins can read every ticket, so they all share one feed group
+ADMIN_FEED_GROUP = 'feed_admins'
+
+
+def feed_group(user_id):
+    return f'feed_{user_id}'
+
+
+def unread_counts(user, ticket_ids=None):
+    """Return {ticket_id: unread count} for the tickets visible to `user`; tickets with nothing unread are left out."""
+    last_read = ReadCursor.objects.filter(
+        user=user, ticket=OuterRef('ticket_id')
+    ).values('last_read_message_id')[:1]
+
+    messages = Message.objects.filter(ticket__in=Ticket.objects.visible_to(user)).exclude(sender=user)
+    if ticket_ids is not None:
+        messages = messages.filter(ticket_id__in=ticket_ids)
+
+    rows = (
+        messages.annotate(last_read=Coalesce(Subquery(last_read), 0))
+        .filter(id__gt=F('last_read'))
+        .values('ticket_id')
+        .annotate(unread=Count('id'))
+        .order_by()
+    )
+    return {row['ticket_id']: row['unread'] for row in rows}
+
+
+def mark_read(user, ticket_id, message_id=None):
+    """
+    Move the user's cursor for a ticket forward to `message_id` (by default
+    the newest message) and return the number of messages still unread.
+    The cursor never moves backwards, so late or duplicate calls are harmless.
+    """
+    if message_id is None:
+        message_id = Message.objects.filter(ticket_id=ticket_id).aggregate(newest=Max('id'))['newest'] or 0
+
+    moved = ReadCursor.objects.filter(
+        user=user, ticket_id=ticket_id, last_read_message_id__lt=message_id
+    ).update(last_read_message_id=message_id, updated_at=timezone.now())
+    if not moved:
+        ReadCursor.objects.get_or_create(user=user, ticket_id=ticket_id, defaults={'last_read_message_id': message_id})
+
+    return unread_counts(user, [ticket_id]).get(ticket_id, 0)
+
+
+async def publish_new_message(channel_layer, ticket_id, sender_id, participants):
+    """Tell every reader of a ticket, other than the sender, that it has one more unread message."""
+    event = {
+        'type': 'unread_delta',
+        'ticket': ticket_id,
+        'sender': sender_id,
+        'participants': [user_id for user_id in participants if user_id is not None],
+        'delta': 1
+    }
+    for user_id in event['participants']:
+        if user_id != sender_id:
+            await channel_layer.group_send(feed_group(user_id), event)
+    await channel_layer.group_send(ADMIN_FEED_GROUP, {**event, 'admins': True})
+
+
+async def publish_count(channel_layer, user_id, ticket_id, count):
+    """Send a user's absolute unread count for a ticket to all of their open feeds (e.g. after mark_read)."""
+    await channel_layer.group_send(feed_group(user_id), {
+        'type': 'unread_count',
+        'ticket': ticket_id,
+        'count': count
+    })
@@ -1,10 +1,20 @@
 from django.urls import path
+from support_system.async_api import read_view
 from . import views
 
 urlpatterns = [
     path('<int:ticket_id>/', views.chat_room, name='chat_room'),
-    path('tickets/<int:ticket_id>/messages/', views.MessageListCreate.as_view(), name='messages'),
+    path('tickets/<int:ticket_id>/messages/', read_view(views.message_list_async, views.MessageListCreate.as_view()),
+         name='messages'),
     path('tickets/<int:ticket_id>/mark-read/', views.mark_messages_read, name='mark-read'),
+    path('unread-counts/', views.unread_counts, name='unread-counts'),
+    path('uploads/', views.create_upload, name='upload-create'),
+    path('uploads/<uuid:upload_id>/', views.upload_detail, name='upload-detail'),
+    path('attachments/<int:attachment_id>/download/', views.download_attachment, name='attachment-download'),
+    path('attachments/<int:attachment_id>/thumbnail/', views.download_attachment, {'variant': 'thumbnail'},
+         name='attachment-thumbnail'),
+    path('attachments/<int:attachment_id>/preview/', views.download_attachment, {'variant': 'preview'},
+         name='attachment-preview'),
     # Add your existing URL patterns here
     path('test-websocket/<int:ticket_id>/', views.test_websocket_url, name='test_websocket_url'),
 ]
\ No newline at end of file
@@ -1,34 +1,133 @@
-from rest_framework import generics, permissions
+import os
+from rest_framework import generics, permissions, status
 from rest_framework.response import Response
-from rest_framework.decorators import api_view, permission_classes
-from .models import Message
-from .serializers import MessageSerializer
+from rest_framework.decorators import api_view, parser_classes, permission_classes
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from . import attachments, unread
+from .models import Attachment, Message, Upload
+from .pagination import MessageCursorPagination
+from .serializers import MessageSerializer, UploadSerializer
 from tickets.models import Ticket
 from tickets.views import IsOwnerOrSupport
-from django.shortcuts import render
+from django.shortcuts import get_object_or_404, render
 from django.http import JsonResponse
+from support_system.async_api import alist, async_api_view, setup_view
 
 class MessageListCreate(generics.ListCreateAPIView):
     serializer_class = MessageSerializer
     permission_classes = [permissions.IsAuthenticated, IsOwnerOrSupport]
+    pagination_class = MessageCursorPagination
 
     def get_queryset(self):
         ticket_id = self.kwargs.get('ticket_id')
-        return Message.objects.filter(ticket_id=ticket_id)
+        # Everything the serializer renders, so the async view never touches a lazy relation
+        return (
+            Message.objects.filter(ticket_id=ticket_id)
+            .select_related('sender__profile', 'sender__support_profile')
+            .prefetch_related('attachments__blob')
+        )
 
     def perform_create(self, serializer):
         ticket_id = self.kwargs.get('ticket_id')
         ticket = Ticket.objects.get(id=ticket_id)
         serializer.save(sender=self.request.user, ticket=ticket)
 
+        async_to_sync(unread.publish_new_message)(
+            get_channel_layer(), ticket.id, self.request.user.id, (ticket.created_by_id, ticket.assigned_to_id)
+        )
 
-@api_view(['GET'])
+
+@async_api_view(MessageListCreate)
+async def message_list_async(request, ticket_id):
+    # Async GET for the messages URL, see support_system/async_api.py
+    return await alist(setup_view(MessageListCreate, request, ticket_id=ticket_id))
+
+
+@api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated, IsOwnerOrSupport])
 def mark_messages_read(request, ticket_id):
-    # Mark all messages in the ticket as read for the current user
-    messages = Message.objects.filter(ticket_id=ticket_id).exclude(sender=request.user)
-    messages.update(is_read=True)
-    return Response({'status': 'Messages marked as read'})
+    # Move the user's read cursor forward; defaults to the newest message in the ticket
+    message_id = request.data.get('message_id')
+    if message_id is not None:
+        try:
+            message_id = int(message_id)
+        except (TypeError, ValueError):
+            return Response({'error': 'message_id must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+
+    count = unread.mark_read(request.user, ticket_id, message_id)
+    async_to_sync(unread.publish_count)(get_channel_layer(), request.user.id, ticket_id, count)
+    return Response({'status': 'Messages marked as read', 'unread': count})
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def unread_counts(request):
+    # Unread counts for all of the user's tickets in one query; tickets with nothing unread are omitted
+    counts = unread.unread_counts(request.user)
+    return Response({
+        'total': sum(counts.values()),
+        'tickets': {str(ticket_id): count for ticket_id, count in counts.items()}
+    })
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def create_upload(request):
+    # Start a resumable upload; the bytes follow as PATCH requests to the upload
+    serializer = UploadSerializer(data=request.data, context={'request': request})
+    serializer.is_valid(raise_exception=True)
+    upload = serializer.save(user=request.user)
+    attachments.start(upload)
+    return Response(serializer.data, status=status.HTTP_201_CREATED, headers={
+        'Location': request.build_absolute_uri(f'{request.path}{upload.id}/'),
+        'Upload-Offset': '0',
+    })
+
+
+@api_view(['GET', 'HEAD', 'PATCH', 'DELETE'])
+@parser_classes([])
+@permission_classes([permissions.IsAuthenticated])
+def upload_detail(request, upload_id):
+    # GET/HEAD report the offset to resume from, PATCH appends the raw request body at Upload-Offset
+    upload = get_object_or_404(Upload, id=upload_id, user=request.user)
+
+    if request.method == 'DELETE':
+        attachments.discard(upload)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    if request.method == 'PATCH':
+        try:
+            offset = int(request.headers['Upload-Offset'])
+        except (KeyError, ValueError):
+            return Response({'error': 'Upload-Offset header must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            # Read the body as a stream instead of request.data, so chunks never sit in memory whole
+            attachments.write_chunk(upload, request.stream, offset)
+        except attachments.UploadError as e:
+            upload.refresh_from_db()
+            return Response({'error': str(e), 'offset': upload.offset}, status=e.status,
+                            headers={'Upload-Offset': str(upload.offset)})
+
+    return Response(UploadSerializer(upload).data, headers={'Upload-Offset': str(upload.offset)})
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def download_attachment(request, attachment_id, variant='file'):
+    # `variant` is 'thumbnail' or 'preview' for the images made by process_attachments
+    attachment = get_object_or_404(
+        Attachment.objects.select_related('blob'),
+        id=attachment_id,
+        blob__isnull=False,
+        message__ticket__in=Ticket.objects.visible_to(request.user)
+    )
+    file_name = attachment.file_name
+    if variant != 'file':
+        if not getattr(attachment.blob, variant):
+            return Response({'error': f'No {variant} for this attachment'}, status=status.HTTP_404_NOT_FOUND)
+        file_name = f'{os.path.splitext(file_name)[0]}-{variant}.webp'
+    return attachments.serve(request, attachment.blob, file_name, variant)
+
 
 def chat_room(request, ticket_id):
     return render(request, 'chat/room.html', {
@@ -1,18 +1,28 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, authenticate
 from django.contrib.auth.decorators import login_required
+from django.core.paginator import Paginator
+from django.db import transaction
 from django.http import JsonResponse
+from tickets.filters import TicketFilterSet
 from tickets.models import Ticket
+from accounts import stats
 from accounts.models import User
 from accounts.serializers import UserSerializer
 from tickets.serializers import TicketSerializer
+from chat import unread
 
 from django.contrib.auth import logout
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 import json
+import logging
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
+DASHBOARD_PAGE_SIZE = 25
+
 def home_view(request):
     if request.user.is_authenticated:
         return redirect('dashboard')
@@ -77,54 +87,45 @@ def signup_view(request):
 @login_required
 def dashboard_view(request):
     user = request.user
-    print(f"Dashboard view - User: {user}, User type: {getattr(user, 'user_type', 'unknown')}")
-
-    # Check if user is authenticated
-    if not user.is_authenticated:
-        print("User is not authenticated")
-        return redirect('login')  # Redirect to your login URL
-
-    # Debug: Check all tickets in the database
-    all_tickets = Ticket.objects.all()
-    print(f"Total tickets in database: {all_tickets.count()}")
-    for ticket in all_tickets:
-        print(f"Ticket ID: {ticket.id}, Created by: {ticket.created_by}, Status: {ticket.status}")
-
-    if hasattr(user, 'user_type') and user.user_type in ['support', 'admin']:
-        # For support staff and admins, show all tickets
-        tickets = Ticket.objects.all().order_by('-created_at')
-        print(f"Support/Admin user - Showing all tickets: {tickets.count()}")
-
-        # Additional filtering options for support
-        status_filter = request.GET.get('status')
-        if status_filter:
-            tickets = tickets.filter(status=status_filter)
-            print(f"Filtered by status '{status_filter}': {tickets.count()} tickets")
-
-        # Filter for assigned tickets
-        assigned_filter = request.GET.get('assigned')
-        if assigned_filter == 'me':
-            tickets = tickets.filter(assigned_to=user)
-            print(f"Filtered by assigned to me: {tickets.count()} tickets")
-        elif assigned_filter == 'unassigned':
-            tickets = tickets.filter(assigned_to__isnull=True)
-            print(f"Filtered by unassigned: {tickets.count()} tickets")
-    else:
-        # For regular users, show only their tickets
-        tickets = Ticket.objects.filter(created_by=user).order_by('-created_at')
-        print(f"Regular user - Showing user's tickets: {tickets.count()}")
+    filters = request.GET.copy()
+
+    tickets = Ticket.objects.select_related('created_by', 'assigned_to').order_by('-created_at', '-id')
+
+    if user.user_type not in ['support', 'admin']:
+        # For regular users, show only their tickets; support staff and admins see all of them
+        tickets = tickets.filter(created_by=user)
+        filters.pop('assigned', None)
+
+    # Same filters as the tickets API; FilterSet.qs skips values that fail validation
+    filterset = TicketFilterSet(filters, queryset=tickets, request=request)
+    tickets = filterset.qs
+    status_filter = filterset.form.cleaned_data.get('status') or []
+    status_filter = status_filter[0] if len(status_filter) == 1 else ''
+    assigned_filter = filterset.form.cleaned_data.get('assigned') or ''
+
+    page = Paginator(tickets, DASHBOARD_PAGE_SIZE).get_page(request.GET.get('page'))
+
+    # One grouped query for the badges of every ticket on the page
+    counts = unread.unread_counts(user, [ticket.id for ticket in page])
+    for ticket in page:
+        ticket.unread = counts.get(ticket.id, 0)
 
-        # Status filtering for users
-        status_filter = request.GET.get('status')
-        if status_filter:
-            tickets = tickets.filter(status=status_filter)
-            print(f"Filtered by status '{status_filter}': {tickets.count()} tickets")
+    logger.debug(
+        "Dashboard rendered: user_id=%s user_type=%s status=%r assigned=%r total=%d page=%d",
+        user.id, user.user_type, status_filter, assigned_filter, page.paginator.count, page.number
+    )
+
+    # Keep the active filters on the pagination links
+    filter_query = request.GET.copy()
+    filter_query.pop('page', None)
 
     context = {
-        'tickets': tickets,
+        'tickets': page,
+        'page_obj': page,
         'user': user,
-        'status_filter': status_filter if 'status_filter' in locals() else '',
-        'assigned_filter': assigned_filter if 'assigned_filter' in locals() else ''
+        'status_filter': status_filter,
+        'assigned_filter': assigned_filter,
+        'filter_query': filter_query.urlencode()
     }
 
     return render(request, 'frontend/dashboard.html', context)
@@ -137,19 +138,18 @@ def create_ticket_view(request):
         description = request.POST.get('description')
         priority = request.POST.get('priority', 'medium')
 
-        # Create ticket
-        ticket = Ticket.objects.create(
-            title=title,
-            description=description,
-            priority=priority,
-            created_by=request.user,
-            status='open'
-        )
+        with transaction.atomic():
+            # Create ticket
+            ticket = Ticket.objects.create(
+                title=title,
+                description=description,
+                priority=priority,
+                created_by=request.user,
+                status='open'
+            )
 
-        # Update user statistics
-        if hasattr(request.user, 'profile'):
-            request.user.profile.tickets_submitted += 1
-            request.user.profile.save()
+            # Update user statistics
+            stats.ticket_created(ticket)
 
         return redirect('ticket_detail', ticket_id=ticket.id)
 
@@ -200,6 +200,8 @@ def assign_ticket(request, ticket_id):
         if request.user.user_type != 'admin':
             return redirect('dashboard')
         
+        old_assigned_to_id = ticket.assigned_to_id
+
         # Handle different assignment options
         support_id = request.POST.get('support_id')
         assigned_to = request.POST.get('assigned_to')
@@ -229,7 +231,9 @@ def assign_ticket(request, ticket_id):
             except User.DoesNotExist:
                 pass
         
-        ticket.save()
+        with transaction.atomic():
+            ticket.save()
+            stats.ticket_assigned(old_assigned_to_id, ticket.assigned_to_id, ticket.resolved_at is not None)
         return redirect('ticket_detail', ticket_id=ticket.id)
     
     return redirect('ticket_detail', ticket_id=ticket_id)
@@ -250,16 +254,15 @@ def update_ticket_status(request, ticket_id):
             # Get display values for statuses
             old_status_display = dict(Ticket.STATUS_CHOICES).get(old_status, old_status)
             
-            ticket.status = new_status
-            ticket.save()
+            with transaction.atomic():
+                ticket.status = new_status
+                ticket.save()
+
+                # Update support statistics if status changed to resolved
+                stats.ticket_status_changed(ticket, old_status)
             
             new_status_display = dict(Ticket.STATUS_CHOICES).get(new_status, new_status)
             
-            # Update support statistics if status changed to resolved
-            if new_status == 'resolved' and ticket.assigned_to and hasattr(ticket.assigned_to, 'support_profile'):
-                ticket.assigned_to.support_profile.tickets_resolved += 1
-                ticket.assigned_to.support_profile.save()
-            
             # Send system message to chat about status update
             if old_status != new_status:
                 channel_layer = get_channel_layer()
@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+class SearchConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'search'
+
+    def ready(self):
+        # Keep the index in step with ticket and message saves
+        from . import signals  # noqa: F401
@@ -0,0 +1,154 @@
+"""
+Full-text search over tickets and chat messages.
+
+Documents are written to SearchDocument as tickets and messages are saved
+(see signals.py); the database keeps the inverted index over them current.
+Queries go straight to the backend's index: FTS5 MATCH ranked by bm25() on
+SQLite, a tsquery against the GIN-indexed tsvector ranked by ts_rank_cd()
+on PostgreSQL. Results are limited to the tickets the user can see through
+the API (Ticket.objects.visible_to).
+"""
+import re
+from html import escape
+from django.db import connection, transaction
+from tickets.models import Ticket
+from .models import SearchDocument
+
+# Highlight markers used inside the database; swapped for <mark> once the text is escaped
+START_MARK = '\x02'
+STOP_MARK = '\x03'
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def index_ticket(ticket):
+    SearchDocument.objects.update_or_create(
+        kind=SearchDocument.TICKET, object_id=ticket.id,
+        defaults={'ticket_id': ticket.id, 'title': ticket.title, 'body': ticket.description}
+    )
+
+
+def index_message(message):
+    SearchDocument.objects.update_or_create(
+        kind=SearchDocument.MESSAGE, object_id=message.id,
+        defaults={'ticket_id': message.ticket_id, 'body': message.content}
+    )
+
+
+def index_new_messages(messages):
+    """Index freshly bulk-created messages (which send no post_save) in one INSERT."""
+    SearchDocument.objects.bulk_create([
+        SearchDocument(kind=SearchDocument.MESSAGE, object_id=message.id, ticket_id=message.ticket_id,
+                       body=message.content)
+        for message in messages if message.id is not None
+    ])
+
+
+def remove(kind, object_id):
+    SearchDocument.objects.filter(kind=kind, object_id=object_id).delete()
+
+
+def rebuild():
+    """Re-create every document from the ticket and message tables; returns the number indexed."""
+    with transaction.atomic():
+        SearchDocument.objects.all().delete()
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO search_searchdocument (kind, object_id, ticket_id, title, body)
+                SELECT %s, id, id, title, description FROM tickets_ticket
+            """, [SearchDocument.TICKET])
+            cursor.execute("""
+                INSERT INTO search_searchdocument (kind, object_id, ticket_id, title, body)
+                SELECT %s, id, ticket_id, '', content FROM chat_message
+            """, [SearchDocument.MESSAGE])
+
+    if connection.vendor == 'sqlite':
+        # Merge the FTS5 segments left behind by the mass delete and insert
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO search_fts(search_fts) VALUES ('optimize')")
+    return SearchDocument.objects.count()
+
+
+def highlight(text):
+    """HTML-escape a highlighted fragment from the database and mark the matches."""
+    return escape(text or '').replace(START_MARK, '<mark>').replace(STOP_MARK, '</mark>')
+
+
+def search(user, query, kind=None, limit=20, offset=0):
+    """
+    Return up to `limit` hits for `query` ordered by relevance, plus whether
+    more are available. Each hit is a dict with type, id, ticket,
+    ticket_title, title (highlighted for tickets), snippet and rank.
+    """
+    visible_sql, visible_params = Ticket.objects.visible_to(user).values('id').query.sql_with_params()
+    filters = [f"d.ticket_id IN ({visible_sql})"]
+    params = list(visible_params)
+    if kind:
+        filters.append("d.kind = %s")
+        params.append(kind)
+
+    if connection.vendor == 'postgresql':
+        rows = _search_postgresql(query, filters, params, limit + 1, offset)
+    else:
+        rows = _search_sqlite(query, filters, params, limit + 1, offset)
+
+    hits = [
+        {
+            'type': doc_kind,
+            'id': object_id,
+            'ticket': ticket_id,
+            'ticket_title': ticket_title,
+            'title': highlight(title) if doc_kind == SearchDocument.TICKET else '',
+            'snippet': highlight(snippet),
+            'rank': rank,
+        }
+        for doc_kind, object_id, ticket_id, ticket_title, title, snippet, rank in rows
+    ]
+    return hits[:limit], len(hits) > limit
+
+
+def _search_sqlite(query, filters, params, limit, offset):
+    # Quote every word so user input can never be parsed as FTS5 syntax; all words must match
+    terms = ' '.join(f'"{word}"' for word in WORD_RE.findall(query))
+    if not terms:
+        return []
+
+    sql = f"""
+        SELECT d.kind, d.object_id, d.ticket_id, t.title,
+               highlight(search_fts, 0, %s, %s),
+               snippet(search_fts, 1, %s, %s, '…', 16),
+               -bm25(search_fts, 5.0, 1.0) AS rank
+        FROM search_fts
+        JOIN search_searchdocument d ON d.id = search_fts.rowid
+        JOIN tickets_ticket t ON t.id = d.ticket_id
+        WHERE search_fts MATCH %s AND {' AND '.join(filters)}
+        ORDER BY bm25(search_fts, 5.0, 1.0)
+        LIMIT %s OFFSET %s
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [START_MARK, STOP_MARK, START_MARK, STOP_MARK, terms, *params, limit, offset])
+        return cursor.fetchall()
+
+
+def _search_postgresql(query, filters, params, limit, offset):
+    # Rank in the inner query so ts_headline() only runs on the returned page
+    headline_options = f'StartSel={START_MARK}, StopSel={STOP_MARK}'
+    sql = f"""
+        SELECT hit.kind, hit.object_id, hit.ticket_id, t.title,
+               ts_headline('english', hit.title, hit.query, %s || ', HighlightAll=true'),
+               ts_headline('english', hit.body, hit.query, %s || ', MaxWords=35, MinWords=15'),
+               hit.rank
+        FROM (
+            SELECT d.id, d.kind, d.object_id, d.ticket_id, d.title, d.body, q.query,
+                   ts_rank_cd(d.document, q.query) AS rank
+            FROM search_searchdocument d, websearch_to_tsquery('english', %s) AS q(query)
+            WHERE d.document @@ q.query AND {' AND '.join(filters)}
+            ORDER BY rank DESC, d.id DESC
+            LIMIT %s OFFSET %s
+        ) hit
+        JOIN tickets_ticket t ON t.id = hit.ticket_id
+        ORDER BY hit.rank DESC, hit.id DESC
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [headline_options, headline_options, query, *params, limit, offset])
+        return cursor.fetchall()
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from search import index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index from the ticket and message tables'
+
+    def handle(self, *args, **options):
+        # Only needed after writes that bypass the model signals (e.g. QuerySet.update on text fields)
+        count = index.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} documents'))
@@ -0,0 +1,84 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+SQLITE_INDEX = [
+    # External-content FTS5 table over search_searchdocument, maintained by triggers
+    """CREATE VIRTUAL TABLE search_fts USING fts5(
+        title, body, content='search_searchdocument', content_rowid='id', tokenize='porter unicode61'
+    )""",
+    """CREATE TRIGGER search_fts_insert AFTER INSERT ON search_searchdocument BEGIN
+        INSERT INTO search_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END""",
+    """CREATE TRIGGER search_fts_delete AFTER DELETE ON search_searchdocument BEGIN
+        INSERT INTO search_fts(search_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+    END""",
+    """CREATE TRIGGER search_fts_update AFTER UPDATE ON search_searchdocument BEGIN
+        INSERT INTO search_fts(search_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+        INSERT INTO search_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END""",
+]
+
+POSTGRESQL_INDEX = [
+    # Titles weigh more than bodies in ts_rank_cd
+    """ALTER TABLE search_searchdocument ADD COLUMN document tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', title), 'A') || setweight(to_tsvector('english', body), 'B')
+    ) STORED""",
+    "CREATE INDEX search_document_gin ON search_searchdocument USING GIN (document)",
+]
+
+
+def create_fulltext_index(apps, schema_editor):
+    statements = {'sqlite': SQLITE_INDEX, 'postgresql': POSTGRESQL_INDEX}.get(schema_editor.connection.vendor, [])
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def drop_fulltext_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        # Dropping the FTS table also drops the triggers that write to it
+        for trigger in ('insert', 'delete', 'update'):
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS search_fts_{trigger}")
+        schema_editor.execute("DROP TABLE IF EXISTS search_fts")
+
+
+def index_existing(apps, schema_editor):
+    # Set-based backfill; the triggers/generated column index the rows as they land
+    schema_editor.execute("""
+        INSERT INTO search_searchdocument (kind, object_id, ticket_id, title, body)
+        SELECT 'ticket', id, id, title, description FROM tickets_ticket
+    """)
+    schema_editor.execute("""
+        INSERT INTO search_searchdocument (kind, object_id, ticket_id, title, body)
+        SELECT 'message', id, ticket_id, '', content FROM chat_message
+    """)
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('tickets', '0003_ticket_ticket_status_created_idx_and_more'),
+        ('chat', '0004_read_cursor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('ticket', 'Ticket'), ('message', 'Message')], max_length=10)),
+                ('object_id', models.BigIntegerField()),
+                ('title', models.TextField(blank=True)),
+                ('body', models.TextField(blank=True)),
+                ('ticket', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='tickets.ticket')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('kind', 'object_id'), name='unique_search_document')],
+            },
+        ),
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+        migrations.RunPython(index_existing, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+from django.db import models
+from tickets.models import Ticket
+
+
+class SearchDocument(models.Model):
+    """
+    One searchable row per ticket or chat message. The full-text index over
+    it is backend specific and created in the migrations: an FTS5 table on
+    SQLite, a generated tsvector column with a GIN index on PostgreSQL.
+    SQLite rebuilds a table to alter it, which drops its triggers, so a
+    migration that alters this model must recreate them.
+    """
+    TICKET = 'ticket'
+    MESSAGE = 'message'
+    KIND_CHOICES = (
+        (TICKET, 'Ticket'),
+        (MESSAGE, 'Message'),
+    )
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    # The ticket the document belongs to, used for permission filtering
+    ticket = models.ForeignKey(Ticket, on_delete=models.CASCADE, related_name='+')
+    title = models.TextField(blank=True)
+    body = models.TextField(blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'object_id'], name='unique_search_document'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id}"
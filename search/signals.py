@@ -0,0 +1,28 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from chat.models import Message
+from tickets.models import Ticket
+from . import index
+from .models import SearchDocument
+
+# Ticket fields that end up in the search index
+INDEXED_TICKET_FIELDS = {'title', 'description'}
+
+
+@receiver(post_save, sender=Ticket)
+def index_ticket(sender, instance, update_fields=None, **kwargs):
+    # Status/assignment updates (save(update_fields=...)) leave the text untouched
+    if update_fields is not None and not INDEXED_TICKET_FIELDS & set(update_fields):
+        return
+    index.index_ticket(instance)
+
+
+@receiver(post_save, sender=Message)
+def index_message(sender, instance, **kwargs):
+    index.index_message(instance)
+
+
+@receiver(post_delete, sender=Message)
+def remove_message(sender, instance, **kwargs):
+    # Ticket documents go with their ticket through the foreign key cascade
+    index.remove(SearchDocument.MESSAGE, instance.id)
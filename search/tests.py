@@ -0,0 +1,121 @@
+import unittest
+from django.db import connection
+from rest_framework.test import APITestCase
+from accounts.models import SupportProfile, User
+from chat.models import Message
+from tickets.models import Ticket
+from .models import SearchDocument
+
+# Input that means something to FTS5 (or SQL) if it reaches the query unquoted
+HOSTILE_QUERIES = (
+    '"',
+    'printer"',
+    'printer" OR "jammed',
+    'printer OR jammed',
+    'printer NOT fire',
+    'NEAR(printer jammed)',
+    'title:jammed',
+    '{title body}: jammed',
+    'jam*',
+    '^printer',
+    '-fire',
+    "'); DROP TABLE search_searchdocument; --",
+    '*',
+    '()',
+    '\x00',
+)
+
+
+class SearchTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(email='admin@example.com', password='pass', first_name='Ada',
+                                             last_name='Admin', user_type='admin')
+        cls.customer = User.objects.create_user(email='customer@example.com', password='pass',
+                                                first_name='Customer', last_name='One', user_type='user')
+        cls.other_customer = User.objects.create_user(email='other@example.com', password='pass',
+                                                      first_name='Other', last_name='Customer', user_type='user')
+        cls.agent = User.objects.create_user(email='agent@example.com', password='pass', first_name='Agent',
+                                             last_name='Smith', user_type='support')
+        SupportProfile.objects.create(user=cls.agent)
+        cls.ticket = Ticket.objects.create(title='Printer on fire', description='The laser printer smokes',
+                                           created_by=cls.customer, assigned_to=cls.agent)
+        cls.other_ticket = Ticket.objects.create(title='Printer jammed', description='Paper stuck in tray two',
+                                                 created_by=cls.other_customer)
+        cls.message = Message.objects.create(ticket=cls.ticket, sender=cls.agent, content='Replace the toner')
+        cls.other_message = Message.objects.create(ticket=cls.other_ticket, sender=cls.other_customer,
+                                                   content='Toner is fine')
+
+    def search(self, user, q, **params):
+        self.client.force_authenticate(user)
+        response = self.client.get('/api/search/', {'q': q, **params})
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.json()['results']
+
+    def hits(self, user, q, **params):
+        return {(hit['type'], hit['id']) for hit in self.search(user, q, **params)}
+
+    def test_saves_and_deletes_update_the_index(self):
+        self.assertEqual(self.hits(self.customer, 'laser'), {('ticket', self.ticket.id)})
+
+        self.ticket.title = 'Scanner overheating'
+        self.ticket.save()
+        self.assertEqual(self.hits(self.customer, 'scanner'), {('ticket', self.ticket.id)})
+        self.assertEqual(self.hits(self.customer, 'fire'), set())
+        # Status changes leave the document alone
+        self.ticket.status = 'in_progress'
+        self.ticket.save(update_fields=['status'])
+        self.assertEqual(self.hits(self.customer, 'scanner laser'), {('ticket', self.ticket.id)})
+
+        self.message.content = 'Replace the drum'
+        self.message.save()
+        self.assertEqual(self.hits(self.customer, 'drum'), {('message', self.message.id)})
+        self.assertEqual(self.hits(self.customer, 'toner'), set())
+
+        message_id = self.message.id
+        self.message.delete()
+        self.assertEqual(self.hits(self.customer, 'drum'), set())
+        self.assertFalse(SearchDocument.objects.filter(kind=SearchDocument.MESSAGE, object_id=message_id).exists())
+
+        ticket_id = self.ticket.id
+        self.ticket.delete()
+        self.assertEqual(self.hits(self.admin, 'scanner'), set())
+        self.assertFalse(SearchDocument.objects.filter(ticket_id=ticket_id).exists())
+
+    def test_results_are_limited_to_visible_tickets(self):
+        own = {('ticket', self.ticket.id), ('message', self.message.id)}
+        other = {('ticket', self.other_ticket.id), ('message', self.other_message.id)}
+        # The agent is assigned to the first ticket only; admins see everything
+        for user, expected in ((self.customer, own), (self.agent, own), (self.other_customer, other),
+                               (self.admin, own | other)):
+            with self.subTest(user=user.email):
+                self.assertEqual(self.hits(user, 'printer') | self.hits(user, 'toner'), expected)
+
+    def test_hostile_queries_are_plain_words(self):
+        for q in HOSTILE_QUERIES:
+            with self.subTest(q=q):
+                # Never an FTS5 syntax error, and never another customer's ticket
+                hits = self.hits(self.customer, q)
+                self.assertNotIn(('ticket', self.other_ticket.id), hits)
+        self.assertTrue(SearchDocument.objects.exists())
+
+    @unittest.skipUnless(connection.vendor == 'sqlite', 'FTS5 query syntax')
+    def test_fts5_operators_are_words(self):
+        # Every word must match, operators included, and quotes only separate words
+        self.assertEqual(self.hits(self.customer, 'printer OR jammed'), set())
+        self.assertEqual(self.hits(self.customer, 'printer" fire'), {('ticket', self.ticket.id)})
+
+    def test_highlights_are_escaped(self):
+        ticket = Ticket.objects.create(title='<script>alert(1)</script> printer', description='<b>bold</b> printer',
+                                       created_by=self.customer)
+        hit, = [hit for hit in self.search(self.customer, 'alert') if hit['id'] == ticket.id]
+        self.assertEqual(hit['title'], '&lt;script&gt;<mark>alert</mark>(1)&lt;/script&gt; printer')
+        self.assertNotIn('<b>', hit['snippet'])
+
+    def test_invalid_arguments(self):
+        self.client.force_authenticate(self.customer)
+        for params in ({}, {'q': '  '}, {'q': 'printer', 'type': 'user'}, {'q': 'printer', 'limit': 'all'},
+                       {'q': 'printer', 'limit': 0}, {'q': 'printer', 'offset': -1}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get('/api/search/', params).status_code, 400)
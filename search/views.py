@@ -0,0 +1,40 @@
+from django.conf import settings
+from rest_framework import permissions, status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.response import Response
+from . import index
+from .models import SearchDocument
+
+SEARCH_PAGE_SIZE = 20
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def search(request):
+    """
+    Full-text search over the tickets (title and description) and chat
+    messages the user can see. Query parameters: q, type (ticket/message),
+    limit and offset. Highlights are HTML-escaped with matches in <mark>.
+    """
+    query = request.query_params.get('q', '').strip()
+    if not query:
+        return Response({'error': 'q is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+    kind = request.query_params.get('type') or None
+    if kind not in (None, SearchDocument.TICKET, SearchDocument.MESSAGE):
+        return Response({'error': 'type must be ticket or message'}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        limit = min(int(request.query_params.get('limit', SEARCH_PAGE_SIZE)), settings.API_MAX_PAGE_SIZE)
+        offset = int(request.query_params.get('offset', 0))
+    except ValueError:
+        return Response({'error': 'limit and offset must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+    if limit < 1 or offset < 0:
+        return Response({'error': 'limit must be positive and offset not negative'},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    hits, has_more = index.search(request.user, query, kind=kind, limit=limit, offset=offset)
+    return Response({
+        'results': hits,
+        'next_offset': offset + limit if has_more else None
+    })
@@ -2,7 +2,6 @@ import os
 import django
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
 
 # Set the Django settings module
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'support_system.settings')
@@ -12,12 +11,14 @@ django.setup()
 
 # Import after Django setup to avoid the ImproperlyConfigured error
 from chat import routing
+from chat.middleware import JWTAuthMiddlewareStack
+from support_system.instrumentation import InstrumentationASGIMiddleware
 
-application = ProtocolTypeRouter({
+application = InstrumentationASGIMiddleware(ProtocolTypeRouter({
     "http": get_asgi_application(),
-    "websocket": AuthMiddlewareStack(
+    "websocket": JWTAuthMiddlewareStack(
         URLRouter(
             routing.websocket_urlpatterns
         )
     ),
-})
+}))
@@ -0,0 +1,144 @@
+"""
+Async implementations of the busiest read-only API endpoints.
+
+DRF views are sync only, so under ASGI every API request occupies a worker
+thread for its whole duration. The GET endpoints that dominate traffic
+(ticket list and detail, message list, profile) also have async versions,
+built with `async_api_view`: authentication uses the DRF view's own
+authentication classes (CachingJWTAuthentication resolves users through its
+cache and only falls back to the async ORM on a miss; other authenticators
+run in a thread), and rows are loaded with the async ORM. Querysets,
+filters, permissions, pagination and serializers are the DRF view's own,
+applied to fully loaded rows, so responses are the same as the sync view's.
+
+`read_view` sends GETs to the async version while ASYNC_API_VIEWS is on and
+every other method to the DRF view.
+"""
+import functools
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.http import HttpResponse
+from rest_framework.exceptions import APIException, AuthenticationFailed, NotAuthenticated, NotFound
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+# Serve the GETs of the ticket, message and profile endpoints with their async views
+ASYNC_API_VIEWS = getattr(settings, 'ASYNC_API_VIEWS', True)
+
+
+def render(data, status=200, headers=None):
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json',
+                        headers=headers)
+
+
+async def authenticate(authenticators, request):
+    """Request.authenticate() for async views: the first authenticator's (user, auth), or None."""
+    for authenticator in authenticators:
+        if hasattr(authenticator, 'aauthenticate'):
+            result = await authenticator.aauthenticate(request)
+        else:
+            result = await sync_to_async(authenticator.authenticate)(request)
+        if result is not None:
+            return result
+    return None
+
+
+def async_api_view(view_class):
+    """
+    Decorator for an async read view taking a DRF Request, standing in for
+    the GETs of `view_class`: authenticates the request with the view class's
+    authenticators, renders the returned data as JSON, and turns
+    APIExceptions into the same responses DRF's exception handler gives.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def view(request, *args, **kwargs):
+            # Resolved per request, so changes to the authentication classes (see api_benchmark) apply
+            authenticators = view_class().get_authenticators()
+            # A DRF Request for query_params and the serializers; authentication happens here instead
+            request = Request(request, authenticators=())
+            try:
+                result = await authenticate(authenticators, request)
+                if result is None:
+                    raise NotAuthenticated()
+                request.user, request.auth = result
+                data = await func(request, *args, **kwargs)
+            except APIException as exc:
+                headers = None
+                if isinstance(exc, (NotAuthenticated, AuthenticationFailed)):
+                    # As APIView.handle_exception: 401 with a challenge when the first authenticator has one
+                    challenge = authenticators[0].authenticate_header(request) if authenticators else None
+                    if challenge:
+                        headers = {'WWW-Authenticate': challenge}
+                    else:
+                        exc.status_code = 403
+                detail = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+                return render(detail, exc.status_code, headers)
+            return render(data)
+
+        return view
+
+    return decorator
+
+
+def read_view(async_view, sync_view):
+    """One URL's view: GETs go to `async_view` while ASYNC_API_VIEWS is on, the rest to DRF's `sync_view`."""
+    run_sync_view = sync_to_async(sync_view)
+
+    # Keeps csrf_exempt and the `cls` the schema generator looks for
+    @functools.wraps(sync_view)
+    async def view(request, *args, **kwargs):
+        if request.method == 'GET' and ASYNC_API_VIEWS:
+            return await async_view(request, *args, **kwargs)
+        return await run_sync_view(request, *args, **kwargs)
+
+    return view
+
+
+def setup_view(view_class, request, action=None, **kwargs):
+    """An instance of a DRF view class prepared the way dispatch() would, for reusing its hooks."""
+    view = view_class(action=action) if action is not None else view_class()
+    view.request = request
+    view.args = ()
+    view.kwargs = kwargs
+    view.format_kwarg = None
+    view.check_permissions(request)
+    return view
+
+
+async def aget_object(view):
+    """Async GenericAPIView.get_object(): the looked up row, with the object permissions applied."""
+    lookup_url_kwarg = view.lookup_url_kwarg or view.lookup_field
+    queryset = view.filter_queryset(view.get_queryset())
+    try:
+        obj = await queryset.filter(**{view.lookup_field: view.kwargs[lookup_url_kwarg]}).afirst()
+    except (TypeError, ValueError, ValidationError):
+        # A lookup value of the wrong type, which DRF also answers with a plain 404
+        raise NotFound()
+    if obj is None:
+        raise NotFound(f'No {queryset.model._meta.object_name} matches the given query.')
+    view.check_object_permissions(view.request, obj)
+    return obj
+
+
+async def alist(view):
+    """Async ListModelMixin.list(); returns the response data."""
+    queryset = view.filter_queryset(view.get_queryset())
+    page = await view.paginator.apaginate_queryset(queryset, view.request, view=view)
+    return view.get_paginated_response(view.get_serializer(page, many=True).data).data
+
+
+async def aretrieve(view):
+    """Async RetrieveModelMixin.retrieve(); returns the response data."""
+    return view.get_serializer(await aget_object(view)).data
+
+
+class AsyncCursorPaginationMixin:
+    """
+    Adds apaginate_queryset(): DRF's own CursorPagination.paginate_queryset(),
+    run through sync_to_async, so the pagination logic is not duplicated here.
+    """
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        return await sync_to_async(self.paginate_queryset)(queryset, request, view=view)
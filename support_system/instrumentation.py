@@ -0,0 +1,338 @@
+"""
+Per-request instrumentation.
+
+Every database connection gets an execute wrapper that reports each query
+to the metrics object of the request (or WebSocket event) being handled,
+found through a context variable so it also follows work handed to
+sync_to_async threads. InstrumentationMiddleware covers HTTP requests and
+InstrumentationASGIMiddleware covers WebSocket connections; both feed the
+process-wide registry rendered in Prometheus text format at /metrics, and
+log anything slower than SLOW_REQUEST_THRESHOLD_MS with its slowest SQL.
+/metrics is only served to staff, to METRICS_TOKEN bearers and to
+METRICS_ALLOWED_IPS.
+
+The registry lives in process memory, so each worker process exposes its
+own numbers; scrape every worker (or sum them) when running several.
+"""
+import heapq
+import hmac
+import logging
+import re
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseForbidden
+
+logger = logging.getLogger(__name__)
+
+# Requests (and WebSocket events) slower than this are logged with their slowest queries
+SLOW_REQUEST_THRESHOLD_MS = getattr(settings, 'SLOW_REQUEST_THRESHOLD_MS', 500)
+# Add a Server-Timing header with the database, render and total time of each response
+SERVER_TIMING_HEADER = getattr(settings, 'SERVER_TIMING_HEADER', True)
+# Bearer token that may read /metrics (e.g. the Prometheus scraper); staff users may always read it
+METRICS_TOKEN = getattr(settings, 'METRICS_TOKEN', None)
+# Client addresses that may read /metrics without a token. Behind a reverse proxy every client has the
+# proxy's address, so only list addresses here when the scraper connects to the app server directly.
+METRICS_ALLOWED_IPS = getattr(settings, 'METRICS_ALLOWED_IPS', ())
+
+SLOW_REQUEST_TOP_QUERIES = 5
+# Statements kept per request for the slow log; past this only the totals are tracked
+MAX_RECORDED_QUERIES = 200
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+METRICS = {
+    'http_requests_total': ('counter', 'HTTP requests handled'),
+    'http_request_duration_seconds': ('histogram', 'HTTP request latency'),
+    'http_request_db_queries_total': ('counter', 'Database queries run by HTTP requests'),
+    'http_request_db_duration_seconds_total': ('counter', 'Time HTTP requests spent in the database'),
+    'http_request_render_duration_seconds_total': ('counter', 'Time HTTP requests spent rendering responses'),
+    'websocket_connections_active': ('gauge', 'Open WebSocket connections'),
+    'websocket_events_total': ('counter', 'WebSocket connects and inbound messages handled'),
+    'websocket_event_duration_seconds': ('histogram', 'Time to handle a WebSocket connect or inbound message'),
+    'websocket_event_db_queries_total': ('counter', 'Database queries run by WebSocket events'),
+    'websocket_event_db_duration_seconds_total': ('counter', 'Time WebSocket events spent in the database'),
+    'chat_write_behind_failures_total': ('counter', 'Failed writes of a batch of buffered chat messages'),
+    'chat_write_behind_dropped_total': ('counter', 'Buffered chat messages that could not be stored'),
+}
+
+current_metrics = ContextVar('current_metrics', default=None)
+
+
+class RequestMetrics:
+    """What one HTTP request or WebSocket event cost."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.statements = []
+
+    def record_query(self, sql, duration):
+        self.queries += 1
+        self.db_time += duration
+        if len(self.statements) < MAX_RECORDED_QUERIES:
+            self.statements.append((duration, sql))
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self, total):
+        return (
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries", '
+            f'render;dur={self.render_time * 1000:.1f}, '
+            f'total;dur={total * 1000:.1f}'
+        )
+
+    def log_if_slow(self, label, total):
+        if total * 1000 < SLOW_REQUEST_THRESHOLD_MS:
+            return
+        top = heapq.nlargest(SLOW_REQUEST_TOP_QUERIES, self.statements, key=lambda statement: statement[0])
+        logger.warning(
+            f"Slow request {label}: {total * 1000:.0f}ms total, {self.queries} queries in "
+            f"{self.db_time * 1000:.0f}ms, render {self.render_time * 1000:.0f}ms"
+            + ''.join(f"\n  {duration * 1000:.1f}ms {sql[:300]}" for duration, sql in top)
+        )
+
+
+class MetricsRegistry:
+    """Counters, gauges and histograms keyed by metric name and label values."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = defaultdict(float)
+        self.histograms = {}
+
+    def inc(self, name, labels, value=1):
+        with self.lock:
+            self.values[name, labels] += value
+
+    def observe(self, name, labels, value):
+        with self.lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                # One count per bucket, then the sum and the total count
+                histogram = self.histograms[name, labels] = [0] * (len(LATENCY_BUCKETS) + 2)
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    histogram[index] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def render(self):
+        with self.lock:
+            values = dict(self.values)
+            histograms = {key: list(histogram) for key, histogram in self.histograms.items()}
+
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind != 'histogram':
+                for (metric, labels), value in sorted(values.items()):
+                    if metric == name:
+                        lines.append(f'{name}{format_labels(labels)} {value:g}')
+                continue
+
+            for (metric, labels), histogram in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, count in zip(LATENCY_BUCKETS, histogram):
+                    lines.append(f'{name}_bucket{format_labels(labels + (("le", f"{bound:g}"),))} {count}')
+                lines.append(f'{name}_bucket{format_labels(labels + (("le", "+Inf"),))} {histogram[-1]}')
+                lines.append(f'{name}_sum{format_labels(labels)} {histogram[-2]:g}')
+                lines.append(f'{name}_count{format_labels(labels)} {histogram[-1]}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+registry = MetricsRegistry()
+
+
+def record_query(execute, sql, params, many, context):
+    metrics = current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.record_query(sql, time.perf_counter() - started)
+
+
+@receiver(connection_created)
+def install_query_recorder(sender, connection, **kwargs):
+    # Fires again when a connection reconnects; the wrapper list outlives the socket
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def install_on_open_connections():
+    # Connections opened before this module was imported never saw connection_created
+    for connection in connections.all(initialized_only=True):
+        install_query_recorder(None, connection)
+
+
+class InstrumentationMiddleware:
+    """
+    Times each HTTP request (total, database and response rendering), sets
+    the Server-Timing header and records the request in the registry.
+    Should be the first middleware so the total covers all the others.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        # Once per process; connections opened later get the wrapper through connection_created
+        install_on_open_connections()
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        return self.finish(request, response, metrics)
+
+    def process_template_response(self, request, response):
+        # Called just before a TemplateResponse (or DRF Response) is rendered
+        metrics = current_metrics.get()
+        if metrics is not None:
+            started = time.perf_counter()
+
+            def rendered(response):
+                metrics.render_time += time.perf_counter() - started
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    def finish(self, request, response, metrics):
+        total = metrics.elapsed()
+        match = request.resolver_match
+        route = match.route if match is not None else 'unmatched'
+        labels = (('method', request.method), ('route', route))
+
+        registry.inc('http_requests_total', labels + (('status', str(response.status_code)),))
+        registry.observe('http_request_duration_seconds', labels, total)
+        registry.inc('http_request_db_queries_total', labels, metrics.queries)
+        registry.inc('http_request_db_duration_seconds_total', labels, metrics.db_time)
+        registry.inc('http_request_render_duration_seconds_total', labels, metrics.render_time)
+
+        if SERVER_TIMING_HEADER:
+            response['Server-Timing'] = metrics.server_timing(total)
+        metrics.log_if_slow(f'{request.method} {request.path}', total)
+        return response
+
+
+class WebSocketMetrics:
+    """Routes the queries of a WebSocket connection to the event being handled."""
+
+    def __init__(self):
+        self.event = None
+
+    def record_query(self, sql, duration):
+        if self.event is not None:
+            self.event.record_query(sql, duration)
+
+
+class InstrumentationASGIMiddleware:
+    """
+    Wraps the ASGI application to time WebSocket connects and inbound
+    messages. Consumers handle one inbound event at a time and only ask for
+    the next one when done, so an event lasts from being received to the
+    following receive() call. HTTP is left to InstrumentationMiddleware.
+    """
+    ID_RE = re.compile(r'/\d+(?=/|$)')
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'websocket':
+            return await self.app(scope, receive, send)
+
+        # Collapse ids so each route is one label value
+        route = self.ID_RE.sub('/{id}', scope['path'])
+        connection = WebSocketMetrics()
+        pending = {}
+
+        def finish_event():
+            event, connection.event = connection.event, None
+            if event is None:
+                return
+            total = event.elapsed()
+            labels = (('route', route), ('event', pending['type']))
+            registry.inc('websocket_events_total', labels)
+            registry.observe('websocket_event_duration_seconds', labels, total)
+            registry.inc('websocket_event_db_queries_total', labels, event.queries)
+            registry.inc('websocket_event_db_duration_seconds_total', labels, event.db_time)
+            event.log_if_slow(f'{pending["type"]} {scope["path"]}', total)
+
+        async def timed_receive():
+            finish_event()
+            message = await receive()
+            if message['type'] in ('websocket.connect', 'websocket.receive'):
+                pending['type'] = message['type'].split('.')[1]
+                connection.event = RequestMetrics()
+            return message
+
+        token = current_metrics.set(connection)
+        registry.inc('websocket_connections_active', (('route', route),))
+        try:
+            await self.app(scope, timed_receive, send)
+        finally:
+            finish_event()
+            registry.inc('websocket_connections_active', (('route', route),), -1)
+            current_metrics.reset(token)
+
+
+def can_read_metrics(request):
+    if request.META.get('REMOTE_ADDR') in METRICS_ALLOWED_IPS:
+        return True
+    if METRICS_TOKEN:
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() == 'bearer' and hmac.compare_digest(token.encode(), METRICS_TOKEN.encode()):
+            return True
+    user = request.user
+    return user.is_authenticated and (user.is_staff or user.user_type == 'admin')
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint; per-route latency and SQL timings are not for everyone."""
+    if not can_read_metrics(request):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -27,6 +27,7 @@ INSTALLED_APPS = [
     'rest_framework_simplejwt',
     'corsheaders',
     'drf_yasg',
+    'django_filters',
     'channels',
     
     # Custom apps
@@ -34,10 +35,13 @@ INSTALLED_APPS = [
     'tickets.apps.TicketsConfig',
     'chat.apps.ChatConfig',  # Keep this one
     'frontend.apps.FrontendConfig',
+    'search.apps.SearchConfig',
     # 'chat',  # Remove this line
 ]
 
 MIDDLEWARE = [
+    # First, so its timings cover every other middleware
+    'support_system.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -114,13 +118,26 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Attachments: largest accepted file in bytes, and seconds an unattached upload is kept (clean_uploads)
+ATTACHMENT_MAX_SIZE = 100 * 1024 * 1024
+ATTACHMENT_UPLOAD_EXPIRY = 24 * 60 * 60
+# Let the web server send attachment files: 'X-Accel-Redirect' (nginx, internal location
+# ATTACHMENT_SENDFILE_PREFIX aliased to MEDIA_ROOT) or 'X-Sendfile'; None streams them from Django
+ATTACHMENT_SENDFILE_HEADER = None
+ATTACHMENT_SENDFILE_PREFIX = '/protected-media/'
+# process_attachments: longest side in pixels of generated thumbnails and previews, and seconds
+# before a blob claimed by a worker that died is processed again
+ATTACHMENT_THUMBNAIL_SIZE = 256
+ATTACHMENT_PREVIEW_SIZE = 1024
+ATTACHMENT_PROCESSING_TIMEOUT = 300
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'accounts.authentication.CachingJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -129,6 +146,36 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 10
 }
 
+# Upper bound for the `page_size` query parameter on cursor-paginated endpoints
+API_MAX_PAGE_SIZE = 100
+
+# Seconds /api/tickets/stats/ may be served from cache (ticket saves invalidate it sooner)
+TICKET_STATS_CACHE_TTL = 60
+
+# Seconds a ticket's creator/assignee pair is cached for WebSocket access checks (ticket saves drop it sooner)
+TICKET_ACCESS_CACHE_TTL = 60
+
+# rollup_metrics rescans this many seconds before its watermark to catch late commits
+METRICS_ROLLUP_OVERLAP = 300
+
+# Requests and WebSocket events slower than this are logged with their slowest SQL
+SLOW_REQUEST_THRESHOLD_MS = 500
+# Who may read /metrics besides staff: a bearer token for the scraper, and/or addresses that connect directly
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+METRICS_ALLOWED_IPS = []
+# Report database/render/total time to clients in a Server-Timing response header
+SERVER_TIMING_HEADER = True
+
+# Serve GETs of the ticket list/detail, message list and profile endpoints with async views
+# (support_system/async_api.py); other methods always use the DRF views
+ASYNC_API_VIEWS = True
+
+# CachingJWTAuthentication: seconds and number of users kept per process, and whether to
+# also share them through CACHES (other processes may serve a changed user for up to the TTL)
+JWT_USER_CACHE_TTL = 30
+JWT_USER_CACHE_SIZE = 1024
+JWT_USER_CACHE_SHARED = False
+
 # JWT settings
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=1),
@@ -150,14 +197,57 @@ SIMPLE_JWT = {
 CORS_ALLOW_ALL_ORIGINS = True
 
 # Channels settings
-CHANNEL_LAYERS = {
-    'default': {
+CHANNEL_LAYER_BACKENDS = {
+    'redis': {
         'BACKEND': 'channels_redis.core.RedisChannelLayer',
         'CONFIG': {
             "hosts": [('127.0.0.1', 6379)],
         },
-    }
+    },
+    # Single-process deployments and load tests without Redis
+    'memory': {
+        'BACKEND': 'chat.layers.FanoutInMemoryChannelLayer',
+        'CONFIG': {
+            'capacity': 1000,
+            'expiry': 60,
+        },
+    },
 }
+CHANNEL_LAYER = os.environ.get('CHANNEL_LAYER', 'redis')
+CHANNEL_LAYERS = {
+    'default': CHANNEL_LAYER_BACKENDS[CHANNEL_LAYER],
+}
+
+# Cache and chat presence; shared through Redis whenever the channel layer is
+if CHANNEL_LAYER == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': 'redis://127.0.0.1:6379/1',
+        }
+    }
+    CHAT_PRESENCE_REDIS_URL = 'redis://127.0.0.1:6379/1'
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Chat settings
+CHAT_HISTORY_PAGE_SIZE = 50  # Messages sent on connect and per `load_older` page
+CHAT_RESUME_LIMIT = 200  # Largest gap replayed on reconnect before sending a fresh snapshot
+# Write-behind mode batches chat messages from all consumers into periodic bulk INSERTs.
+# Messages are broadcast before they are stored, so they carry no id until the next history load.
+CHAT_WRITE_BEHIND = False
+CHAT_WRITE_BEHIND_INTERVAL = 0.5  # Seconds a message may wait in the buffer
+CHAT_WRITE_BEHIND_MAX_BATCH = 500  # Flush immediately once this many messages are pending
+CHAT_WRITE_BEHIND_MAX_ATTEMPTS = 3  # Failed writes of a batch before only its failing messages are dropped
+CHAT_PRESENCE_TTL = 30  # Seconds a viewer stays present without a heartbeat
+CHAT_TYPING_TIMEOUT = 5  # Seconds after the last keystroke before "typing" is cleared
+CHAT_PRESENCE_COALESCE_WINDOW = 0.25  # Seconds presence changes are merged into one frame
+CHAT_BATCH_WINDOW = 0  # Seconds chat messages are merged into one chat_batch frame; 0 sends each immediately
+FEED_TICKET_COALESCE_WINDOW = 0.5  # Seconds ticket updates are merged into one delta per ticket on the dashboard feed
 
 # Swagger settings
 SWAGGER_SETTINGS = {
@@ -0,0 +1,51 @@
+from unittest import mock
+from django.test import TestCase
+from accounts.models import User
+from support_system import instrumentation
+
+
+class MetricsAccessTests(TestCase):
+    """/metrics exposes per-route latency and SQL timings, so it is not public."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(email='admin@example.com', password='pass', first_name='Ada',
+                                             last_name='Admin', user_type='admin')
+        cls.customer = User.objects.create_user(email='customer@example.com', password='pass',
+                                                first_name='Customer', last_name='One', user_type='user')
+
+    def test_anonymous(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+    def test_customer(self):
+        self.client.force_login(self.customer)
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+    def test_admin(self):
+        self.client.force_login(self.admin)
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('http_requests_total', response.content.decode())
+
+    @mock.patch.object(instrumentation, 'METRICS_TOKEN', 'secret')
+    def test_token(self):
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+
+    @mock.patch.object(instrumentation, 'METRICS_ALLOWED_IPS', ('10.0.0.5',))
+    def test_allowed_ip(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.5').status_code, 200)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.6').status_code, 403)
+
+
+class QueryRecorderTests(TestCase):
+
+    def test_requests_count_their_queries(self):
+        # The recorder is installed once per connection, not per request
+        user = User.objects.create_user(email='admin@example.com', password='pass', first_name='Ada',
+                                        last_name='Admin', user_type='admin')
+        self.client.force_login(user)
+        for _ in range(2):
+            response = self.client.get('/dashboard/')
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('desc="0 queries"', response.headers['Server-Timing'])
@@ -1,10 +1,9 @@
 from django.contrib import admin
 from django.urls import path, include
-from django.conf import settings
-from django.conf.urls.static import static
 from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
+from support_system.instrumentation import metrics_view
 
 schema_view = get_schema_view(
    openapi.Info(
@@ -21,17 +20,18 @@ schema_view = get_schema_view(
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    # Prometheus scrape endpoint
+    path('metrics', metrics_view, name='metrics'),
     path('api/', include('accounts.urls')),
     path('api/', include('tickets.urls')),
     path('api/', include('chat.urls')),
-    path('chat/', include('chat.urls')),  # ... other url patterns ...
+    path('api/', include('search.urls')),
+    # Namespaced, so reversing the chat URL names gives the API routes above
+    path('chat/', include(('chat.urls', 'chat'), namespace='chat')),  # ... other url patterns ...
     path('', include('frontend.urls')),
 
     # Swagger URLs
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
     path('swagger<format>/', schema_view.without_ui(cache_timeout=0), name='schema-json'),
-]
-
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+]
\ No newline at end of file
@@ -2,4 +2,8 @@ from django.apps import AppConfig
 
 class TicketsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'tickets'
\ No newline at end of file
+    name = 'tickets'
+
+    def ready(self):
+        # Drop cached statistics whenever a ticket changes
+        from . import signals  # noqa: F401
@@ -0,0 +1,35 @@
+import django_filters
+from .models import Ticket
+
+
+class TicketFilterSet(django_filters.FilterSet):
+    """
+    Filters shared by TicketViewSet and the dashboard. Every filter maps onto
+    one of the Ticket indexes, so combining them with the default
+    created_at ordering never needs a full table scan.
+    """
+    ASSIGNED_CHOICES = (
+        ('me', 'Assigned to me'),
+        ('unassigned', 'Unassigned'),
+    )
+
+    status = django_filters.MultipleChoiceFilter(choices=Ticket.STATUS_CHOICES)
+    priority = django_filters.MultipleChoiceFilter(choices=Ticket.PRIORITY_CHOICES)
+    # Plain id filters: no lookup to validate that the user exists
+    assigned_to = django_filters.NumberFilter(field_name='assigned_to_id')
+    created_by = django_filters.NumberFilter(field_name='created_by_id')
+    unassigned = django_filters.BooleanFilter(field_name='assigned_to', lookup_expr='isnull')
+    # The dashboard's ?assigned=me|unassigned shortcut
+    assigned = django_filters.ChoiceFilter(choices=ASSIGNED_CHOICES, method='filter_assigned')
+    # ?created_after=&created_before= and ?updated_after=&updated_before=
+    created = django_filters.IsoDateTimeFromToRangeFilter(field_name='created_at')
+    updated = django_filters.IsoDateTimeFromToRangeFilter(field_name='updated_at')
+
+    class Meta:
+        model = Ticket
+        fields = ['status', 'priority', 'assigned_to', 'created_by', 'unassigned', 'assigned', 'created', 'updated']
+
+    def filter_assigned(self, queryset, name, value):
+        if value == 'me':
+            return queryset.filter(assigned_to=self.request.user)
+        return queryset.filter(assigned_to__isnull=True)
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from tickets import metrics
+
+
+class Command(BaseCommand):
+    help = 'Roll new ticket and message activity up into DailyTicketMetrics (run periodically, e.g. from cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Recompute every day instead of only those touched since the last run')
+
+    def handle(self, *args, **options):
+        days = metrics.rollup(full=options['full'])
+        if days:
+            self.stdout.write(self.style.SUCCESS(f'Refreshed {len(days)} day(s): {days[0]} to {days[-1]}'))
+        else:
+            self.stdout.write('No new activity since the last rollup')
@@ -0,0 +1,167 @@
+"""
+Daily ticket metrics rollup (DailyTicketMetrics), refreshed by
+`manage.py rollup_metrics`.
+
+Each run only looks at rows written since the previous run's watermark and
+recomputes the days they fall on, so the cost follows the amount of new
+activity rather than the size of the ticket and message tables. The scan
+starts METRICS_ROLLUP_OVERLAP seconds before the watermark to pick up rows
+from transactions that committed after the previous run read the tables.
+
+Changes that take a ticket out of an older day leave nothing new to scan:
+reopening clears resolved_at, and deleting a ticket removes it with its
+messages. tickets/signals.py records those days as RollupDirtyDay rows,
+which the next run recomputes along with the scanned days.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from statistics import median
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Min, Q
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from chat.models import Message
+from .models import DailyTicketMetrics, RollupDirtyDay, RollupWatermark, Ticket
+
+METRICS_ROLLUP_OVERLAP = getattr(settings, 'METRICS_ROLLUP_OVERLAP', 300)
+
+WATERMARK = 'daily_ticket_metrics'
+
+
+def rollup(full=False):
+    """Refresh the days touched since the last run (every day if `full`); returns them sorted."""
+    started = timezone.now()
+    watermark = RollupWatermark.objects.filter(name=WATERMARK).first()
+    since = None
+    if watermark is not None and not full:
+        since = watermark.value - timedelta(seconds=METRICS_ROLLUP_OVERLAP)
+
+    marked = list(RollupDirtyDay.objects.values_list('id', 'date'))
+    days = sorted(dirty_days(since) | {day for _, day in marked})
+    with transaction.atomic():
+        if full:
+            # Days that lost all their activity have no tickets left to find them by
+            DailyTicketMetrics.objects.all().delete()
+            runs = [days] if days else []
+        else:
+            # An old marked day must not stretch the scan over every day since
+            runs = consecutive_runs(days)
+        for run in runs:
+            refresh_days(run)
+        # Days marked while this run was reading are left for the next one
+        RollupDirtyDay.objects.filter(id__in=[pk for pk, _ in marked]).delete()
+        RollupWatermark.objects.update_or_create(name=WATERMARK, defaults={'value': started})
+    return days
+
+
+def dirty_days(since=None):
+    """Days with tickets opened or resolved, or messages sent, at or after `since`."""
+    tickets = Ticket.objects.all()
+    messages = Message.objects.all()
+    if since is not None:
+        opened = tickets.filter(created_at__gte=since)
+        resolved = tickets.filter(resolved_at__gte=since)
+        messages = messages.filter(timestamp__gte=since)
+    else:
+        opened = tickets
+        resolved = tickets.filter(resolved_at__isnull=False)
+
+    days = set()
+    for queryset, field in ((opened, 'created_at'), (resolved, 'resolved_at'), (messages, 'timestamp')):
+        days.update(
+            queryset.annotate(day=TruncDate(field)).order_by().values_list('day', flat=True).distinct()
+        )
+    return days
+
+
+def mark_dirty(*moments):
+    """Have the next rollup recompute the days of `moments` (datetimes; None is skipped)."""
+    days = {timezone.localdate(moment) for moment in moments if moment is not None}
+    RollupDirtyDay.objects.bulk_create([RollupDirtyDay(date=day) for day in days])
+
+
+def first_response(ticket):
+    """When someone other than the creator first replied on `ticket`, or None."""
+    replies = ticket.messages.exclude(sender=ticket.created_by_id).order_by('timestamp')
+    return replies.values_list('timestamp', flat=True).first()
+
+
+def consecutive_runs(days):
+    """Split sorted `days` into lists of consecutive days."""
+    runs = []
+    for day in days:
+        if runs and day - runs[-1][-1] == timedelta(days=1):
+            runs[-1].append(day)
+        else:
+            runs.append([day])
+    return runs
+
+
+def day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def count_by_day(field, start, end):
+    """{(day, priority): tickets} for tickets whose `field` falls in [start, end)."""
+    rows = (
+        Ticket.objects.filter(**{f'{field}__gte': start, f'{field}__lt': end})
+        .annotate(day=TruncDate(field))
+        .order_by()
+        .values('day', 'priority')
+        .annotate(count=Count('id'))
+    )
+    return defaultdict(int, {(row['day'], row['priority']): row['count'] for row in rows})
+
+
+def refresh_days(days):
+    """Recompute and replace the DailyTicketMetrics rows of `days` (sorted)."""
+    start, end = day_start(days[0]), day_start(days[-1] + timedelta(days=1))
+
+    opened = count_by_day('created_at', start, end)
+    resolved = count_by_day('resolved_at', start, end)
+    response_times = defaultdict(list)
+
+    # Only tickets with messages in the range can have had their first response in it
+    replied = Message.objects.filter(timestamp__gte=start, timestamp__lt=end).values('ticket_id')
+    rows = (
+        Ticket.objects.filter(id__in=replied)
+        .annotate(first_response=Min('messages__timestamp', filter=~Q(messages__sender=F('created_by'))))
+        .filter(first_response__gte=start, first_response__lt=end)
+        .values_list('priority', 'created_at', 'first_response')
+    )
+    for priority, created_at, first_response in rows:
+        day = timezone.localdate(first_response)
+        response_times[day, priority].append((first_response - created_at).total_seconds())
+
+    metrics = []
+    for day in days:
+        all_times = []
+        for priority, _ in Ticket.PRIORITY_CHOICES:
+            times = response_times[day, priority]
+            all_times.extend(times)
+            metrics.append(build_metrics(day, priority, opened[day, priority], resolved[day, priority], times))
+        metrics.append(build_metrics(
+            day, DailyTicketMetrics.ALL_PRIORITIES,
+            sum(opened[day, priority] for priority, _ in Ticket.PRIORITY_CHOICES),
+            sum(resolved[day, priority] for priority, _ in Ticket.PRIORITY_CHOICES),
+            all_times
+        ))
+
+    # Days in the scanned range that were not dirty keep their rows
+    DailyTicketMetrics.objects.filter(date__in=days).delete()
+    DailyTicketMetrics.objects.bulk_create([row for row in metrics if row is not None])
+
+
+def build_metrics(day, priority, opened, resolved, response_times):
+    # Quiet days get no row; readers treat a missing row as zeros
+    if not (opened or resolved or response_times):
+        return None
+    return DailyTicketMetrics(
+        date=day,
+        priority=priority,
+        opened=opened,
+        resolved=resolved,
+        first_responses=len(response_times),
+        median_first_response_seconds=median(response_times) if response_times else None
+    )
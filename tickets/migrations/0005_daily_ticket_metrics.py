@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:13
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_resolved_at(apps, schema_editor):
+    # The real resolution time was never recorded; the last update is the closest we have
+    Ticket = apps.get_model('tickets', 'Ticket')
+    Ticket.objects.filter(status__in=['resolved', 'closed']).update(resolved_at=models.F('updated_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0004_ticket_filter_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyTicketMetrics',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('priority', models.CharField(max_length=10)),
+                ('opened', models.PositiveIntegerField(default=0)),
+                ('resolved', models.PositiveIntegerField(default=0)),
+                ('first_responses', models.PositiveIntegerField(default=0)),
+                ('median_first_response_seconds', models.FloatField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['date', 'priority'],
+            },
+        ),
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('value', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='resolved_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['resolved_at'], name='ticket_resolved_at_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyticketmetrics',
+            constraint=models.UniqueConstraint(fields=('date', 'priority'), name='unique_daily_ticket_metrics'),
+        ),
+        migrations.RunPython(backfill_resolved_at, migrations.RunPython.noop),
+    ]
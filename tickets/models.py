@@ -1,7 +1,23 @@
 from django.db import models
+from django.utils import timezone
 from accounts.models import User
 
 
+class TicketQuerySet(models.QuerySet):
+    def visible_to(self, user):
+        """Tickets the user may access through the API."""
+        # If admin, show all tickets
+        if user.user_type == 'admin':
+            return self.all()
+
+        # If support staff, show only assigned tickets
+        if user.user_type == 'support':
+            return self.filter(assigned_to=user)
+
+        # For regular users, show only their tickets
+        return self.filter(created_by=user)
+
+
 class Ticket(models.Model):
     STATUS_CHOICES = (
         ('open', 'Open'),
@@ -17,6 +33,11 @@ class Ticket(models.Model):
         ('urgent', 'Urgent'),
     )
 
+    # Statuses that count as resolved for resolved_at and reporting
+    RESOLVED_STATUSES = ('resolved', 'closed')
+    # Fields whose changes are published to the dashboard feeds, see chat/feed.py
+    TRACKED_FIELDS = ('status', 'assigned_to_id')
+
     title = models.CharField(max_length=255)
     description = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
@@ -26,6 +47,94 @@ class Ticket(models.Model):
                                     related_name='assigned_tickets')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='open')
     priority = models.CharField(max_length=10, choices=PRIORITY_CHOICES, default='medium')
+    resolved_at = models.DateTimeField(null=True, blank=True)
+
+    objects = TicketQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Backs cursor pagination in TicketViewSet
+            models.Index(fields=['created_at', 'id'], name='ticket_created_at_id_idx'),
+            # Backs ?ordering=updated_at and the updated_after/updated_before filters
+            models.Index(fields=['updated_at', 'id'], name='ticket_updated_at_id_idx'),
+            # Dashboard and API filters
+            models.Index(fields=['status', '-created_at'], name='ticket_status_created_idx'),
+            models.Index(fields=['priority', '-created_at'], name='ticket_priority_created_idx'),
+            models.Index(fields=['assigned_to', 'status'], name='ticket_assignee_status_idx'),
+            models.Index(fields=['created_by', '-created_at'], name='ticket_creator_created_idx'),
+            models.Index(fields=['-created_at'], name='ticket_unassigned_idx',
+                         condition=models.Q(assigned_to__isnull=True)),
+            # Backs the incremental scan in rollup_metrics
+            models.Index(fields=['resolved_at'], name='ticket_resolved_at_idx'),
+        ]
 
     def __str__(self):
         return self.title
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the loaded values, so a save can tell what it changed
+        loaded = dict(zip(field_names, values))
+        instance.loaded_values = {name: loaded[name] for name in cls.TRACKED_FIELDS if name in loaded}
+        return instance
+
+    def save(self, *args, **kwargs):
+        # Stamp the first move to a resolved status (resolved -> closed keeps it); reopening clears it
+        resolved = self.status in self.RESOLVED_STATUSES
+        if resolved != (self.resolved_at is not None):
+            if self.resolved_at is not None:
+                # The rollup must recount the day it was resolved on, see tickets/signals.py
+                self.previous_resolved_at = self.resolved_at
+            self.resolved_at = timezone.now() if resolved else None
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'resolved_at'}
+        super().save(*args, **kwargs)
+
+
+class DailyTicketMetrics(models.Model):
+    """
+    One day of ticket activity for one priority, maintained by the
+    rollup_metrics command. The row with priority ALL_PRIORITIES covers every
+    priority, since medians cannot be added up from the per-priority rows.
+    """
+    ALL_PRIORITIES = 'all'
+
+    date = models.DateField()
+    priority = models.CharField(max_length=10)
+    opened = models.PositiveIntegerField(default=0)
+    resolved = models.PositiveIntegerField(default=0)
+    # Tickets that got their first reply from someone other than the creator on this day
+    first_responses = models.PositiveIntegerField(default=0)
+    median_first_response_seconds = models.FloatField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['date', 'priority']
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'priority'], name='unique_daily_ticket_metrics'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.priority}"
+
+
+class RollupDirtyDay(models.Model):
+    """
+    A day the metrics rollup must recompute although nothing written since
+    its watermark falls on it: the day a reopened ticket had been resolved,
+    or the days a deleted ticket counted towards.
+    """
+    date = models.DateField()
+
+    def __str__(self):
+        return str(self.date)
+
+
+class RollupWatermark(models.Model):
+    """How far an incremental rollup has processed the raw tables."""
+    name = models.CharField(max_length=50, unique=True)
+    value = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name} @ {self.value}"
@@ -0,0 +1,13 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+from support_system.async_api import AsyncCursorPaginationMixin
+
+
+class TicketCursorPagination(AsyncCursorPaginationMixin, CursorPagination):
+    """
+    Keyset pagination over (created_at, id), newest tickets first. Avoids the
+    COUNT(*) and OFFSET scans of page-number pagination on deep pages.
+    """
+    ordering = ('-created_at', '-id')
+    page_size_query_param = 'page_size'
+    max_page_size = settings.API_MAX_PAGE_SIZE
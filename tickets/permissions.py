@@ -0,0 +1,47 @@
+"""
+Ticket access checks for code outside DRF views (e.g. WebSocket consumers).
+
+The rules mirror Ticket.objects.visible_to. A decision only depends on the
+user and the ticket's (creator, assignee) pair, so that pair is cached per
+ticket and shared by every user and connection: a reconnect storm costs
+cache reads, not ticket queries. Ticket saves and deletes drop the entry
+(see signals.py).
+"""
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from .models import Ticket
+
+TICKET_ACCESS_CACHE_TTL = getattr(settings, 'TICKET_ACCESS_CACHE_TTL', 60)
+
+
+def participants_key(ticket_id):
+    return f'ticket_participants:{ticket_id}'
+
+
+def load_participants(ticket_id):
+    # () marks a missing ticket, so repeated attempts on it are cached as well
+    return Ticket.objects.filter(id=ticket_id).values_list('created_by_id', 'assigned_to_id').first() or ()
+
+
+async def get_participants(ticket_id):
+    """Return (created_by_id, assigned_to_id) of the ticket, or None if it does not exist."""
+    participants = await cache.aget(participants_key(ticket_id))
+    if participants is None:
+        participants = await database_sync_to_async(load_participants)(ticket_id)
+        await cache.aset(participants_key(ticket_id), participants, TICKET_ACCESS_CACHE_TTL)
+    return tuple(participants) or None
+
+
+def forget_participants(ticket_id):
+    cache.delete(participants_key(ticket_id))
+
+
+def can_access(user, participants):
+    """Whether `user` may see the ticket with these (created_by_id, assigned_to_id)."""
+    created_by_id, assigned_to_id = participants
+    if user.user_type == 'admin':
+        return True
+    if user.user_type == 'support':
+        return assigned_to_id == user.id
+    return created_by_id == user.id
@@ -0,0 +1,106 @@
+"""
+Ticket statistics for reporting (GET /api/tickets/stats/).
+
+Everything is folded out of a single grouped query over
+(status, priority, assignee, age bucket) and cached per visibility scope.
+The cache is invalidated as a whole by bumping a version number whenever a
+ticket is saved or deleted (see signals.py), with a TTL as a backstop.
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, CharField, Count, Value, When
+from django.utils import timezone
+from .models import Ticket
+
+TICKET_STATS_CACHE_TTL = getattr(settings, 'TICKET_STATS_CACHE_TTL', 60)
+
+VERSION_KEY = 'ticket_stats:version'
+
+UNRESOLVED_STATUSES = ('open', 'in_progress')
+
+# Ticket age buckets as (label, minimum age), oldest first
+AGE_BUCKETS = (
+    ('over_30d', timedelta(days=30)),
+    ('7d_30d', timedelta(days=7)),
+    ('1d_7d', timedelta(days=1)),
+    ('under_1d', timedelta(0)),
+)
+
+
+def invalidate():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        # No version yet (or it was evicted); any value nobody has cached under will do
+        cache.set(VERSION_KEY, int(timezone.now().timestamp()), None)
+
+
+def visibility_scope(user):
+    """Cache scope matching Ticket.objects.visible_to(user)."""
+    if user.user_type == 'admin':
+        return 'all'
+    return f'{user.user_type}:{user.id}'
+
+
+def ticket_stats(user):
+    key = f'ticket_stats:{cache.get(VERSION_KEY, 0)}:{visibility_scope(user)}'
+    stats = cache.get(key)
+    if stats is None:
+        stats = compute_ticket_stats(Ticket.objects.visible_to(user))
+        cache.set(key, stats, TICKET_STATS_CACHE_TTL)
+    return stats
+
+
+def compute_ticket_stats(tickets):
+    now = timezone.now()
+    age = Case(
+        *[When(created_at__lte=now - min_age, then=Value(label)) for label, min_age in AGE_BUCKETS],
+        output_field=CharField()
+    )
+    rows = (
+        tickets.annotate(age=age)
+        .values('status', 'priority', 'assigned_to', 'assigned_to__first_name', 'assigned_to__last_name', 'age')
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+
+    by_status_priority = {
+        status: {priority: 0 for priority, _ in Ticket.PRIORITY_CHOICES}
+        for status, _ in Ticket.STATUS_CHOICES
+    }
+    age_buckets = {label: 0 for label, _ in reversed(AGE_BUCKETS)}
+    agents = {}
+    total = unassigned = 0
+
+    for row in rows:
+        count = row['count']
+        total += count
+        by_status_priority[row['status']][row['priority']] += count
+
+        unresolved = row['status'] in UNRESOLVED_STATUSES
+        if unresolved:
+            age_buckets[row['age']] += count
+
+        if row['assigned_to'] is None:
+            if unresolved:
+                unassigned += count
+            continue
+        agent = agents.setdefault(row['assigned_to'], {
+            'id': row['assigned_to'],
+            'name': f"{row['assigned_to__first_name']} {row['assigned_to__last_name']}".strip(),
+            'open': 0,
+            'resolved': 0
+        })
+        agent['open' if unresolved else 'resolved'] += count
+
+    return {
+        'total': total,
+        'by_status': {status: sum(counts.values()) for status, counts in by_status_priority.items()},
+        'by_status_priority': by_status_priority,
+        # Age of the tickets that are still open or in progress
+        'age_buckets': age_buckets,
+        'unassigned_open': unassigned,
+        'agents': sorted(agents.values(), key=lambda agent: (-agent['open'], agent['name'])),
+        'generated_at': now.isoformat()
+    }
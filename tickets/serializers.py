@@ -1,7 +1,40 @@
+from django.db import transaction
 from rest_framework import serializers
-from .models import Ticket
+from .models import DailyTicketMetrics, Ticket
+from accounts import stats
 from accounts.serializers import UserSerializer
-from accounts.models import User, UserProfile, SupportProfile
+from accounts.models import User
+
+
+def parse_field_list(value):
+    """Split a comma separated query parameter (e.g. `?fields=id,title`) into names."""
+    if not value:
+        return []
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+class SparseFieldsetMixin:
+    """
+    Serializer mixin implementing `?fields=` / `?expand=` sparse fieldsets.
+
+    Only `Meta.default_fields` are rendered unless the request names other
+    fields in `fields`; fields in `Meta.expandable_fields` are rendered only
+    when listed in `expand`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        request = self.context.get('request')
+        query_params = getattr(request, 'query_params', {})
+        expandable = set(self.Meta.expandable_fields)
+
+        requested = set(parse_field_list(query_params.get('fields')) or self.Meta.default_fields)
+        expanded = set(parse_field_list(query_params.get('expand'))) & expandable
+        allowed = (requested - expandable) | expanded | {'id'}
+
+        for field_name in set(self.fields) - allowed:
+            self.fields.pop(field_name)
 
 
 class TicketSerializer(serializers.ModelSerializer):
@@ -19,38 +52,39 @@ class TicketSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         user = self.context['request'].user
-        ticket = Ticket.objects.create(created_by=user, **validated_data)
 
-        # Update user profile statistics
-        if hasattr(user, 'profile'):
-            user.profile.tickets_submitted += 1
-            user.profile.save()
+        with transaction.atomic():
+            ticket = Ticket.objects.create(created_by=user, **validated_data)
+
+            # Update user and support staff statistics
+            stats.ticket_created(ticket)
+            stats.ticket_assigned(None, ticket.assigned_to_id, ticket.resolved_at is not None)
 
         return ticket
 
     def update(self, instance, validated_data):
         old_status = instance.status
-        old_assigned_to = instance.assigned_to
-
-        # Update the ticket
-        instance = super().update(instance, validated_data)
-
-        # Update support staff statistics if assignment or status changed
-        if 'assigned_to' in validated_data and validated_data['assigned_to'] != old_assigned_to:
-            # If previously assigned to someone, decrease their count
-            if old_assigned_to and hasattr(old_assigned_to, 'support_profile'):
-                old_assigned_to.support_profile.tickets_assigned -= 1
-                old_assigned_to.support_profile.save()
-
-            # If newly assigned to someone, increase their count
-            if instance.assigned_to and hasattr(instance.assigned_to, 'support_profile'):
-                instance.assigned_to.support_profile.tickets_assigned += 1
-                instance.assigned_to.support_profile.save()
-
-        # Update resolved tickets count if status changed to resolved
-        if 'status' in validated_data and validated_data['status'] == 'resolved' and old_status != 'resolved':
-            if instance.assigned_to and hasattr(instance.assigned_to, 'support_profile'):
-                instance.assigned_to.support_profile.tickets_resolved += 1
-                instance.assigned_to.support_profile.save()
-
-        return instance
\ No newline at end of file
+        old_assigned_to_id = instance.assigned_to_id
+
+        with transaction.atomic():
+            # Update the ticket
+            instance = super().update(instance, validated_data)
+
+            # Update support staff statistics if assignment or status changed
+            stats.ticket_assigned(old_assigned_to_id, instance.assigned_to_id, old_status in Ticket.RESOLVED_STATUSES)
+            stats.ticket_status_changed(instance, old_status)
+
+        return instance
+
+class TicketListSerializer(SparseFieldsetMixin, TicketSerializer):
+    """Compact ticket representation for the list endpoint."""
+
+    class Meta(TicketSerializer.Meta):
+        default_fields = ['id', 'title', 'status', 'priority', 'assigned_to']
+        expandable_fields = ['created_by_details', 'assigned_to_details']
+
+
+class DailyTicketMetricsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DailyTicketMetrics
+        fields = ['date', 'priority', 'opened', 'resolved', 'first_responses', 'median_first_response_seconds']
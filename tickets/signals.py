@@ -0,0 +1,34 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from . import metrics, permissions, reporting
+from .models import Ticket
+
+
+@receiver(post_save, sender=Ticket)
+@receiver(post_delete, sender=Ticket)
+def invalidate_ticket_stats(sender, **kwargs):
+    # After commit, so a concurrent request cannot re-cache the pre-commit numbers. A cache outage
+    # is logged instead of failing a request whose write is already committed.
+    transaction.on_commit(reporting.invalidate, robust=True)
+
+
+@receiver(post_save, sender=Ticket)
+@receiver(post_delete, sender=Ticket)
+def invalidate_ticket_participants(sender, instance, **kwargs):
+    # Reassignment changes who may join the ticket's chat
+    transaction.on_commit(lambda: permissions.forget_participants(instance.pk), robust=True)
+
+
+@receiver(post_save, sender=Ticket)
+def mark_reopened_metrics_day(sender, instance, **kwargs):
+    # Reopening clears resolved_at, so the rollup would not find the day it counted as resolved
+    previous_resolved_at = instance.__dict__.pop('previous_resolved_at', None)
+    if previous_resolved_at is not None:
+        metrics.mark_dirty(previous_resolved_at)
+
+
+@receiver(pre_delete, sender=Ticket)
+def mark_deleted_metrics_days(sender, instance, **kwargs):
+    # Before the delete, while the ticket's messages still exist
+    metrics.mark_dirty(instance.created_at, instance.resolved_at, metrics.first_response(instance))
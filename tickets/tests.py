@@ -0,0 +1,301 @@
+import itertools
+import unittest
+from datetime import timedelta
+from unittest import mock
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+from accounts.authentication import user_cache
+from accounts.models import SupportProfile, User, UserProfile
+from support_system import async_api
+from chat.models import Message
+from . import metrics
+from .models import DailyTicketMetrics, Ticket
+
+PAGE_SIZES = (1, 5, 20)
+EXPANSIONS = ('', 'created_by_details', 'created_by_details,assigned_to_details')
+
+
+class TicketReadQueryBudgetMixin:
+    """
+    Query counts of the ticket endpoints must not grow with the number of
+    tickets rendered: nested users and their profiles come from JOINs.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(email='admin@example.com', password='pass', first_name='Ada',
+                                             last_name='Admin', user_type='admin')
+        cls.agents = []
+        for i in range(3):
+            agent = User.objects.create_user(email=f'agent{i}@example.com', password='pass', first_name='Agent',
+                                             last_name=str(i), user_type='support')
+            SupportProfile.objects.create(user=agent)
+            cls.agents.append(agent)
+        customers = []
+        for i in range(4):
+            customer = User.objects.create_user(email=f'customer{i}@example.com', password='pass',
+                                                first_name='Customer', last_name=str(i), user_type='user')
+            UserProfile.objects.create(user=customer)
+            customers.append(customer)
+        cls.tickets = [
+            Ticket.objects.create(title=f'Ticket {i}', description='Description', created_by=customers[i % 4],
+                                  assigned_to=cls.agents[i % 3] if i % 5 else None)
+            for i in range(25)
+        ]
+
+    def assert_list_queries(self, expected, expand):
+        for page_size in PAGE_SIZES:
+            with self.subTest(page_size=page_size, expand=expand):
+                with self.assertNumQueries(expected):
+                    response = self.client.get('/api/tickets/', {'page_size': page_size, 'expand': expand})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.json()['results']), page_size)
+
+    def test_list(self):
+        for expand in EXPANSIONS:
+            self.assert_list_queries(1, expand)
+
+    def test_list_next_page(self):
+        next_url = self.client.get('/api/tickets/', {'page_size': 5}).json()['next']
+        with self.assertNumQueries(1):
+            response = self.client.get(next_url)
+        self.assertEqual(len(response.json()['results']), 5)
+
+    def test_retrieve(self):
+        for ticket in (self.tickets[0], self.tickets[1]):
+            with self.subTest(assigned=ticket.assigned_to_id is not None):
+                with self.assertNumQueries(1):
+                    response = self.client.get(f'/api/tickets/{ticket.id}/')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json()['created_by_details']['id'], ticket.created_by_id)
+
+
+class TicketQueryBudgetTests(TicketReadQueryBudgetMixin, APITestCase):
+    """The DRF viewset."""
+
+    def setUp(self):
+        patcher = mock.patch.object(async_api, 'ASYNC_API_VIEWS', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client.force_authenticate(self.admin)
+
+    def test_change_status(self):
+        ticket = self.tickets[1]
+        with self.assertNumQueries(6):
+            response = self.client.post(f'/api/tickets/{ticket.id}/change_status/', {'status': 'resolved'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'resolved')
+
+    def test_assign(self):
+        ticket = self.tickets[1]
+        with self.assertNumQueries(8):
+            response = self.client.post(f'/api/tickets/{ticket.id}/assign/',
+                                        {'support_user_id': self.agents[2].id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['assigned_to_details']['id'], self.agents[2].id)
+
+
+class AsyncTicketQueryBudgetTests(TicketReadQueryBudgetMixin, APITestCase):
+    """The same budgets for the async GET views, authenticated with a JWT from the warm user cache."""
+
+    def setUp(self):
+        patcher = mock.patch.object(async_api, 'ASYNC_API_VIEWS', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        user_cache.clear()
+        self.addCleanup(user_cache.clear)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.admin)}')
+        # Loads the user into the authentication cache
+        self.client.get('/api/auth/profile/')
+
+
+# Stands for the requesting user's id in filter values
+ME = '<me>'
+
+# API filters and the index each must use (None: any index)
+FILTER_INDEXES = (
+    ({'status': 'open'}, 'ticket_status_created_idx'),
+    ({'priority': 'high'}, 'ticket_priority_created_idx'),
+    ({'created_by': ME}, 'ticket_creator_created_idx'),
+    ({'created_after': '2020-01-01T00:00:00Z'}, 'ticket_created_at_id_idx'),
+    ({'ordering': 'updated_at'}, 'ticket_updated_at_id_idx'),
+    ({'updated_after': '2020-01-01T00:00:00Z', 'ordering': 'updated_at'}, 'ticket_updated_at_id_idx'),
+    ({'assigned_to': ME}, None),
+    ({'unassigned': 'true'}, None),
+    ({'assigned': 'unassigned'}, None),
+)
+
+
+class TicketFilterIndexMixin:
+    """
+    Every ticket filter, alone and in pairs, is answered through an index
+    rather than a table scan. The plans are taken for the SQL the API and
+    dashboard actually run.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(email='admin@example.com', password='pass', first_name='Ada',
+                                             last_name='Admin', user_type='admin')
+        cls.agent = User.objects.create_user(email='agent@example.com', password='pass', first_name='Agent',
+                                             last_name='Smith', user_type='support')
+        SupportProfile.objects.create(user=cls.agent)
+        Ticket.objects.bulk_create([
+            Ticket(title=f'Ticket {i}', description='Description', created_by=cls.admin,
+                   assigned_to=cls.agent if i % 2 else None, status=Ticket.STATUS_CHOICES[i % 4][0],
+                   priority=Ticket.PRIORITY_CHOICES[i % 4][0])
+            for i in range(50)
+        ])
+
+    def setUp(self):
+        patcher = mock.patch.object(async_api, 'ASYNC_API_VIEWS', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def page_query(self, url, params, user):
+        """The SQL of the query loading the page of tickets `url` shows for `params`."""
+        # The API authenticates with JWTs, the dashboard with the session
+        self.client.force_authenticate(user)
+        self.client.force_login(user)
+        params = {key: user.id if value == ME else value for key, value in params.items()}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        # Selects from tickets_ticket itself (not in a subquery) and is limited to one page
+        pages = [query['sql'] for query in queries
+                 if query['sql'].split(' FROM ', 1)[-1].startswith('"tickets_ticket"') and ' LIMIT ' in query['sql']]
+        self.assertEqual(len(pages), 1, pages)
+        return pages[0]
+
+    def assert_plan(self, url, params, index, user):
+        plan = self.explain(self.page_query(url, params, user))
+        self.assertFalse(self.is_table_scan(plan), plan)
+        if index is not None:
+            self.assertIn(index, plan)
+
+    def test_filters(self):
+        for params, index in FILTER_INDEXES:
+            with self.subTest(params=params):
+                self.assert_plan('/api/tickets/', params, index, self.admin)
+
+    def test_filter_pairs(self):
+        for (first, _), (second, _) in itertools.combinations(FILTER_INDEXES, 2):
+            params = {**first, **second}
+            with self.subTest(params=params):
+                self.assert_plan('/api/tickets/', params, None, self.admin)
+
+    def test_support_staff_filters(self):
+        # The API only shows support staff their assigned tickets
+        for params in ({}, {'status': 'open'}):
+            with self.subTest(params=params):
+                self.assert_plan('/api/tickets/', params, None, self.agent)
+
+    def test_dashboard(self):
+        for params, index in (({}, 'ticket_created_at_id_idx'), ({'status': 'open'}, 'ticket_status_created_idx'),
+                              ({'assigned': 'me'}, None), ({'assigned': 'unassigned'}, None)):
+            with self.subTest(params=params):
+                self.assert_plan('/dashboard/', params, index, self.agent)
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'SQLite query plans')
+class SQLiteTicketFilterIndexTests(TicketFilterIndexMixin, APITestCase):
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return '\n'.join(row[-1] for row in cursor.fetchall())
+
+    def is_table_scan(self, plan):
+        return any(line.startswith('SCAN tickets_ticket') and 'USING' not in line for line in plan.splitlines())
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'PostgreSQL query plans')
+class PostgreSQLTicketFilterIndexTests(TicketFilterIndexMixin, APITestCase):
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            # The test tables are tiny; without this a sequential scan always wins on cost
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(f'EXPLAIN {sql}')
+            return '\n'.join(row[0] for row in cursor.fetchall())
+
+    def is_table_scan(self, plan):
+        return 'Seq Scan on tickets_ticket' in plan
+
+
+class DailyMetricsRollupTests(TestCase):
+    """Incremental rollups agree with a full recompute after tickets leave an older day."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user(email='customer@example.com', password='pass',
+                                                first_name='Customer', last_name='One', user_type='user')
+        cls.agent = User.objects.create_user(email='agent@example.com', password='pass', first_name='Agent',
+                                             last_name='Smith', user_type='support')
+
+    def setUp(self):
+        # A ticket opened, answered and resolved ten days ago, already rolled up
+        self.day = timezone.localdate() - timedelta(days=10)
+        moment = timezone.now() - timedelta(days=10)
+        self.ticket = Ticket.objects.create(title='Printer', description='On fire', created_by=self.customer,
+                                            status='resolved')
+        message = Message.objects.create(ticket=self.ticket, sender=self.agent, content='Try turning it off')
+        Ticket.objects.filter(pk=self.ticket.pk).update(created_at=moment, resolved_at=moment)
+        Message.objects.filter(pk=message.pk).update(timestamp=moment)
+        self.ticket.refresh_from_db()
+        metrics.rollup(full=True)
+        self.assertEqual(self.day_metrics(), (1, 1, 1))
+
+    def day_metrics(self):
+        row = DailyTicketMetrics.objects.filter(date=self.day, priority=DailyTicketMetrics.ALL_PRIORITIES).first()
+        return (row.opened, row.resolved, row.first_responses) if row else None
+
+    def assert_rollups_agree(self, expected):
+        self.assertIn(self.day, metrics.rollup())
+        self.assertEqual(self.day_metrics(), expected)
+        metrics.rollup(full=True)
+        self.assertEqual(self.day_metrics(), expected)
+
+    def test_reopened_ticket(self):
+        self.ticket.status = 'open'
+        self.ticket.save()
+        self.assert_rollups_agree((1, 0, 1))
+
+    def test_deleted_ticket(self):
+        self.ticket.delete()
+        self.assert_rollups_agree(None)
+
+    def test_marked_days_are_processed_once(self):
+        self.ticket.status = 'open'
+        self.ticket.save()
+        metrics.rollup()
+        self.assertNotIn(self.day, metrics.rollup())
+
+
+class DailyTicketMetricsListTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.agent = User.objects.create_user(email='agent@example.com', password='pass', first_name='Agent',
+                                             last_name='Smith', user_type='support')
+
+    def setUp(self):
+        self.client.force_authenticate(self.agent)
+
+    def test_valid_arguments(self):
+        for params in ({}, {'from': '2024-02-01', 'to': '2024-02-29'}, {'priority': 'urgent'}, {'priority': 'all'}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get('/api/metrics/daily/', params).status_code, 200)
+
+    def test_invalid_arguments(self):
+        for params in ({'from': '2024-02-30'}, {'to': '2024-13-01'}, {'from': 'yesterday'},
+                       {'from': '2024-03-01', 'to': '2024-02-01'}, {'from': '2020-01-01', 'to': '2024-01-01'},
+                       {'priority': 'critical'}):
+            with self.subTest(params=params):
+                response = self.client.get('/api/metrics/daily/', params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.json())
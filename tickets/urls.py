@@ -1,10 +1,24 @@
-from django.urls import path, include
+from django.urls import path, include, re_path
 from rest_framework.routers import DefaultRouter
-from .views import TicketViewSet
+from support_system.async_api import read_view
+from .views import DailyTicketMetricsList, TicketViewSet, ticket_detail_async, ticket_list_async
 
 router = DefaultRouter()
 router.register(r'tickets', TicketViewSet, basename='ticket')
 
+ASYNC_READ_VIEWS = {
+    'ticket-list': ticket_list_async,
+    'ticket-detail': ticket_detail_async,
+}
+
+# GETs on the list and detail routes go to the async views; the .json style format suffix routes stay sync
+router_urls = [
+    re_path(url.pattern.regex.pattern, read_view(ASYNC_READ_VIEWS[url.name], url.callback), name=url.name)
+    if url.name in ASYNC_READ_VIEWS and 'format' not in url.pattern.regex.groupindex else url
+    for url in router.urls
+]
+
 urlpatterns = [
-    path('', include(router.urls)),
+    path('', include(router_urls)),
+    path('metrics/daily/', DailyTicketMetricsList.as_view(), name='daily-metrics'),
 ]
\ No newline at end of file
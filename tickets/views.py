@@ -1,9 +1,22 @@
-from rest_framework import viewsets, permissions, status
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework import generics, viewsets, permissions, status
 from rest_framework.decorators import action
+from rest_framework.filters import OrderingFilter
 from rest_framework.response import Response
-from .models import Ticket
-from .serializers import TicketSerializer
+from . import reporting
+from .filters import TicketFilterSet
+from .models import DailyTicketMetrics, Ticket
+from .pagination import TicketCursorPagination
+from .serializers import DailyTicketMetricsSerializer, TicketSerializer, TicketListSerializer, parse_field_list
+from accounts import stats
+from accounts.models import User
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 from django.shortcuts import get_object_or_404
+from support_system.async_api import alist, aretrieve, async_api_view, setup_view
 
 
 class IsOwnerOrSupport(permissions.BasePermission):
@@ -16,72 +29,159 @@ class IsOwnerOrSupport(permissions.BasePermission):
         return obj.created_by == request.user or request.user.user_type in ['support', 'admin']
 
 
+class IsSupportStaff(permissions.BasePermission):
+    """
+    Only support staff and admins
+    """
+
+    def has_permission(self, request, view):
+        return request.user.user_type in ['support', 'admin']
+
+
+# Everything TicketSerializer renders through the nested UserSerializers
+TICKET_RELATED_FIELDS = (
+    'created_by__profile',
+    'created_by__support_profile',
+    'assigned_to__profile',
+    'assigned_to__support_profile',
+)
+
+
 class TicketViewSet(viewsets.ModelViewSet):
     serializer_class = TicketSerializer
     permission_classes = [permissions.IsAuthenticated, IsOwnerOrSupport]
+    pagination_class = TicketCursorPagination
+    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    filterset_class = TicketFilterSet
+    # Only columns with a (column, id) index; ?ordering= also drives the pagination cursor
+    ordering_fields = ['created_at', 'updated_at']
+    ordering = TicketCursorPagination.ordering
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return TicketListSerializer
+        return TicketSerializer
+
+    def get_related_fields(self):
+        if self.action != 'list':
+            return TICKET_RELATED_FIELDS
+
+        # The compact list only renders nested users that were asked for via ?expand=
+        expand = parse_field_list(self.request.query_params.get('expand'))
+        return [field for field in TICKET_RELATED_FIELDS if f"{field.split('__')[0]}_details" in expand]
 
     def get_queryset(self):
-        user = self.request.user
+        return Ticket.objects.visible_to(self.request.user).select_related(*self.get_related_fields())
 
-        # If admin, show all tickets
-        if user.user_type == 'admin':
-            return Ticket.objects.all()
-        
-        # If support staff, show only assigned tickets
-        if user.user_type == 'support':
-            return Ticket.objects.filter(assigned_to=user)
+    def get_refreshed_ticket(self, ticket):
+        # Re-read after an update so the response reflects the new statistics
+        return Ticket.objects.select_related(*TICKET_RELATED_FIELDS).get(pk=ticket.pk)
 
-        # For regular users, show only their tickets
-        return Ticket.objects.filter(created_by=user)
+    @action(detail=False, methods=['get'], url_path='stats')
+    def statistics(self, request):
+        # Counts by status x priority, per agent and by age; cached, see tickets/reporting.py
+        return Response(reporting.ticket_stats(request.user))
 
     @action(detail=True, methods=['post'])
     def change_status(self, request, pk=None):
         ticket = self.get_object()
-        status = request.data.get('status')
+        new_status = request.data.get('status')
 
-        if status not in [choice[0] for choice in Ticket.STATUS_CHOICES]:
+        if new_status not in [choice[0] for choice in Ticket.STATUS_CHOICES]:
             return Response({'error': 'Invalid status'}, status=status.HTTP_400_BAD_REQUEST)
 
-        ticket.status = status
-        ticket.save()
+        old_status = ticket.status
+        with transaction.atomic():
+            ticket.status = new_status
+            ticket.save(update_fields=['status', 'updated_at'])
 
-        # Update support statistics if status changed to resolved
-        if status == 'resolved' and ticket.assigned_to and hasattr(ticket.assigned_to, 'support_profile'):
-            ticket.assigned_to.support_profile.tickets_resolved += 1
-            ticket.assigned_to.support_profile.save()
+            # Update support statistics if status changed to resolved
+            stats.ticket_status_changed(ticket, old_status)
 
-        return Response(TicketSerializer(ticket).data)
+        return Response(TicketSerializer(self.get_refreshed_ticket(ticket)).data)
 
     @action(detail=True, methods=['post'])
     def assign(self, request, pk=None):
         ticket = self.get_object()
         support_user_id = request.data.get('support_user_id')
 
+        support_user = None
         if support_user_id:
             try:
                 support_user = User.objects.get(id=support_user_id, user_type='support')
+            except User.DoesNotExist:
+                return Response({'error': 'Support user not found'}, status=status.HTTP_404_NOT_FOUND)
 
-                # Update old support staff statistics if any
-                if ticket.assigned_to and hasattr(ticket.assigned_to, 'support_profile'):
-                    ticket.assigned_to.support_profile.tickets_assigned -= 1
-                    ticket.assigned_to.support_profile.save()
+        # Assign the ticket (or unassign it when no support user was given)
+        old_assigned_to_id = ticket.assigned_to_id
+        with transaction.atomic():
+            ticket.assigned_to = support_user
+            ticket.save(update_fields=['assigned_to', 'updated_at'])
 
-                # Update new support staff statistics
-                ticket.assigned_to = support_user
-                if hasattr(support_user, 'support_profile'):
-                    support_user.support_profile.tickets_assigned += 1
-                    support_user.support_profile.save()
+            # Move the assignment count from the old to the new support staff
+            stats.ticket_assigned(old_assigned_to_id, ticket.assigned_to_id, ticket.resolved_at is not None)
 
-                ticket.save()
-                return Response(TicketSerializer(ticket).data)
-            except User.DoesNotExist:
-                return Response({'error': 'Support user not found'}, status=status.HTTP_404_NOT_FOUND)
-        else:
-            # Unassign ticket
-            if ticket.assigned_to and hasattr(ticket.assigned_to, 'support_profile'):
-                ticket.assigned_to.support_profile.tickets_assigned -= 1
-                ticket.assigned_to.support_profile.save()
-
-            ticket.assigned_to = None
-            ticket.save()
-            return Response(TicketSerializer(ticket).data)
+        return Response(TicketSerializer(self.get_refreshed_ticket(ticket)).data)
+
+
+
+# Async GETs for the ticket list and detail URLs, see support_system/async_api.py
+@async_api_view(TicketViewSet)
+async def ticket_list_async(request):
+    return await alist(setup_view(TicketViewSet, request, action='list'))
+
+
+@async_api_view(TicketViewSet)
+async def ticket_detail_async(request, pk):
+    return await aretrieve(setup_view(TicketViewSet, request, action='retrieve', pk=pk))
+
+
+# Longest date range a single metrics request may cover
+METRICS_MAX_DAYS = getattr(settings, 'METRICS_MAX_DAYS', 366)
+
+
+class DailyTicketMetricsList(generics.ListAPIView):
+    """
+    Daily rollups from `manage.py rollup_metrics`, oldest first. Query
+    parameters: from, to (YYYY-MM-DD, default the last 30 days) and priority
+    (a priority or `all`, the default). Days without activity are omitted.
+    """
+    serializer_class = DailyTicketMetricsSerializer
+    permission_classes = [permissions.IsAuthenticated, IsSupportStaff]
+    pagination_class = None
+
+    PRIORITIES = {priority for priority, _ in Ticket.PRIORITY_CHOICES} | {DailyTicketMetrics.ALL_PRIORITIES}
+
+    def date_param(self, name):
+        value = self.request.query_params.get(name)
+        if not value:
+            return None
+        # parse_date returns None for malformed and raises ValueError for impossible dates
+        parsed = parse_date(value)
+        if parsed is None:
+            raise ValueError(value)
+        return parsed
+
+    def list(self, request, *args, **kwargs):
+        try:
+            date_to = self.date_param('to') or timezone.localdate()
+            date_from = self.date_param('from') or date_to - timedelta(days=29)
+        except ValueError:
+            return Response({'error': 'from and to must be dates (YYYY-MM-DD)'}, status=status.HTTP_400_BAD_REQUEST)
+        priority = request.query_params.get('priority') or DailyTicketMetrics.ALL_PRIORITIES
+        if priority not in self.PRIORITIES:
+            return Response({'error': f'priority must be one of {", ".join(sorted(self.PRIORITIES))}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        if date_from > date_to:
+            return Response({'error': 'from must not be after to'}, status=status.HTTP_400_BAD_REQUEST)
+        if (date_to - date_from).days >= METRICS_MAX_DAYS:
+            return Response({'error': f'at most {METRICS_MAX_DAYS} days per request'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        self.date_range = (date_from, date_to)
+        self.priority = priority
+        return super().list(request, *args, **kwargs)
+
+    def get_queryset(self):
+        return DailyTicketMetrics.objects.filter(date__range=self.date_range, priority=self.priority)